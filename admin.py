@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User, Group
+from .exports import export_action
 from .models import Profile
+from .paginators import KeysetPaginator
 
 # Import custom admin site
 from nutrilogic.admin_customization import admin_site
@@ -22,7 +24,17 @@ class ProfileInline(admin.StackedInline):
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'age', 'gender', 'height', 'weight', 'daily_calorie_target', 'activity_level', 'goal']
     list_filter = ['gender', 'activity_level', 'goal']
-    search_fields = ['user__username', 'user__email', 'user__first_name', 'user__last_name']
+    list_select_related = ['user']
+    # Prefix matches (istartswith), which an index on UPPER(<field>) can
+    # serve, unlike a leading-wildcard icontains
+    search_fields = ['^user__username', '^user__email', '^user__first_name', '^user__last_name']
+    # Estimated/cached counts and primary-key seeks for deep pages
+    paginator = KeysetPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    # Whole-table and date-filtered extracts: /admin/export/<source>/ or
+    # manage.py export_data
+    actions = [export_action('profiles', 'csv'), export_action('profiles', 'jsonl')]
     readonly_fields = ['daily_calorie_target']
     fieldsets = (
         ('User Information', {
@@ -1,3 +1,5 @@
+from functools import update_wrapper
+
 from django.contrib import admin
 from django.utils.html import format_html
 from django.templatetags.static import static
@@ -23,9 +25,123 @@ class NutriLogicAdminSite(admin.AdminSite):
         custom_urls = [
             path('', self.admin_view(self.custom_index), name='index'),
             path('logout/', self.custom_logout, name='logout'),
+            path('models/status/', self.admin_view(self.model_status), name='model_status'),
+            path('dashboard/<str:name>/', self.async_admin_view(self.dashboard_chart), name='dashboard_chart'),
+            path('export/<str:name>/', self.admin_view(self.export_data), name='export_data'),
         ]
         return custom_urls + urls
     
+    def async_admin_view(self, view):
+        """
+        admin_view for async views: the same staff check, awaited, without the
+        sync-only wrappers. Views must be read-only (GET/HEAD).
+        """
+        async def inner(request, *args, **kwargs):
+            user = await request.auser()
+            if not (user.is_active and user.is_staff):
+                from django.contrib.auth.views import redirect_to_login
+                return redirect_to_login(
+                    request.get_full_path(),
+                    reverse('admin:login', current_app=self.name),
+                )
+            return await view(request, *args, **kwargs)
+        
+        return update_wrapper(inner, view)
+    
+    async def dashboard_chart(self, request, name):
+        """
+        One dashboard widget (a chart dataset, or 'stats') as JSON.
+        
+        Accepts the index's ?days= / ?start=&end= range and ?refresh=1, and
+        answers conditional GETs: the weak ETag covers the data, so an
+        unchanged widget is a 304 even after it was recomputed.
+        """
+        from django.core.serializers.json import DjangoJSONEncoder
+        from django.http import Http404, HttpResponseNotAllowed, JsonResponse
+        from django.utils.cache import get_conditional_response, patch_cache_control
+        from .admin_dashboard import acached_widget, request_date_range
+        import hashlib
+        import json
+        
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        
+        start, end = request_date_range(request)
+        try:
+            widget = await acached_widget(start, end, name, refresh=request.GET.get('refresh') == '1')
+        except KeyError:
+            raise Http404(f'No dashboard chart {name!r}')
+        
+        data = json.dumps([name, start, end, widget['data']], cls=DjangoJSONEncoder, sort_keys=True)
+        etag = f'W/"{hashlib.sha1(data.encode()).hexdigest()}"'
+        response = get_conditional_response(request, etag=etag) or JsonResponse({
+            'name': name,
+            'start': start,
+            'end': end,
+            'data': widget['data'],
+            'computed_at': widget['computed_at'],
+            'stale': widget['stale'],
+        })
+        response.headers['ETag'] = etag
+        # Browsers keep the payload but revalidate it on every load
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    
+    def model_status(self, request):
+        """
+        Model versions served by the worker that handles this request (JSON).
+        """
+        from django.http import JsonResponse
+        from health.model_registry import model_registry
+        
+        return JsonResponse(model_registry.status())
+    
+    def export_data(self, request, name):
+        """
+        Stream a whole table as CSV (or ?format=jsonl), optionally ?gzip=1.
+        
+        ?since=&until= (YYYY-MM-DD) restrict the rows by date; ?after=<id>
+        resumes an interrupted download after the last id received.
+        """
+        from django.core.exceptions import PermissionDenied
+        from django.http import Http404, HttpResponseBadRequest
+        from users.exports import EXPORT_SOURCES, FORMATS, streaming_response
+        
+        source = EXPORT_SOURCES.get(name)
+        if source is None:
+            raise Http404(f'Unknown export {name!r}')
+        opts = source.model._meta
+        if not request.user.has_perm(f'{opts.app_label}.view_{opts.model_name}'):
+            raise PermissionDenied
+        
+        fmt = request.GET.get('format', 'csv')
+        try:
+            since, until = (
+                self.export_date(request.GET[key]) if request.GET.get(key) else None for key in ('since', 'until')
+            )
+            after = int(request.GET['after']) if request.GET.get('after') else None
+        except ValueError:
+            return HttpResponseBadRequest('since/until must be YYYY-MM-DD dates and after an id')
+        if fmt not in FORMATS:
+            return HttpResponseBadRequest(f"format must be one of {', '.join(FORMATS)}")
+        
+        return streaming_response(
+            source, fmt, source.queryset(since=since, until=until, after=after),
+            # A resumed download continues the first one, without a header
+            header=after is None,
+            compress=request.GET.get('gzip') == '1',
+        )
+    
+    @staticmethod
+    def export_date(value):
+        from django.utils.dateparse import parse_date
+        
+        # parse_date returns None for malformed values, raises for impossible ones
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        return day
+    
     def custom_logout(self, request):
         """
         Custom logout view that accepts both GET and POST requests.
@@ -50,131 +166,47 @@ class NutriLogicAdminSite(admin.AdminSite):
         """
         Custom index view with statistics dashboard and visualizations.
         """
-        from django.contrib.auth.models import User
-        from meals.models import MealPlan, Food
-        from health.models import HealthPrediction
-        from premium.models import Subscription, Payment
-        from users.models import Profile
-        from django.db.models import Sum, Count, Q
-        from django.utils import timezone
-        from datetime import timedelta
+        from .admin_dashboard import ASYNC_CHARTS, DashboardData, cached_widgets, request_date_range
         import json
         
         app_list = self.get_app_list(request)
         
-        # Calculate statistics
-        stats = {
-            'total_users': User.objects.count(),
-            'total_meal_plans': MealPlan.objects.count(),
-            'total_predictions': HealthPrediction.objects.count(),
-            'active_subscriptions': Subscription.objects.filter(status='A').count(),
-            'total_foods': Food.objects.count(),
-            'total_revenue': Payment.objects.filter(status='S').aggregate(
-                total=Sum('amount')
-            )['total'] or 0,
-        }
-        
-        # User Activity Analysis - Goal Distribution
-        goal_stats = Profile.objects.values('goal').annotate(count=Count('goal')).order_by('goal')
-        goal_data = {
-            'labels': [dict(Profile.GOAL_CHOICES).get(item['goal'], 'Unknown') for item in goal_stats],
-            'values': [item['count'] for item in goal_stats],
-        }
-        
-        # User Activity Analysis - Activity Level Distribution
-        activity_stats = Profile.objects.values('activity_level').annotate(count=Count('activity_level')).order_by('activity_level')
-        activity_data = {
-            'labels': [dict(Profile.ACTIVITY_LEVEL_CHOICES).get(item['activity_level'], 'Unknown') for item in activity_stats],
-            'values': [item['count'] for item in activity_stats],
-        }
-        
-        # Gender Distribution
-        gender_stats = Profile.objects.exclude(gender__isnull=True).values('gender').annotate(count=Count('gender')).order_by('gender')
-        gender_data = {
-            'labels': [dict(Profile.GENDER_CHOICES).get(item['gender'], 'Unknown') for item in gender_stats],
-            'values': [item['count'] for item in gender_stats],
-        }
+        # Totals, distributions and the trends over ?days= / ?start=&end=
+        start, end = request_date_range(request)
+        query = request.GET.copy()
+        query.pop('refresh', None)
         
-        # Health Prediction Risk Distribution
-        risk_stats = HealthPrediction.objects.values('risk_level').annotate(count=Count('risk_level')).order_by('risk_level')
-        risk_data = {
-            'labels': [dict(HealthPrediction.RISK_LEVELS).get(item['risk_level'], 'Unknown') for item in risk_stats],
-            'values': [item['count'] for item in risk_stats],
-        }
-        
-        # Health Condition Type Distribution
-        condition_stats = HealthPrediction.objects.values('condition_type').annotate(count=Count('condition_type')).order_by('condition_type')
-        condition_data = {
-            'labels': [dict(HealthPrediction.CONDITION_TYPES).get(item['condition_type'], 'Unknown') for item in condition_stats],
-            'values': [item['count'] for item in condition_stats],
-        }
-        
-        # Subscription Status Distribution
-        subscription_stats = Subscription.objects.values('status').annotate(count=Count('status')).order_by('status')
-        subscription_choices = {
-            'A': 'Active',
-            'C': 'Cancelled',
-            'E': 'Expired',
-            'P': 'Pending',
-        }
-        subscription_data = {
-            'labels': [subscription_choices.get(item['status'], 'Unknown') for item in subscription_stats],
-            'values': [item['count'] for item in subscription_stats],
-        }
-        
-        # User Registration Trend (Last 7 days)
-        today = timezone.now().date()
-        dates = [(today - timedelta(days=i)).strftime('%b %d') for i in range(6, -1, -1)]
-        user_trend_data = {
-            'labels': dates,
-            'values': [
-                User.objects.filter(date_joined__date=today - timedelta(days=i)).count()
-                for i in range(6, -1, -1)
-            ]
-        }
-        
-        # Meal Plans Created (Last 7 days)
-        meal_trend_data = {
-            'labels': dates,
-            'values': [
-                MealPlan.objects.filter(date=today - timedelta(days=i)).count()
-                for i in range(6, -1, -1)
-            ]
-        }
-        
-        # Payment Status Distribution
-        payment_stats = Payment.objects.values('status').annotate(count=Count('status')).order_by('status')
-        payment_choices = {
-            'P': 'Pending',
-            'S': 'Success',
-            'F': 'Failed',
-        }
-        payment_data = {
-            'labels': [payment_choices.get(item['status'], 'Unknown') for item in payment_stats],
-            'values': [item['count'] for item in payment_stats],
-        }
-        
-        # Convert to JSON for JavaScript
-        chart_data = {
-            'goal_data': json.dumps(goal_data),
-            'activity_data': json.dumps(activity_data),
-            'gender_data': json.dumps(gender_data),
-            'risk_data': json.dumps(risk_data),
-            'condition_data': json.dumps(condition_data),
-            'subscription_data': json.dumps(subscription_data),
-            'user_trend_data': json.dumps(user_trend_data),
-            'meal_trend_data': json.dumps(meal_trend_data),
-            'payment_data': json.dumps(payment_data),
+        # Each widget's JSON endpoint, with the same range
+        chart_urls = {
+            name: f"{reverse('admin:dashboard_chart', args=[name], current_app=self.name)}?{query.urlencode()}"
+            for name in DashboardData.WIDGETS
         }
         
+        query['refresh'] = '1'
         context = {
             **self.each_context(request),
             'title': self.index_title,
             'app_list': app_list,
-            'stats': stats,
-            'chart_data': chart_data,
-            **(extra_context or {}),
-        }
+            'chart_urls': chart_urls,
+            'refresh_url': f'{request.path}?{query.urlencode()}',
+            'trend_start': start,
+            'trend_end': end,
+        }
+        
+        if not ASYNC_CHARTS:
+            # Compute the widgets before rendering, each cached on its own;
+            # ?refresh=1 recomputes them
+            widgets = cached_widgets(start, end, refresh=request.GET.get('refresh') == '1')
+            stats = widgets.pop('stats')
+            context.update({
+                'stats': stats['data'],
+                'stats_computed_at': stats['computed_at'],
+                # Convert to JSON for JavaScript
+                'chart_data': {name: json.dumps(widget['data']) for name, widget in widgets.items()},
+                'chart_computed_at': {name: widget['computed_at'] for name, widget in widgets.items()},
+                'stale_widgets': [name for name, widget in {'stats': stats, **widgets}.items() if widget['stale']],
+            })
+        context.update(extra_context or {})
         
         request.current_app = self.name
         return TemplateResponse(request, 'admin/index.html', context)
@@ -0,0 +1,564 @@
+"""
+Data for the admin index dashboard (see admin_customization.py).
+
+By default every trend is one ``TruncDate`` group-by over the requested date
+range and the distributions of a table come from a single conditional
+aggregate. With ROLLUPS on, the metrics come from the daily rollup rows kept
+up to date by users/rollups.py instead, so a load reads O(days) rows rather
+than the source tables (run ``manage.py rebuild_rollups`` once to fill them
+before turning it on).
+Either way a dashboard load costs a fixed handful of queries however many
+days it shows.
+
+``cached_widgets`` caches every widget separately in Django's cache, with
+single-flight recomputation: when a widget expires, one request takes a
+lock and recomputes it while concurrent requests keep serving the stale
+value. ``acached_widget`` does the same for one widget on the async cache
+and ORM APIs, for the admin's JSON chart endpoints.
+"""
+import asyncio
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+ADMIN_DASHBOARD = getattr(settings, 'ADMIN_DASHBOARD', {})
+
+TREND_DAYS = ADMIN_DASHBOARD.get('TREND_DAYS', 7)
+MAX_TREND_DAYS = ADMIN_DASHBOARD.get('MAX_TREND_DAYS', 366)
+ROLLUPS = ADMIN_DASHBOARD.get('ROLLUPS', False)
+# True renders the index without dashboard data, for a template that fetches
+# every widget from its JSON endpoint (chart_urls) in parallel
+ASYNC_CHARTS = ADMIN_DASHBOARD.get('ASYNC_CHARTS', False)
+
+# Widget cache: fresh for the widget's TTL (seconds), then served stale for
+# up to STALE_TTL more while one request recomputes it
+CACHE_ALIAS = ADMIN_DASHBOARD.get('CACHE_ALIAS', 'default')
+CACHE_TTL = ADMIN_DASHBOARD.get('CACHE_TTL', 300)
+WIDGET_TTL = ADMIN_DASHBOARD.get('WIDGET_TTL', {})
+STALE_TTL = ADMIN_DASHBOARD.get('STALE_TTL', 86400)
+LOCK_TIMEOUT = ADMIN_DASHBOARD.get('LOCK_TIMEOUT', 30)
+
+SUBSCRIPTION_STATUSES = [('A', 'Active'), ('C', 'Cancelled'), ('E', 'Expired'), ('P', 'Pending')]
+PAYMENT_STATUSES = [('P', 'Pending'), ('S', 'Success'), ('F', 'Failed')]
+
+
+def date_range(days=None, start=None, end=None):
+    """
+    (start, end) dates of the trend charts, both included.
+
+    Defaults to the last TREND_DAYS days up to today; ranges are capped at
+    MAX_TREND_DAYS.
+    """
+    end = end or timezone.localdate()
+    if start is None:
+        start = end - timedelta(days=(days or TREND_DAYS) - 1)
+    if start > end:
+        raise ValueError('The start date is after the end date')
+    return max(start, end - timedelta(days=MAX_TREND_DAYS - 1)), end
+
+
+def request_date_range(request):
+    """date_range from ?days= or ?start=&end= (YYYY-MM-DD); bad values use the default."""
+    try:
+        start = request.GET.get('start')
+        end = request.GET.get('end')
+        return date_range(
+            days=int(request.GET['days']) if request.GET.get('days') else None,
+            start=datetime.strptime(start, '%Y-%m-%d').date() if start else None,
+            end=datetime.strptime(end, '%Y-%m-%d').date() if end else None,
+        )
+    except ValueError:
+        return date_range()
+
+
+class Query:
+    """
+    One dashboard query that can run sync or on Django's async ORM.
+
+    ``kind`` is 'aggregate' (``queryset.aggregate(**aggregates)``), 'count'
+    or 'rows' (the queryset's rows); ``process`` turns the result into what
+    the widgets read.
+    """
+
+    def __init__(self, kind, queryset, aggregates=None, process=None):
+        self.kind = kind
+        self.queryset = queryset
+        self.aggregates = aggregates or {}
+        self.process = process or (lambda result: result)
+
+    def run(self):
+        if self.kind == 'aggregate':
+            return self.process(self.queryset.aggregate(**self.aggregates))
+        if self.kind == 'count':
+            return self.process(self.queryset.count())
+        return self.process(list(self.queryset))
+
+    async def arun(self):
+        if self.kind == 'aggregate':
+            return self.process(await self.queryset.aaggregate(**self.aggregates))
+        if self.kind == 'count':
+            return self.process(await self.queryset.acount())
+        return self.process([row async for row in self.queryset])
+
+
+class dashboard_query:
+    """
+    Like cached_property, for a method returning a Query: reading the
+    attribute runs the query once; ``DashboardData.aprepare`` runs it on the
+    async ORM instead and stores the result in the same place.
+    """
+
+    def __init__(self, method):
+        self.method = method
+        self.name = method.__name__
+        self.__doc__ = method.__doc__
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.name] = self.method(instance).run()
+        return value
+
+
+def daily_counts(queryset, field, start, end):
+    """
+    Query for the rows per day of ``field`` from ``start`` to ``end``.
+
+    DateTimeFields are grouped by their date in the current time zone, as
+    ``field__date`` lookups do; days without rows count 0.
+    """
+    if isinstance(queryset.model._meta.get_field(field), models.DateTimeField):
+        since = timezone.make_aware(datetime.combine(start, datetime.min.time()))
+        until = timezone.make_aware(datetime.combine(end + timedelta(days=1), datetime.min.time()))
+        rows = queryset.filter(**{f'{field}__gte': since, f'{field}__lt': until}).annotate(day=TruncDate(field))
+    else:
+        rows = queryset.filter(**{f'{field}__range': (start, end)}).annotate(day=models.F(field))
+    rows = rows.order_by().values('day').annotate(count=Count('pk')).values_list('day', 'count')
+    return Query('rows', rows, process=lambda result: trend_dataset(dict(result), start, end))
+
+
+def trend_dataset(counts, start, end):
+    """Chart dataset of {date: count} for every day from start to end"""
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    return {
+        'labels': [day.strftime('%b %d') for day in days],
+        'values': [counts.get(day, 0) for day in days],
+    }
+
+
+def choice_counts(queryset, fields, **extra):
+    """
+    Query for the counts per choice of several fields, in one aggregate.
+
+    ``fields`` maps a field name to its choices. The result holds a chart
+    dataset (labels/values of the choices present) per field, plus the
+    ``extra`` aggregates by name.
+    """
+    aggregates = {
+        f'{field}_{i}': Count('pk', filter=Q(**{field: value}))
+        for field, choices in fields.items()
+        for i, (value, _) in enumerate(choices)
+    }
+
+    def process(totals):
+        datasets = {name: totals[name] for name in extra}
+        for field, choices in fields.items():
+            counts = {value: totals[f'{field}_{i}'] for i, (value, _) in enumerate(choices)}
+            datasets[field] = choice_dataset(counts, choices)
+        return datasets
+
+    return Query('aggregate', queryset, {**aggregates, **extra}, process)
+
+
+def choice_dataset(counts, choices):
+    """Chart dataset of {value: count} in choice order, leaving out empty choices"""
+    present = [(label, counts.get(value, 0)) for value, label in choices if counts.get(value, 0)]
+    return {
+        'labels': [label for label, _ in present],
+        'values': [count for _, count in present],
+    }
+
+
+class DashboardData:
+    """
+    The admin index widgets for one date range, computed on demand.
+
+    Each widget is a method; the queries behind them are dashboard_query
+    attributes, so widgets sharing a query (e.g. the three profile charts)
+    run it once and a caller that only needs a few widgets only runs their
+    queries. ``QUERIES`` lists the queries each widget reads, which lets
+    ``awidget`` run them on the async ORM first.
+    """
+
+    # The ``stats`` block, then the chart datasets
+    WIDGETS = (
+        'stats', 'goal_data', 'activity_data', 'gender_data', 'risk_data', 'condition_data',
+        'subscription_data', 'user_trend_data', 'meal_trend_data', 'payment_data',
+    )
+    # Widgets that depend on the date range
+    RANGE_WIDGETS = ('user_trend_data', 'meal_trend_data')
+    QUERIES = {
+        'goal_data': ('profiles',),
+        'activity_data': ('profiles',),
+        'gender_data': ('profiles',),
+    }
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def widget(self, name):
+        if name not in self.WIDGETS:
+            raise KeyError(name)
+        return getattr(self, name)()
+
+    async def aprepare(self, name):
+        """Run the queries of widget ``name`` on the async ORM."""
+        for query in self.QUERIES[name]:
+            if query not in self.__dict__:
+                self.__dict__[query] = await getattr(type(self), query).method(self).arun()
+
+    async def awidget(self, name):
+        if name not in self.WIDGETS:
+            raise KeyError(name)
+        await self.aprepare(name)
+        return self.widget(name)
+
+    @dashboard_query
+    def profiles(self):
+        from users.models import Profile
+
+        return choice_counts(Profile.objects.all(), {
+            'goal': Profile.GOAL_CHOICES,
+            'activity_level': Profile.ACTIVITY_LEVEL_CHOICES,
+            'gender': Profile.GENDER_CHOICES,
+        })
+
+    def goal_data(self):
+        return self.profiles['goal']
+
+    def activity_data(self):
+        return self.profiles['activity_level']
+
+    def gender_data(self):
+        return self.profiles['gender']
+
+    @dashboard_query
+    def total_foods(self):
+        from meals.models import Food
+
+        return Query('count', Food.objects.all())
+
+
+class RollupDashboardData(DashboardData):
+    """
+    Widgets from the daily rollups: two queries over rollup rows, plus the
+    live profile distributions and food count.
+    """
+
+    QUERIES = {
+        **DashboardData.QUERIES,
+        'stats': ('totals', 'total_foods'),
+        'risk_data': ('totals',),
+        'condition_data': ('totals',),
+        'subscription_data': ('totals',),
+        'payment_data': ('totals',),
+        'user_trend_data': ('trends',),
+        'meal_trend_data': ('trends',),
+    }
+
+    @dashboard_query
+    def totals(self):
+        """{metric: Counter of count per dimension}, {metric: Counter of amount per dimension}"""
+        from users.models import DailyRollup
+
+        def process(rows):
+            counts, amounts = {}, {}
+            for metric, dimension, count, amount in rows:
+                counts.setdefault(metric, Counter())[dimension] += count
+                amounts.setdefault(metric, Counter())[dimension] += amount
+            return counts, amounts
+
+        rows = DailyRollup.objects.order_by().values('metric', 'dimension').annotate(
+            total_count=Sum('count'), total_amount=Sum('amount'),
+        ).values_list('metric', 'dimension', 'total_count', 'total_amount')
+        return Query('rows', rows, process=process)
+
+    @dashboard_query
+    def trends(self):
+        from users.models import DailyRollup
+
+        def process(rows):
+            trends = {'users': {}, 'meal_plans': {}}
+            for metric, day, count in rows:
+                trends[metric][day] = trends[metric].get(day, 0) + count
+            return trends
+
+        rows = DailyRollup.objects.filter(
+            metric__in=['users', 'meal_plans'], date__range=(self.start, self.end),
+        ).values_list('metric', 'date', 'count')
+        return Query('rows', rows, process=process)
+
+    def counts(self, metric):
+        return self.totals[0].get(metric, Counter())
+
+    @cached_property
+    def predictions(self):
+        """Prediction counts by condition and by risk level"""
+        from users.rollups import split_dimension
+
+        conditions, risks = Counter(), Counter()
+        for dimension, count in self.counts('predictions').items():
+            condition, risk = split_dimension(dimension)
+            conditions[condition] += count
+            risks[risk] += count
+        return conditions, risks
+
+    def stats(self):
+        return {
+            'total_users': sum(self.counts('users').values()),
+            'total_meal_plans': sum(self.counts('meal_plans').values()),
+            'total_predictions': sum(self.counts('predictions').values()),
+            'active_subscriptions': self.counts('subscriptions')['A'],
+            'total_foods': self.total_foods,
+            'total_revenue': self.totals[1].get('payments', Counter())['S'],
+        }
+
+    def risk_data(self):
+        from health.models import HealthPrediction
+
+        return choice_dataset(self.predictions[1], HealthPrediction.RISK_LEVELS)
+
+    def condition_data(self):
+        from health.models import HealthPrediction
+
+        return choice_dataset(self.predictions[0], HealthPrediction.CONDITION_TYPES)
+
+    def subscription_data(self):
+        return choice_dataset(self.counts('subscriptions'), SUBSCRIPTION_STATUSES)
+
+    def payment_data(self):
+        return choice_dataset(self.counts('payments'), PAYMENT_STATUSES)
+
+    def user_trend_data(self):
+        return trend_dataset(self.trends['users'], self.start, self.end)
+
+    def meal_trend_data(self):
+        return trend_dataset(self.trends['meal_plans'], self.start, self.end)
+
+
+class LiveDashboardData(DashboardData):
+    """
+    Widgets straight from the source tables, nine queries in all: one per
+    table for totals and distributions, one per trend.
+    """
+
+    QUERIES = {
+        **DashboardData.QUERIES,
+        'stats': ('total_users', 'total_meal_plans', 'predictions', 'subscriptions', 'payments', 'total_foods'),
+        'risk_data': ('predictions',),
+        'condition_data': ('predictions',),
+        'subscription_data': ('subscriptions',),
+        'payment_data': ('payments',),
+        'user_trend_data': ('user_trend',),
+        'meal_trend_data': ('meal_trend',),
+    }
+
+    @dashboard_query
+    def total_users(self):
+        from django.contrib.auth.models import User
+
+        return Query('count', User.objects.all())
+
+    @dashboard_query
+    def total_meal_plans(self):
+        from meals.models import MealPlan
+
+        return Query('count', MealPlan.objects.all())
+
+    @dashboard_query
+    def predictions(self):
+        from health.models import HealthPrediction
+
+        return choice_counts(HealthPrediction.objects.all(), {
+            'risk_level': HealthPrediction.RISK_LEVELS,
+            'condition_type': HealthPrediction.CONDITION_TYPES,
+        }, total=Count('pk'))
+
+    @dashboard_query
+    def subscriptions(self):
+        from premium.models import Subscription
+
+        return choice_counts(Subscription.objects.all(), {'status': SUBSCRIPTION_STATUSES},
+                             active=Count('pk', filter=Q(status='A')))
+
+    @dashboard_query
+    def payments(self):
+        from premium.models import Payment
+
+        return choice_counts(Payment.objects.all(), {'status': PAYMENT_STATUSES},
+                             revenue=Sum('amount', filter=Q(status='S')))
+
+    @dashboard_query
+    def user_trend(self):
+        from django.contrib.auth.models import User
+
+        return daily_counts(User.objects.all(), 'date_joined', self.start, self.end)
+
+    @dashboard_query
+    def meal_trend(self):
+        from meals.models import MealPlan
+
+        return daily_counts(MealPlan.objects.all(), 'date', self.start, self.end)
+
+    def stats(self):
+        return {
+            'total_users': self.total_users,
+            'total_meal_plans': self.total_meal_plans,
+            'total_predictions': self.predictions['total'],
+            'active_subscriptions': self.subscriptions['active'],
+            'total_foods': self.total_foods,
+            'total_revenue': self.payments['revenue'] or 0,
+        }
+
+    def risk_data(self):
+        return self.predictions['risk_level']
+
+    def condition_data(self):
+        return self.predictions['condition_type']
+
+    def subscription_data(self):
+        return self.subscriptions['status']
+
+    def payment_data(self):
+        return self.payments['status']
+
+    def user_trend_data(self):
+        return self.user_trend
+
+    def meal_trend_data(self):
+        return self.meal_trend
+
+
+def dashboard_class():
+    return RollupDashboardData if ROLLUPS else LiveDashboardData
+
+
+def dashboard_data(start, end, data_class=None):
+    """The ``stats`` block and the chart datasets of the admin index, uncached."""
+    data = (data_class or dashboard_class())(start, end)
+    return data.widget('stats'), {name: data.widget(name) for name in data.WIDGETS[1:]}
+
+
+def widget_cache_key(name, start, end):
+    if name in DashboardData.RANGE_WIDGETS:
+        return f'nutrilogic:dashboard:{name}:{start.isoformat()}:{end.isoformat()}'
+    return f'nutrilogic:dashboard:{name}'
+
+
+def cached_widgets(start, end, names=None, refresh=False, data_class=None):
+    """
+    {name: {'data', 'computed_at', 'stale'}} for the widgets in ``names``
+    (default: all), from the cache where fresh.
+
+    An expired or missing widget is recomputed by whichever request gets
+    its lock; the others serve the stale entry, or wait up to LOCK_TIMEOUT
+    for the first value. ``refresh`` recomputes even fresh widgets.
+    """
+    from django.core.cache import caches
+
+    cache = caches[CACHE_ALIAS]
+    data = (data_class or dashboard_class())(start, end)
+    names = names or data.WIDGETS
+    keys = {name: widget_cache_key(name, start, end) for name in names}
+    entries = cache.get_many(list(keys.values()))
+    now = time.time()
+
+    widgets = {}
+    for name, key in keys.items():
+        entry = entries.get(key)
+        if entry is not None and not refresh and entry['expires_at'] > now:
+            widgets[name] = dict(entry, stale=False)
+            continue
+
+        if cache.add(f'{key}:lock', 1, LOCK_TIMEOUT):
+            try:
+                entry = compute_widget(cache, data, name, key)
+            finally:
+                cache.delete(f'{key}:lock')
+            widgets[name] = dict(entry, stale=False)
+        elif entry is not None:
+            widgets[name] = dict(entry, stale=True)
+        else:
+            widgets[name] = wait_for_widget(cache, data, name, key)
+    return widgets
+
+
+def new_entry(name, data):
+    """Cache entry of a freshly computed widget, with its cache timeout"""
+    ttl = WIDGET_TTL.get(name, CACHE_TTL)
+    return {'data': data, 'computed_at': timezone.now(), 'expires_at': time.time() + ttl}, ttl + STALE_TTL
+
+
+def compute_widget(cache, data, name, key):
+    entry, timeout = new_entry(name, data.widget(name))
+    cache.set(key, entry, timeout)
+    return entry
+
+
+def wait_for_widget(cache, data, name, key):
+    """First computation of a widget is under way elsewhere: wait for it, else compute it here."""
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return dict(entry, stale=False)
+        if cache.get(f'{key}:lock') is None:
+            break
+    return dict(compute_widget(cache, data, name, key), stale=False)
+
+
+async def acached_widget(start, end, name, refresh=False, data_class=None):
+    """cached_widgets for one widget, on the async cache and ORM APIs."""
+    from django.core.cache import caches
+
+    cache = caches[CACHE_ALIAS]
+    data = (data_class or dashboard_class())(start, end)
+    if name not in data.WIDGETS:
+        raise KeyError(name)
+    key = widget_cache_key(name, start, end)
+    entry = await cache.aget(key)
+    if entry is not None and not refresh and entry['expires_at'] > time.time():
+        return dict(entry, stale=False)
+
+    if await cache.aadd(f'{key}:lock', 1, LOCK_TIMEOUT):
+        try:
+            return dict(await acompute_widget(cache, data, name, key), stale=False)
+        finally:
+            await cache.adelete(f'{key}:lock')
+    if entry is not None:
+        return dict(entry, stale=True)
+
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        entry = await cache.aget(key)
+        if entry is not None:
+            return dict(entry, stale=False)
+        if await cache.aget(f'{key}:lock') is None:
+            break
+    return dict(await acompute_widget(cache, data, name, key), stale=False)
+
+
+async def acompute_widget(cache, data, name, key):
+    entry, timeout = new_entry(name, await data.awidget(name))
+    await cache.aset(key, entry, timeout)
+    return entry
@@ -0,0 +1,184 @@
+"""
+Meal Recommender Benchmark Suite - NutriLogic
+=============================================
+Reproducible performance benchmark for MealRecommender.
+
+Synthetic user profiles cover every gender / goal / activity level / BMI
+category combination; synthetic meal tables grow in size. For each table
+size the suite reports per-call p50/p95/p99 latency, throughput and peak
+traced memory for:
+
+  - get_recommendations       (single user, result cache cleared per call)
+  - get_recommendations_batch (all profiles in one call)
+  - rank_meals                (top-k selection vs. a full sort)
+
+Results are written as JSON so runs can be diffed between releases.
+
+Usage: python benchmark_recommender.py [--sizes 10000 100000 1000000] [--output recommender_benchmark.json]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import django
+import numpy as np
+import pandas as pd
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nutrilogic.settings')
+django.setup()
+
+from meals.recommender import MealRecommender, recommendation_cache
+
+GENDERS = ['Male', 'Female']
+GOALS = ['L', 'M', 'G']
+ACTIVITY_LEVELS = ['S', 'L', 'M', 'V', 'E']
+# BMI inside each category: Underweight, Normal, Overweight, Obese
+BMI_VALUES = {'Underweight': 17.0, 'Normal': 22.0, 'Overweight': 27.5, 'Obese': 33.0}
+AGES = [25, 45, 65]
+HEIGHTS = [155.0, 170.0, 185.0]
+
+
+def synthetic_meals(n, seed=42):
+    """Meal table with roughly the spread of the Indian food dataset"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Dish Name': [f'Dish {i}' for i in range(n)],
+        'Calories': rng.gamma(2.5, 120, n).round(1),
+        'Protein': rng.gamma(2.0, 6, n).round(1),
+        'Fat': rng.gamma(2.0, 7, n).round(1),
+        'Carbs': rng.gamma(2.0, 18, n).round(1),
+    })
+
+
+def synthetic_profiles():
+    """One profile per gender/goal/activity/BMI/age/height combination"""
+    profiles = []
+    for gender, goal, activity, (category, bmi), age, height in itertools.product(
+        GENDERS, GOALS, ACTIVITY_LEVELS, BMI_VALUES.items(), AGES, HEIGHTS
+    ):
+        profiles.append({
+            'age': age,
+            'gender': gender,
+            'height': height,
+            'weight': round(bmi * (height / 100) ** 2, 1),
+            'goal': goal,
+            'activity_level': activity,
+            'bmi_category': category,  # For reporting only
+        })
+    return profiles
+
+
+def summarize(operation, size, latencies, items, elapsed, peak_bytes):
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        'operation': operation,
+        'dataset_size': size,
+        'calls': len(latencies),
+        'items': items,
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 4),
+        'p95_ms': round(float(np.percentile(latencies_ms, 95)), 4),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 4),
+        'mean_ms': round(float(latencies_ms.mean()), 4),
+        'throughput_per_s': round(items / elapsed, 1) if elapsed else None,
+        'peak_memory_mb': round(peak_bytes / 2 ** 20, 2),
+    }
+
+
+def measure(calls, before_each=None):
+    """Run the callables, timing each; returns (latencies, total seconds, peak traced bytes)."""
+    tracemalloc.start()
+    latencies = []
+    total = 0.0
+    for call in calls:
+        if before_each:
+            before_each()
+        started = time.perf_counter()
+        call()
+        latency = time.perf_counter() - started
+        latencies.append(latency)
+        total += latency
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latencies, total, peak
+
+
+def bench_single(recommender, profiles, size, top):
+    latencies, elapsed, peak = measure(
+        [lambda p=p: recommender.get_recommendations(p, top) for p in profiles],
+        before_each=recommendation_cache.clear,
+    )
+    return summarize('get_recommendations', size, latencies, len(profiles), elapsed, peak)
+
+
+def bench_batch(recommender, profiles, size, top, repeats):
+    latencies, elapsed, peak = measure(
+        [lambda: recommender.get_recommendations_batch(profiles, top)] * repeats
+    )
+    return summarize('get_recommendations_batch', size, latencies, len(profiles) * repeats, elapsed, peak)
+
+
+def bench_ranking(recommender, profiles, size, limit):
+    targets = [recommender.calculate_targets(p) for p in profiles]
+    latencies, elapsed, peak = measure([
+        lambda t=t: recommender.rank_meals(
+            t['target_calories'] * 0.3, t['max_fat'], t['max_carbs'], t['weight_loss'], limit=limit
+        )
+        for t in targets
+    ])
+    operation = 'rank_meals_top_k' if limit else 'rank_meals_full_sort'
+    return summarize(operation, size, latencies, len(targets), elapsed, peak)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--top', type=int, default=15, help='Recommendations per user')
+    parser.add_argument('--batch-repeats', type=int, default=3)
+    parser.add_argument('--output', default='recommender_benchmark.json')
+    args = parser.parse_args()
+
+    profiles = synthetic_profiles()
+    print(f"\n📊 {len(profiles)} synthetic profiles, meal tables of {args.sizes}")
+
+    results = []
+    for size in args.sizes:
+        recommender = MealRecommender.from_dataframe(synthetic_meals(size))
+        results.append(bench_single(recommender, profiles, size, args.top))
+        results.append(bench_batch(recommender, profiles, size, args.top, args.batch_repeats))
+        results.append(bench_ranking(recommender, profiles, size, args.top))
+        results.append(bench_ranking(recommender, profiles, size, None))
+
+    print(f"\n{'operation':<28} {'dishes':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'items/s':>11} {'peak MB':>8}")
+    print('-' * 89)
+    for row in results:
+        print(
+            f"{row['operation']:<28} {row['dataset_size']:>9} {row['p50_ms']:>9.3f} {row['p95_ms']:>9.3f} "
+            f"{row['p99_ms']:>9.3f} {row['throughput_per_s']:>11,.0f} {row['peak_memory_mb']:>8.1f}"
+        )
+
+    report = {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'profiles': len(profiles),
+            'top': args.top,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Results written to {args.output}\n")
+
+
+if __name__ == "__main__":
+    main()
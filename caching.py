@@ -0,0 +1,161 @@
+"""
+Small in-process caches for NutriLogic's computed results, shared by the
+meals and health apps.
+
+LRUCache keeps at most ``max_entries`` values for ``ttl`` seconds and counts
+hits, misses, evictions and expirations so it can be sized from real
+traffic. Passing ``alias`` stores the values in Django's cache framework
+instead (e.g. a shared Redis or Memcached cache), so that all workers
+share one copy; the backend then does the evicting and expiring, and each
+worker counts the evictions and expirations of the entries it wrote.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded LRU cache with a per-entry time-to-live."""
+
+    def __init__(self, max_entries=1024, ttl=600, alias=None, namespace='cache'):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.alias = alias
+        self.namespace = namespace
+        self.version = ''
+        self._entries = OrderedDict()
+        # Shared mode: this worker's writes, key -> (shared key, expires_at)
+        self._written = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def stats(self):
+        """Counters for sizing the cache."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'version': self.version,
+            'backend': self.alias or 'local',
+        }
+
+    def set_version(self, version):
+        """
+        Scope entries to a data/model version.
+
+        Changing the version makes every existing entry unreachable; the
+        local store is dropped right away, shared entries simply expire.
+        """
+        version = str(version)
+        if version != self.version:
+            with self._lock:
+                self._entries.clear()
+                self._written.clear()
+            self.version = version
+
+    def get(self, key):
+        if self.alias:
+            value = self._get_shared(key)
+        else:
+            value = self._get_local(key)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.alias:
+            shared_key = self._shared_key(key)
+            self._shared_cache().set(shared_key, value, self.ttl)
+            with self._lock:
+                self._written[key] = (shared_key, time.monotonic() + self.ttl)
+                self._written.move_to_end(key)
+                while len(self._written) > self.max_entries:
+                    self._written.popitem(last=False)
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        if self.alias:
+            self._shared_cache().delete(self._shared_key(key))
+            with self._lock:
+                self._written.pop(key, None)
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        if self.alias:
+            # Other workers read the generation too, so bumping it drops
+            # the shared entries everywhere without touching unrelated keys
+            cache = self._shared_cache()
+            cache.add(self._generation_key(), 0, None)
+            try:
+                cache.incr(self._generation_key())
+            except ValueError:
+                cache.set(self._generation_key(), 1, None)
+
+        with self._lock:
+            self._entries.clear()
+            self._written.clear()
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _get_shared(self, key):
+        shared_key = self._shared_key(key)
+        value = self._shared_cache().get(shared_key)
+        if value is None:
+            # A miss on an entry this worker wrote under the current
+            # generation and version: the backend expired or evicted it
+            with self._lock:
+                written = self._written.pop(key, None)
+            if written is not None and written[0] == shared_key:
+                if written[1] <= time.monotonic():
+                    self.expirations += 1
+                else:
+                    self.evictions += 1
+        return value
+
+    def _shared_cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def _generation_key(self):
+        return f'nutrilogic:{self.namespace}:generation'
+
+    def _shared_key(self, key):
+        generation = self._shared_cache().get(self._generation_key(), 0)
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return f'nutrilogic:{self.namespace}:{generation}:{self.version}:{digest}'
@@ -1 +1,302 @@
+"""
+ML Model Evaluation - NutriLogic
+================================
+Evaluates the health condition models on large evaluation sets.
 
+The set is generated (deterministically, per chunk) or streamed from a CSV
+and split into chunks that worker processes score for all four conditions
+at once. Workers only send back confusion-matrix counts and score
+histograms, so memory stays flat however many rows are evaluated.
+
+Reports accuracy, precision, recall, F1 and ROC AUC per condition, plus
+inference throughput and single-row latency. The JSON report and the CSV
+of metrics are stable for a given seed and model version, so CI can diff
+them.
+
+Usage: python evaluate_ml_models.py [--samples 1000000] [--data eval.csv] [--workers 4]
+                                    [--json ml_evaluation_report.json] [--csv ml_evaluation_metrics.csv]
+
+A --data CSV needs age, bmi, activity_level, diet_score and calorie_ratio
+columns (raw, unnormalized) plus a 0/1 column per condition.
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import django
+import numpy as np
+import pandas as pd
+
+# Setup Django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nutrilogic.settings')
+django.setup()
+
+from health.ml_model import CONDITIONS, predictor
+
+FEATURE_COLUMNS = ['age', 'bmi', 'activity_level', 'diet_score', 'calorie_ratio']
+# Score histogram resolution for streaming ROC AUC; forest probabilities
+# are multiples of 1/n_estimators, so they land exactly on a bin
+SCORE_BINS = 1000
+
+
+def generate_eval_data(n, seed):
+    """Raw features and true labels, same rules as the original quick evaluation"""
+    rng = np.random.default_rng(seed)
+
+    age = rng.integers(18, 80, n)
+    bmi = np.clip(rng.normal(25, 5, n), 15, 45)
+    activity = rng.beta(2, 2, n)
+    diet = rng.beta(2, 2, n)
+    cal_ratio = rng.normal(1.0, 0.2, n)
+
+    X = np.column_stack([age, bmi, activity, diet, cal_ratio])
+
+    # True labels
+    y = np.column_stack([
+        bmi > 30,                                       # obesity
+        (bmi > 27) & (diet < 0.4) & (age > 40),         # diabetes
+        (bmi > 28) & (activity < 0.3) & (age > 45),     # heart_disease
+        (diet < 0.3) | (cal_ratio < 0.7),               # nutrient_deficiency
+    ]).astype(np.int8)
+
+    return X, y
+
+
+def evaluate_chunk(task):
+    """
+    Score one chunk for every condition.
+
+    ``task`` is ('generate', rows, seed) or ('data', X, y). Returns per
+    condition [tn, fp, fn, tp] counts and score histograms by true class,
+    plus the rows and seconds spent scoring.
+    """
+    if task[0] == 'generate':
+        X, y = generate_eval_data(task[1], task[2])
+    else:
+        X, y = task[1], task[2]
+
+    features = X.astype(float)
+    features[:, 0] /= 100  # Normalize age
+    features[:, 1] /= 40   # Normalize BMI
+
+    started = time.perf_counter()
+    probabilities = predictor.predict_proba_matrix(features)
+    seconds = time.perf_counter() - started
+
+    # Same decision as model.predict: the positive class needs p > 0.5
+    predicted = (probabilities > 0.5).astype(np.int64)
+    bins = np.rint(probabilities * SCORE_BINS).astype(np.int64)
+    counts, histograms = [], []
+    for column in range(len(CONDITIONS)):
+        truth = y[:, column].astype(np.int64)
+        counts.append(np.bincount(2 * truth + predicted[:, column], minlength=4))
+        histograms.append(np.stack([
+            np.bincount(bins[truth == label, column], minlength=SCORE_BINS + 1) for label in (0, 1)
+        ]))
+    return np.array(counts), np.array(histograms), len(X), seconds
+
+
+def roc_auc_from_histograms(negatives, positives):
+    """ROC AUC from score histograms (ties count half), None with a single class"""
+    n_neg, n_pos = negatives.sum(), positives.sum()
+    if not n_neg or not n_pos:
+        return None
+    below = np.cumsum(negatives) - negatives  # Negatives scoring lower than each bin
+    return float((positives * (below + 0.5 * negatives)).sum() / (n_neg * n_pos))
+
+
+def condition_metrics(counts, histogram):
+    tn, fp, fn, tp = (int(value) for value in counts)
+    total = tn + fp + fn + tp
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    auc = roc_auc_from_histograms(histogram[0], histogram[1])
+    return {
+        'samples': total,
+        'positives': tp + fn,
+        'tn': tn, 'fp': fp, 'fn': fn, 'tp': tp,
+        'accuracy': round((tp + tn) / total, 6) if total else 0.0,
+        'precision': round(precision, 6),
+        'recall': round(recall, 6),
+        'f1': round(f1, 6),
+        'roc_auc': round(auc, 6) if auc is not None else None,
+    }
+
+
+class ModelEvaluator:
+    """Parallel, streaming evaluation of the health condition models"""
+
+    def __init__(self, workers=None, chunk_size=100_000, seed=42):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunk_size = chunk_size
+        self.seed = seed
+
+    def tasks(self, n_samples, data_path=None):
+        if data_path:
+            for frame in pd.read_csv(data_path, chunksize=self.chunk_size):
+                missing = [column for column in FEATURE_COLUMNS + list(CONDITIONS) if column not in frame.columns]
+                if missing:
+                    raise ValueError(f'{data_path} has no {", ".join(missing)} column')
+                yield 'data', frame[FEATURE_COLUMNS].to_numpy(float), frame[list(CONDITIONS)].to_numpy(np.int8)
+            return
+
+        for index, start in enumerate(range(0, n_samples, self.chunk_size)):
+            # Seeded per chunk, so results do not depend on the worker count
+            yield 'generate', min(self.chunk_size, n_samples - start), [self.seed, index]
+
+    def run_evaluation(self, n_samples=1_000_000, data_path=None, latency_samples=1000):
+        predictor.load()
+        counts = np.zeros((len(CONDITIONS), 4), dtype=np.int64)
+        histograms = np.zeros((len(CONDITIONS), 2, SCORE_BINS + 1), dtype=np.int64)
+        rows = 0
+        scoring_seconds = 0.0
+
+        started = time.perf_counter()
+        if self.workers > 0:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=django.setup) as pool:
+                pending = set()
+                for task in self.tasks(n_samples, data_path):
+                    pending.add(pool.submit(evaluate_chunk, task))
+                    if len(pending) >= 2 * self.workers:
+                        done = next(as_completed(pending))
+                        pending.remove(done)
+                        rows, scoring_seconds = self._collect(done.result(), counts, histograms, rows, scoring_seconds)
+                for done in as_completed(pending):
+                    rows, scoring_seconds = self._collect(done.result(), counts, histograms, rows, scoring_seconds)
+        else:
+            for task in self.tasks(n_samples, data_path):
+                rows, scoring_seconds = self._collect(evaluate_chunk(task), counts, histograms, rows, scoring_seconds)
+        wall_seconds = time.perf_counter() - started
+
+        return {
+            'meta': {
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'model_version': predictor.version,
+                'model_versions': predictor.versions,
+                'source': data_path or f'generated (seed {self.seed})',
+                'samples': rows,
+            },
+            'metrics': {
+                condition: condition_metrics(counts[column], histograms[column])
+                for column, condition in enumerate(CONDITIONS)
+            },
+            'performance': {
+                'workers': self.workers,
+                'chunk_size': self.chunk_size,
+                'wall_seconds': round(wall_seconds, 3),
+                'rows_per_second': round(rows / wall_seconds, 1) if wall_seconds else None,
+                'rows_per_worker_second': round(rows / scoring_seconds, 1) if scoring_seconds else None,
+                'single_row_latency_us': self.measure_latency(latency_samples),
+            },
+        }
+
+    @staticmethod
+    def _collect(result, counts, histograms, rows, scoring_seconds):
+        chunk_counts, chunk_histograms, chunk_rows, seconds = result
+        counts += chunk_counts
+        histograms += chunk_histograms
+        return rows + chunk_rows, scoring_seconds + seconds
+
+    def measure_latency(self, n):
+        """predict() latency for single users, bypassing the prediction cache"""
+        if n <= 0:
+            return None
+        X, _ = generate_eval_data(n, self.seed)
+        latencies = []
+        for age, bmi, activity, diet, cal_ratio in X.tolist():
+            user_data = {'age': age, 'bmi': bmi, 'activity_level': activity, 'diet_score': diet, 'calorie_ratio': cal_ratio}
+            started = time.perf_counter()
+            predictor.predict_many([user_data], use_cache=False)
+            latencies.append(time.perf_counter() - started)
+
+        latencies_us = np.asarray(latencies) * 1e6
+        return {
+            'samples': n,
+            'p50': round(float(np.percentile(latencies_us, 50)), 1),
+            'p95': round(float(np.percentile(latencies_us, 95)), 1),
+            'p99': round(float(np.percentile(latencies_us, 99)), 1),
+        }
+
+    @staticmethod
+    def print_report(report):
+        for condition, metrics in report['metrics'].items():
+            print(f"\n{'='*60}")
+            print(f"📊 {condition.replace('_', ' ').upper()}")
+            print('='*60)
+
+            print(f"\n✅ METRICS:")
+            print(f"   Accuracy:  {metrics['accuracy']:.4f} ({metrics['accuracy']*100:.2f}%)")
+            print(f"   Precision: {metrics['precision']:.4f}")
+            print(f"   Recall:    {metrics['recall']:.4f}")
+            print(f"   F1-Score:  {metrics['f1']:.4f}")
+            if metrics['roc_auc'] is not None:
+                print(f"   ROC AUC:   {metrics['roc_auc']:.4f}")
+
+            print(f"\n📈 CONFUSION MATRIX:")
+            print(f"              Predicted")
+            print(f"           Neg         Pos")
+            print(f"   Real N  {metrics['tn']:10d}  {metrics['fp']:10d}")
+            print(f"        P  {metrics['fn']:10d}  {metrics['tp']:10d}")
+
+        performance = report['performance']
+        print(f"\n{'='*60}")
+        print(f"⚡ PERFORMANCE ({report['meta']['samples']:,} samples, {performance['workers']} workers)")
+        print('='*60)
+        print(f"   Throughput:  {performance['rows_per_second']:,.0f} rows/s "
+              f"({performance['rows_per_worker_second']:,.0f} rows/s per worker)")
+        latency = performance['single_row_latency_us']
+        if latency:
+            print(f"   Single-row latency: p50 {latency['p50']} us, p95 {latency['p95']} us, p99 {latency['p99']} us")
+
+    @staticmethod
+    def write_json(report, path):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    @staticmethod
+    def write_csv(report, path):
+        """Metrics only (no timings), one row per condition"""
+        fields = ['condition', 'samples', 'positives', 'tn', 'fp', 'fn', 'tp',
+                  'accuracy', 'precision', 'recall', 'f1', 'roc_auc']
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for condition, metrics in report['metrics'].items():
+                writer.writerow({'condition': condition, **metrics})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=1_000_000, help='Generated rows (ignored with --data)')
+    parser.add_argument('--data', default=None, help='Evaluation CSV to stream instead of generated rows')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (0 = in this process)')
+    parser.add_argument('--chunk-size', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency-samples', type=int, default=1000)
+    parser.add_argument('--json', default='ml_evaluation_report.json')
+    parser.add_argument('--csv', default='ml_evaluation_metrics.csv')
+    args = parser.parse_args()
+
+    print("\n" + "🔬" * 30)
+    print("   NUTRILOGIC - ML MODEL EVALUATION")
+    print("🔬" * 30 + "\n")
+
+    evaluator = ModelEvaluator(workers=args.workers, chunk_size=args.chunk_size, seed=args.seed)
+    report = evaluator.run_evaluation(
+        n_samples=args.samples, data_path=args.data, latency_samples=args.latency_samples
+    )
+    evaluator.print_report(report)
+
+    evaluator.write_json(report, args.json)
+    evaluator.write_csv(report, args.csv)
+    print(f"\n✅ Report written to {args.json} and {args.csv}\n")
+
+
+if __name__ == "__main__":
+    main()
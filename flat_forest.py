@@ -0,0 +1,337 @@
+"""
+Flat-array export of fitted random forests.
+
+sklearn's ``predict_proba`` on a single row is dominated by input validation
+and per-tree dispatch. FlatForest copies every tree of one or more fitted
+forests into shared node arrays (feature, threshold, left, right) plus a
+table of leaf probabilities, and walks all trees for all rows at once with
+NumPy, so one pass over the features serves several models (e.g. the four
+health conditions).
+
+The evaluation reproduces sklearn exactly: inputs are cast to float32 as the
+trees do, missing values (NaN) follow each node's ``missing_go_to_left``,
+leaf values are normalized the same way and tree probabilities are
+accumulated in estimator order before dividing by the number of trees.
+It pays off for small batches; large batches are faster in sklearn's
+compiled trees, so callers switch over above a few hundred rows.
+
+``save``/``load`` use a compact single-file format (``.forest``) that is
+memory-mapped on load, so worker processes share one copy of the pages
+instead of each unpickling its own forest. Thresholds are stored as float32
+rounded down, which keeps every decision identical for float32 inputs, or
+optionally quantized to int16 per feature (smaller, approximate).
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+LEAF = -1
+
+MAGIC = b'NLFOREST'
+FORMAT_VERSION = 2  # 2 added missing_left
+ALIGNMENT = 64
+INT16_LEVELS = 65000  # Quantization steps per feature, below the int16 range
+
+
+class FlatForest:
+    """Node arrays for the trees of one or more fitted forest classifiers"""
+
+    def __init__(self, feature, threshold, left, right, value, roots, bounds, classes, n_features,
+                 missing_left=None, quantization=None, metadata=None):
+        self.feature = feature      # Split feature per node, LEAF for leaves
+        self.threshold = threshold  # Go left when x[feature] <= threshold; leaves always go left
+        self.left = left            # Left child; a leaf points at itself
+        self.right = right          # Right child; for a leaf, its row in value
+        self.value = value          # Class probabilities per leaf (padded to the widest forest)
+        self.roots = roots          # Root node of every tree
+        self.bounds = bounds        # Trees of forest i are roots[bounds[i]:bounds[i + 1]]
+        self.classes = classes      # classes_ of each forest
+        # Whether NaN goes left per node (leaves: left, onto themselves); None
+        # for trees without missing-value support, which reject NaN like sklearn
+        self.missing_left = missing_left
+        self.n_features = n_features
+        self.quantization = quantization  # Per-feature (low, step) for int16 thresholds
+        self.metadata = metadata or {}
+
+    @staticmethod
+    def supports(model):
+        """True for fitted single-output tree ensembles such as RandomForestClassifier"""
+        estimators = getattr(model, 'estimators_', None)
+        return bool(estimators) and getattr(model, 'n_outputs_', 1) == 1 and all(
+            hasattr(estimator, 'tree_') for estimator in estimators
+        )
+
+    @classmethod
+    def from_sklearn(cls, *models):
+        """Export fitted forests; they must share the same input features."""
+        if not models or not all(cls.supports(model) for model in models):
+            raise ValueError('FlatForest needs fitted single-output tree ensembles')
+
+        n_features = {model.n_features_in_ for model in models}
+        if len(n_features) != 1:
+            raise ValueError('All forests must use the same features')
+
+        width = max(len(model.classes_) for model in models)
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        missing_lefts = []
+        bounds = [0]
+        offset = 0
+        leaf_offset = 0
+        for model in models:
+            for estimator in model.estimators_:
+                tree = estimator.tree_
+                nodes = np.arange(tree.node_count)
+                is_leaf = tree.children_left == -1
+                leaf_ids = np.cumsum(is_leaf) - 1 + leaf_offset
+
+                # Same normalization as DecisionTreeClassifier.predict_proba
+                value = tree.value[is_leaf, 0, :].astype(np.float64)
+                normalizer = value.sum(axis=1, keepdims=True)
+                normalizer[normalizer == 0.0] = 1.0
+                value = value / normalizer
+
+                features.append(np.where(is_leaf, LEAF, tree.feature))
+                thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+                lefts.append(np.where(is_leaf, nodes + offset, tree.children_left + offset))
+                rights.append(np.where(is_leaf, leaf_ids, tree.children_right + offset))
+                # scikit-learn >= 1.3 routes NaN per node
+                missing = getattr(tree, 'missing_go_to_left', None)
+                missing_lefts.append(None if missing is None else is_leaf | (np.asarray(missing) != 0))
+                values.append(np.pad(value, ((0, 0), (0, width - value.shape[1]))))
+                roots.append(offset)
+                offset += tree.node_count
+                leaf_offset += len(value)
+            bounds.append(len(roots))
+
+        return cls(
+            feature=np.concatenate(features).astype(np.int16),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            left=np.concatenate(lefts).astype(np.int32),
+            right=np.concatenate(rights).astype(np.int32),
+            value=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int32),
+            bounds=bounds,
+            classes=[np.asarray(model.classes_) for model in models],
+            n_features=n_features.pop(),
+            missing_left=None if any(missing is None for missing in missing_lefts) else np.concatenate(missing_lefts),
+        )
+
+    @property
+    def n_forests(self):
+        return len(self.classes)
+
+    @property
+    def classes_(self):
+        return self.classes[0]
+
+    @property
+    def n_features_in_(self):
+        return self.n_features
+
+    def apply(self, X):
+        """Leaf node reached in every tree: an (n_rows, n_trees) index array."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f'Expected rows of {self.n_features} features, got shape {X.shape}')
+        missing = np.isnan(X)
+        if not missing.any():
+            missing = None
+        elif self.missing_left is None:
+            raise ValueError('Input contains NaN, which these trees cannot route')
+        if self.quantization is not None:
+            X = self._quantize(X if missing is None else np.where(missing, 0, X))
+
+        if len(X) == 1:
+            return self._apply_row(X[0], None if missing is None else missing[0])[None, :]
+
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots))).astype(np.intp)
+        while True:
+            feature = self.feature[nodes]
+            if not (feature != LEAF).any():
+                return nodes
+            # float32 input against the thresholds, as in sklearn's trees; leaves
+            # (feature LEAF reads the last column) always go left, onto themselves
+            go_left = X[rows, feature] <= self.threshold[nodes]
+            if missing is not None:
+                go_left = np.where(missing[rows, feature], self.missing_left[nodes], go_left)
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+    def _apply_row(self, x, missing=None):
+        """
+        Single-row walk of all trees at once over the (memory-mapped) node
+        arrays: one feature lookup per level instead of the 2-D row indexing.
+        """
+        nodes = self.roots.astype(np.intp)
+        while True:
+            feature = self.feature.take(nodes)
+            if (feature == LEAF).all():
+                return nodes
+            go_left = x.take(feature) <= self.threshold.take(nodes)
+            if missing is not None:
+                go_left = np.where(missing.take(feature), self.missing_left.take(nodes), go_left)
+            nodes = np.where(go_left, self.left.take(nodes), self.right.take(nodes))
+
+    def _quantize(self, X):
+        low, step = self.quantization
+        quantized = np.floor((X - low) / step) - 32768
+        return np.clip(quantized, -32768, 32767).astype(np.int32)
+
+    def predict_proba_all(self, X):
+        """predict_proba of every exported forest, from a single traversal."""
+        leaves = self.right[self.apply(X)]
+        probabilities = []
+        for i, classes in enumerate(self.classes):
+            start, end = self.bounds[i], self.bounds[i + 1]
+            leaf_values = self.value[leaves[:, start:end], :len(classes)]
+            # cumsum accumulates in estimator order like sklearn's running sum
+            total = np.cumsum(leaf_values, axis=1)[:, -1]
+            probabilities.append(total / (end - start))
+        return probabilities
+
+    def predict_proba(self, X, forest=0):
+        return self.predict_proba_all(X)[forest]
+
+    def predict(self, X, forest=0):
+        return self.classes[forest].take(np.argmax(self.predict_proba(X, forest), axis=1))
+
+    def compact_arrays(self, precision='float32'):
+        """Thresholds as stored by save(), and the quantization parameters."""
+        internal = self.feature != LEAF
+        if precision == 'float32':
+            # Largest float32 not above each threshold: for float32 inputs
+            # x <= t and x <= rounded-down t always agree
+            threshold = self.threshold.astype(np.float32)
+            above = threshold.astype(np.float64) > self.threshold
+            threshold[above] = np.nextafter(threshold[above], np.float32(-np.inf))
+            return threshold, None
+        if precision == 'int16':
+            low = np.zeros(self.n_features)
+            step = np.ones(self.n_features)
+            for feature in range(self.n_features):
+                values = self.threshold[internal & (self.feature == feature)]
+                if len(values):
+                    low[feature] = values.min()
+                    step[feature] = (values.max() - low[feature]) / INT16_LEVELS or 1.0
+            threshold = np.full(len(self.threshold), 32767, dtype=np.int16)
+            split = self.feature[internal]
+            threshold[internal] = np.floor((self.threshold[internal] - low[split]) / step[split]) - 32768
+            return threshold, (low, step)
+        raise ValueError(f'Unknown precision {precision!r}; use float32 or int16')
+
+    def save(self, path, precision='float32', metadata=None):
+        """Write the compact format atomically; returns the file size in bytes."""
+        if self.quantization is not None:
+            raise ValueError('Already quantized; export again from the sklearn model')
+        threshold, quantization = self.compact_arrays(precision)
+        arrays = {
+            'feature': self.feature.astype(np.int16),
+            'threshold': threshold,
+            'left': self.left.astype(np.int32),
+            'right': self.right.astype(np.int32),
+            'value': np.ascontiguousarray(self.value, dtype=np.float64),
+            'roots': self.roots.astype(np.int32),
+        }
+        if self.missing_left is not None:
+            arrays['missing_left'] = self.missing_left.astype(np.uint8)
+        if quantization is not None:
+            arrays['quantization'] = np.vstack(quantization)
+
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            layout[name] = [array.dtype.str, list(array.shape), offset]
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        header = json.dumps({
+            'format': FORMAT_VERSION,
+            'precision': precision,
+            'n_features': self.n_features,
+            'bounds': list(self.bounds),
+            'classes': [classes.tolist() for classes in self.classes],
+            'classes_dtype': [classes.dtype.str for classes in self.classes],
+            'arrays': layout,
+            'metadata': metadata if metadata is not None else self.metadata,
+        }).encode()
+        data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.uint64(len(header)).tobytes())
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name][2])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    @staticmethod
+    def read_header(path):
+        """(header, header length) of a .forest file"""
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a NutriLogic forest file')
+            header_length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            return json.loads(f.read(header_length)), header_length
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Read a .forest file; with mmap the node arrays stay shared page cache."""
+        header, header_length = cls.read_header(path)
+        if header['format'] != FORMAT_VERSION:
+            raise ValueError(f"{path} has format {header['format']}, expected {FORMAT_VERSION}")
+
+        data_start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+        if mmap:
+            # Plain ndarray views of the mapping: np.memmap's Python-level
+            # __getitem__ would dominate a single-row walk
+            buffer = np.memmap(path, dtype=np.uint8, mode='r').view(np.ndarray)
+        else:
+            buffer = np.fromfile(path, dtype=np.uint8)
+        arrays = {}
+        for name, (dtype, shape, offset) in header['arrays'].items():
+            dtype = np.dtype(dtype)
+            start = data_start + offset
+            count = int(np.prod(shape))
+            arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(shape)
+
+        quantization = arrays.pop('quantization', None)
+        if 'missing_left' in arrays:
+            arrays['missing_left'] = arrays['missing_left'].view(np.bool_)
+        return cls(
+            classes=[
+                np.asarray(classes, dtype=dtype)
+                for classes, dtype in zip(header['classes'], header['classes_dtype'])
+            ],
+            bounds=header['bounds'],
+            n_features=header['n_features'],
+            quantization=None if quantization is None else (quantization[0], quantization[1]),
+            metadata=header['metadata'],
+            **arrays,
+        )
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_if_current(path, source_path):
+    """
+    The compact export at ``path``, or None if it is missing, in an older
+    format or was exported from a different ``source_path`` artifact than the
+    one on disk now (a retrained model must not be shadowed by a stale export).
+    """
+    if not os.path.exists(path) or FlatForest.read_header(path)[0]['format'] != FORMAT_VERSION:
+        return None
+    forest = FlatForest.load(path)
+    source_sha256 = forest.metadata.get('source_sha256')
+    if os.path.exists(source_path) and source_sha256 != file_sha256(source_path):
+        return None
+    return forest
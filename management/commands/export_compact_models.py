@@ -0,0 +1,130 @@
+import os
+import time
+import tracemalloc
+
+import joblib
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from health.flat_forest import FlatForest, file_sha256
+from health.ml_model import CONDITIONS, compact_model_path, model_path, risk_levels
+from meals.recommender import (
+    MEAL_MODEL, MEAL_MODEL_COMPACT, MealRecommender, data_path, load_meal_classifier,
+)
+
+NUTRIENTS = ['Calories', 'Protein', 'Fat', 'Carbs']
+
+
+def timed_load(load, path, row):
+    """
+    Seconds to load an artifact, and the Python heap it holds after loading
+    and after serving one single-row prediction (lazy copies show up there)
+    """
+    tracemalloc.start()
+    started = time.perf_counter()
+    model = load(path)
+    seconds = time.perf_counter() - started
+    loaded, _ = tracemalloc.get_traced_memory()
+    model.predict_proba(row)
+    serving, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, loaded, serving
+
+
+def drift(original, compact, X, labels=None):
+    """Share of rows whose prediction changed, and the largest probability change"""
+    expected = original.predict_proba(X)
+    actual = compact.predict_proba(X)
+    if labels is None:
+        changed = expected.argmax(axis=1) != actual.argmax(axis=1)
+    else:
+        changed = (labels(expected) != labels(actual)).any(axis=1)
+    return float(changed.mean()), float(np.abs(expected - actual).max())
+
+
+class Command(BaseCommand):
+    help = 'Export the health and meal models to memory-mapped .forest files, gated on prediction drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--precision', choices=['float32', 'int16'], default='float32',
+                            help='float32 matches the originals exactly; int16 is smaller and approximate')
+        parser.add_argument('--max-drift', type=float, default=0.0,
+                            help='Largest share of evaluation rows allowed to change prediction')
+        parser.add_argument('--samples', type=int, default=20000, help='Synthetic evaluation rows per model')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--only', choices=['health', 'meals'], default=None)
+
+    def handle(self, *args, **options):
+        rng = np.random.RandomState(options['seed'])
+        exports = []  # (source, candidate, target, source loader, sample row) per model
+        try:
+            if options['only'] in (None, 'health'):
+                self.export_health(rng, options, exports)
+            if options['only'] in (None, 'meals'):
+                self.export_meals(rng, options, exports)
+        except CommandError:
+            for _, candidate, *_ in exports:
+                os.remove(candidate)
+            raise
+
+        # Publish only once every model passed the drift check
+        for source, candidate, target, load_source, row in exports:
+            os.replace(candidate, target)
+            self.report(source, target, load_source, row)
+        self.stdout.write(self.style.SUCCESS(f"Exported {len(exports)} models at {options['precision']}"))
+
+    def export_health(self, rng, options, exports):
+        # Training range of the features, plus a margin for unusual profiles
+        X = rng.uniform(-0.2, 1.5, size=(options['samples'], 5))
+        for condition in CONDITIONS:
+            source = model_path(condition)
+            if not os.path.exists(source):
+                raise CommandError(f'{source} not found; run manage.py train_health_models first')
+            # Risk levels are what users see, so any level change counts
+            exports.append(self.export(
+                condition, joblib.load(source), source, compact_model_path(condition), X, options,
+                labels=lambda proba: risk_levels(proba[:, 1:]),
+                load_source=joblib.load,
+            ))
+
+    def export_meals(self, rng, options, exports):
+        source = data_path(MEAL_MODEL)
+        if not os.path.exists(source):
+            raise CommandError(f'{source} not found; run manage.py train_meal_classifier first')
+        model, metadata = load_meal_classifier(source)
+
+        # Every real dish plus random rows across the observed nutrient ranges
+        meals = MealRecommender.read_meals_data()[NUTRIENTS].dropna().to_numpy(dtype=float)
+        low, high = meals.min(axis=0), meals.max(axis=0)
+        X = np.vstack([meals, rng.uniform(low, high, size=(options['samples'], len(NUTRIENTS)))])
+        exports.append(self.export('meal_classifier', model, source, data_path(MEAL_MODEL_COMPACT), X, options,
+                                   source_metadata=metadata, load_source=lambda path: load_meal_classifier(path)[0]))
+
+    def export(self, name, model, source, target, X, options, labels=None, source_metadata=None, load_source=None):
+        if not FlatForest.supports(model):
+            raise CommandError(f'{name}: {type(model).__name__} is not a tree ensemble')
+
+        candidate = f'{target}.candidate-{os.getpid()}'
+        metadata = {'source_sha256': file_sha256(source), 'precision': options['precision']}
+        if source_metadata is not None:
+            metadata['source_metadata'] = source_metadata
+        FlatForest.from_sklearn(model).save(candidate, precision=options['precision'], metadata=metadata)
+
+        changed, max_diff = drift(model, FlatForest.load(candidate), X, labels)
+        self.stdout.write(f'{name}: {changed:.4%} of {len(X)} predictions changed, max probability diff {max_diff:.4f}')
+        if changed > options['max_drift']:
+            os.remove(candidate)
+            raise CommandError(
+                f"{name}: drift {changed:.4%} exceeds --max-drift {options['max_drift']:.4%}; nothing was published"
+            )
+        return source, candidate, target, load_source, X[:1]
+
+    def report(self, source, target, load_source, row):
+        source_seconds, source_loaded, source_serving = timed_load(load_source, source, row)
+        compact_seconds, compact_loaded, compact_serving = timed_load(FlatForest.load, target, row)
+        self.stdout.write(
+            f'{target}: {os.path.getsize(target) / 1024:,.0f} KB (was {os.path.getsize(source) / 1024:,.0f} KB), '
+            f'load {compact_seconds * 1000:.1f} ms (was {source_seconds * 1000:.1f} ms), '
+            f'private heap {compact_loaded / 1024:,.0f} KB loaded / {compact_serving / 1024:,.0f} KB after a '
+            f'prediction (was {source_loaded / 1024:,.0f} / {source_serving / 1024:,.0f} KB)'
+        )
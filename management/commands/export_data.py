@@ -0,0 +1,104 @@
+import json
+import os
+import resource
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.exports import CHUNK_SIZE, EXPORT_SOURCES, FORMATS, encode, gzip_member
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Expected a YYYY-MM-DD date, got {value!r}')
+
+
+class Command(BaseCommand):
+    help = 'Export profiles or health predictions to a CSV/JSONL file, resuming from a checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', choices=sorted(EXPORT_SOURCES))
+        parser.add_argument('--output', required=True, help='File to write (the checkpoint is <output>.checkpoint)')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output, one gzip member per chunk')
+        parser.add_argument('--since', type=parse_date, default=None, help='First day to export (YYYY-MM-DD)')
+        parser.add_argument('--until', type=parse_date, default=None, help='Last day to export (YYYY-MM-DD)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows fetched and written per chunk')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+
+    def handle(self, *args, **options):
+        source = EXPORT_SOURCES[options['source']]
+        output = options['output']
+        checkpoint_path = f'{output}.checkpoint'
+        # The options a checkpoint is only valid for
+        export = {
+            'source': source.name,
+            'format': options['format'],
+            'gzip': options['gzip'],
+            'since': options['since'] and options['since'].isoformat(),
+            'until': options['until'] and options['until'].isoformat(),
+        }
+
+        checkpoint = self.read_checkpoint(checkpoint_path, options['restart'])
+        if checkpoint['last_pk'] is not None:
+            if checkpoint['export'] != export:
+                raise CommandError(
+                    f"{checkpoint_path} belongs to a different export ({checkpoint['export']}); "
+                    f"pass --restart to start over"
+                )
+            if not os.path.exists(output) or os.path.getsize(output) < checkpoint['offset']:
+                raise CommandError(f'{output} is shorter than its checkpoint; pass --restart to start over')
+            self.stdout.write(f"Resuming after id {checkpoint['last_pk']} ({checkpoint['rows']} rows written)")
+
+        queryset = source.queryset(since=options['since'], until=options['until'], after=checkpoint['last_pk'])
+        resumed_rows, resumed_offset = checkpoint['rows'], checkpoint['offset']
+        started = time.perf_counter()
+
+        # Everything past the checkpoint was written by an interrupted run
+        with open(output, 'r+b' if checkpoint['last_pk'] is not None else 'wb') as f:
+            f.truncate(checkpoint['offset'])
+            f.seek(checkpoint['offset'])
+            header = checkpoint['last_pk'] is None
+            for chunk in source.chunks(queryset, options['chunk_size']):
+                self.write(f, encode(source, options['format'], chunk, header=header), options['gzip'])
+                header = False
+                checkpoint.update(last_pk=chunk[-1][0], rows=checkpoint['rows'] + len(chunk), offset=f.tell())
+                self.write_checkpoint(checkpoint_path, {**checkpoint, 'export': export})
+            if header and options['format'] == 'csv':
+                # No rows: still a valid CSV with its header
+                self.write(f, encode(source, 'csv', [], header=True), options['gzip'])
+            size = f.tell()
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        seconds = time.perf_counter() - started
+        rows, megabytes = checkpoint['rows'] - resumed_rows, (size - resumed_offset) / 2**20
+        self.stdout.write(
+            f'{rows:,} rows, {megabytes:,.1f} MB in {seconds:.1f}s: '
+            f'{rows / max(seconds, 1e-9):,.0f} rows/s, {megabytes / max(seconds, 1e-9):,.1f} MB/s, '
+            f'peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:,.0f} MB'
+        )
+        self.stdout.write(self.style.SUCCESS(f"Exported {checkpoint['rows']:,} {source.name} to {output}"))
+
+    @staticmethod
+    def write(f, data, compress):
+        # Whole members keep the file valid at every checkpoint
+        f.write(gzip_member(data) if compress else data)
+        f.flush()
+
+    @staticmethod
+    def read_checkpoint(path, restart):
+        if not restart and os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return {'last_pk': None, 'rows': 0, 'offset': 0}
+
+    @staticmethod
+    def write_checkpoint(path, checkpoint):
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,54 @@
+import time
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+
+from meals.meal_store import COLUMN_RENAMES, NUTRIENT_COLUMNS, FoodStoreWriter
+from meals.recommender import data_path
+
+REQUIRED_COLUMNS = ('Dish Name',) + NUTRIENT_COLUMNS
+
+
+class Command(BaseCommand):
+    help = 'Stream one or more food nutrition CSVs into a compact, memory-mappable food store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='CSV files to merge, in priority order for duplicates')
+        parser.add_argument('--output', default=None, help='Store directory (default: meals/data/food_store)')
+        parser.add_argument('--chunk-size', type=int, default=100_000, help='Rows read per chunk')
+        parser.add_argument(
+            '--rename', action='append', default=[], metavar='SOURCE=TARGET',
+            help="Extra column mapping, e.g. --rename 'description=Dish Name' (repeatable)"
+        )
+
+    def handle(self, *args, **options):
+        output = options['output'] or data_path('food_store')
+        renames = dict(COLUMN_RENAMES)
+        for mapping in options['rename']:
+            source, sep, target = mapping.partition('=')
+            if not sep:
+                raise CommandError(f'--rename expects SOURCE=TARGET, got {mapping!r}')
+            renames[source.strip()] = target.strip()
+
+        writer = FoodStoreWriter(output)
+        started = time.perf_counter()
+        for path in options['paths']:
+            writer.add_source(path)
+            for chunk in pd.read_csv(path, chunksize=options['chunk_size']):
+                chunk.columns = chunk.columns.str.strip()
+                chunk = chunk.rename(columns=renames)
+                missing = [column for column in REQUIRED_COLUMNS if column not in chunk.columns]
+                if missing:
+                    raise CommandError(f'{path} has no {", ".join(missing)} column (use --rename)')
+
+                writer.append(chunk)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'{path}: {writer.rows} rows read, {writer.rows / elapsed:,.0f} rows/s')
+
+        meta = writer.finish()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {meta['rows']} foods to {output} ({meta['duplicates']} duplicates dropped) "
+            f"in {elapsed:.1f}s, {meta['rows_read'] / elapsed:,.0f} rows/s"
+        ))
+        self.stdout.write(f'Set MEAL_FOOD_STORE = {output!r} to recommend from it')
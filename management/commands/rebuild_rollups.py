@@ -0,0 +1,39 @@
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.rollups import ROLLUP_SOURCES, rebuild
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Expected a YYYY-MM-DD date, got {value!r}')
+
+
+class Command(BaseCommand):
+    help = 'Backfill or repair the daily dashboard rollups from the source tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--metric', action='append', choices=[source.metric for source in ROLLUP_SOURCES],
+                            help='Metric to rebuild (repeatable; default: all)')
+        parser.add_argument('--since', type=parse_date, default=None, help='First day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--until', type=parse_date, default=None, help='Last day to rebuild (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        if options['since'] and options['until'] and options['since'] > options['until']:
+            raise CommandError('--since is after --until')
+
+        sources = [
+            source for source in ROLLUP_SOURCES
+            if not options['metric'] or source.metric in options['metric']
+        ]
+        for source in sources:
+            started = time.perf_counter()
+            changed = rebuild(source, options['since'], options['until'])
+            self.stdout.write(
+                f'{source.metric}: {changed} rollup rows repaired in {time.perf_counter() - started:.2f}s'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(sources)} rollups'))
@@ -0,0 +1,170 @@
+import itertools
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from health.ml_model import ACTIVITY_SCORES, CONDITIONS, predictor, risk_levels, score_features
+from health.models import HealthPrediction
+from users.models import Profile
+from users.rollups import record_created
+
+PROFILE_FIELDS = ('pk', 'user_id', 'age', 'height', 'weight', 'activity_level', 'latest_input')
+
+
+def default_checkpoint():
+    return os.path.join(settings.BASE_DIR, 'health', 'rescore_checkpoint.json')
+
+
+def chunk_features(rows):
+    """Normalized feature matrix and the raw inputs stored with each prediction"""
+    inputs = []
+    for _, _, age, height, weight, activity_level, latest_input in rows:
+        latest_input = latest_input or {}
+        if isinstance(latest_input, str):
+            latest_input = json.loads(latest_input)
+        inputs.append({
+            'age': age,
+            'bmi': round(weight / (height / 100) ** 2, 2),
+            'activity_level': ACTIVITY_SCORES.get(activity_level, 0.6),
+            # Form inputs; reuse the user's latest values when there are any
+            'diet_score': latest_input.get('diet_score', 0.5),
+            'calorie_ratio': latest_input.get('calorie_ratio', 1.0),
+        })
+
+    features = np.array([
+        (row['age'], row['bmi'], row['activity_level'], row['diet_score'], row['calorie_ratio'])
+        for row in inputs
+    ], dtype=float).reshape(-1, 5)
+    features[:, 0] /= 100  # Normalize age
+    features[:, 1] /= 40   # Normalize BMI
+    return features, inputs
+
+
+class Command(BaseCommand):
+    help = 'Re-score health risks for every complete profile in batches, resuming from a checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Profiles scored per batch')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Scoring processes (0 scores in this process)')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per bulk_create INSERT')
+        parser.add_argument('--checkpoint', default=None, help='Progress file (default: health/rescore_checkpoint.json)')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+
+    def handle(self, *args, **options):
+        checkpoint_path = options['checkpoint'] or default_checkpoint()
+        checkpoint = self.read_checkpoint(checkpoint_path, options['restart'])
+        version = predictor.version
+        if checkpoint['last_pk'] and checkpoint.get('model_version') != version:
+            self.stdout.write(self.style.WARNING(
+                f"Resuming a run started with model {checkpoint.get('model_version')}, now serving {version}"
+            ))
+        checkpoint['model_version'] = version
+
+        latest_input = HealthPrediction.objects.filter(user_id=OuterRef('user_id')).order_by('-prediction_date')
+        profiles = Profile.objects.filter(
+            pk__gt=checkpoint['last_pk'], age__isnull=False, height__gt=0, weight__gt=0
+        ).order_by('pk')
+        total = profiles.count()
+        resume = f" (resuming after profile {checkpoint['last_pk']})" if checkpoint['last_pk'] else ''
+        self.stdout.write(f'{total} profiles to score{resume}')
+
+        rows = profiles.annotate(
+            latest_input=Subquery(latest_input.values('input_data')[:1])
+        ).values_list(*PROFILE_FIELDS).iterator(chunk_size=options['chunk_size'])
+        chunks = iter(lambda: list(itertools.islice(rows, options['chunk_size'])), [])
+
+        started = time.perf_counter()
+        done = 0
+        pool = None
+        if options['workers'] > 0:
+            # django.setup makes spawned workers usable too; forked ones are already set up
+            pool = ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup)
+        try:
+            for chunk, inputs, probabilities in self.score(chunks, pool, options['workers']):
+                self.write_chunk(chunk, inputs, probabilities, options['batch_size'])
+
+                checkpoint['last_pk'] = chunk[-1][0]
+                checkpoint['rows'] += len(chunk)
+                self.write_checkpoint(checkpoint_path, checkpoint)
+
+                done += len(chunk)
+                elapsed = time.perf_counter() - started
+                rate = done / elapsed
+                eta = (total - done) / rate if rate else 0
+                self.stdout.write(f'{done}/{total} profiles, {rate:,.0f} rows/s, ETA {eta:,.0f}s')
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-scored {checkpoint['rows']} profiles with model {version} "
+            f"({done} this run in {elapsed:.1f}s)"
+        ))
+
+    def score(self, chunks, pool, workers):
+        """Yield (chunk, inputs, probabilities) in profile order, keeping the pool busy."""
+        if pool is None:
+            for chunk in chunks:
+                features, inputs = chunk_features(chunk)
+                yield chunk, inputs, score_features(features)
+            return
+
+        pending = deque()
+        for chunk in chunks:
+            features, inputs = chunk_features(chunk)
+            pending.append((chunk, inputs, pool.submit(score_features, features)))
+            if len(pending) >= 2 * workers:
+                chunk, inputs, future = pending.popleft()
+                yield chunk, inputs, future.result()
+        while pending:
+            chunk, inputs, future = pending.popleft()
+            yield chunk, inputs, future.result()
+
+    def write_chunk(self, chunk, inputs, probabilities, batch_size):
+        risks = risk_levels(probabilities)
+        now = timezone.now()
+        predictions = [
+            HealthPrediction(
+                user_id=row[1],
+                condition_type=condition,
+                risk_level=str(risks[i, column]),
+                prediction_score=float(probabilities[i, column]),
+                input_data=inputs[i],
+                prediction_date=now,
+            )
+            for i, row in enumerate(chunk)
+            for column, condition in enumerate(CONDITIONS)
+        ]
+        # The checkpoint only moves past rows that were committed
+        with transaction.atomic():
+            HealthPrediction.objects.bulk_create(predictions, batch_size=batch_size)
+            record_created('predictions', predictions)
+
+    @staticmethod
+    def read_checkpoint(path, restart):
+        if not restart and os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return {'last_pk': 0, 'rows': 0}
+
+    @staticmethod
+    def write_checkpoint(path, checkpoint):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from health.ml_model import CONDITIONS, DEMO_SAMPLES, DEMO_SEED, create_demo_model, model_path, save_model
+
+
+class Command(BaseCommand):
+    help = 'Train the health condition models once (seeded) and save them for the workers to load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=DEMO_SEED)
+        parser.add_argument('--samples', type=int, default=DEMO_SAMPLES, help='Training rows per condition')
+        parser.add_argument('--n-estimators', type=int, default=10)
+        parser.add_argument('--output-dir', default=None, help='Model directory (default: health/ml_models)')
+
+    def handle(self, *args, **options):
+        for condition in CONDITIONS:
+            started = time.perf_counter()
+            model = create_demo_model(
+                condition, seed=options['seed'], n_samples=options['samples'],
+                n_estimators=options['n_estimators'],
+            )
+            path = model_path(condition, options['output_dir'])
+            save_model(model, path)
+            self.stdout.write(f'{condition}: trained in {time.perf_counter() - started:.2f}s, saved {path}')
+
+        self.stdout.write(self.style.SUCCESS(f'Saved {len(CONDITIONS)} health models'))
@@ -0,0 +1,70 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from meals.recommender import MEAL_INDEX, data_path
+
+
+def read_smaps(pid, prefix):
+    """
+    Sum RSS/PSS (kB) of a process and of its mappings under ``prefix``.
+
+    PSS splits each shared page between the processes mapping it, so a
+    memory-mapped file shared by N workers shows up as roughly 1/N per worker.
+    """
+    totals = {'rss': 0, 'pss': 0, 'mapped_rss': 0, 'mapped_pss': 0}
+    in_prefix = False
+    with open(f'/proc/{pid}/smaps') as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if not fields[0].endswith(':'):
+                # Mapping header: address perms offset dev inode [path]
+                in_prefix = len(fields) >= 6 and fields[5].startswith(prefix)
+            elif fields[0] in ('Rss:', 'Pss:'):
+                key = fields[0][:-1].lower()
+                totals[key] += int(fields[1])
+                if in_prefix:
+                    totals[f'mapped_{key}'] += int(fields[1])
+    return totals
+
+
+def child_pids(parent):
+    pids = []
+    for tid in os.listdir(f'/proc/{parent}/task'):
+        with open(f'/proc/{parent}/task/{tid}/children') as f:
+            pids.extend(int(pid) for pid in f.read().split())
+    return pids
+
+
+class Command(BaseCommand):
+    help = 'Report per-worker RSS/PSS and the share of it used by the memory-mapped meal index (Linux only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pids', nargs='*', type=int, help='Worker process ids')
+        parser.add_argument('--parent', type=int, help='Report every child of this process (e.g. the gunicorn master)')
+        parser.add_argument('--path', default=None, help='Mapped file prefix (default: meals/data/%s)' % MEAL_INDEX)
+
+    def handle(self, *args, **options):
+        pids = list(options['pids'])
+        if options['parent']:
+            pids.extend(child_pids(options['parent']))
+        if not pids:
+            raise CommandError('Give worker pids or --parent')
+        prefix = os.path.realpath(options['path'] or data_path(MEAL_INDEX))
+
+        self.stdout.write(f"{'PID':>8} {'RSS kB':>10} {'PSS kB':>10} {'index RSS':>10} {'index PSS':>10}")
+        total_rss = total_pss = 0
+        for pid in pids:
+            try:
+                usage = read_smaps(pid, prefix)
+            except OSError as e:
+                self.stderr.write(f'{pid:>8} unreadable: {e}')
+                continue
+            total_rss += usage['rss']
+            total_pss += usage['pss']
+            self.stdout.write(
+                f"{pid:>8} {usage['rss']:>10} {usage['pss']:>10} {usage['mapped_rss']:>10} {usage['mapped_pss']:>10}"
+            )
+        self.stdout.write(f"{'total':>8} {total_rss:>10} {total_pss:>10}")
@@ -0,0 +1,82 @@
+"""
+Anytime search for meal combinations that hit a calorie target.
+
+Used by MealRecommender.get_meal_plan: the candidate dishes already pass the
+macro caps, so the search only has to pick ``count`` distinct dishes whose
+calories sum to within the allowed range while minimising the summed health
+score (lower is better, as in the ranking).
+"""
+import time
+
+
+class PlanSearch:
+    """
+    Depth-first branch and bound over dishes sorted by health score.
+
+    Because scores are sorted ascending, the best score still reachable from
+    a node is the current score plus the next scores in order, which prunes
+    whole subtrees; calorie bounds from the cheapest/largest remaining dish
+    prune infeasible ones. The search stops at ``deadline`` and keeps the
+    best plan found so far.
+    """
+
+    # Nodes between deadline checks
+    CHECK_EVERY = 256
+
+    def __init__(self, scores, calories, count, low, high, deadline):
+        self.scores = list(scores)
+        self.calories = list(calories)
+        self.count = count
+        self.low = low
+        self.high = high
+        self.deadline = deadline
+
+        n = len(self.scores)
+        self.prefix = [0.0]
+        for score in self.scores:
+            self.prefix.append(self.prefix[-1] + score)
+        # Smallest/largest calories from position i onwards
+        self.suffix_min = [float('inf')] * (n + 1)
+        self.suffix_max = [float('-inf')] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            self.suffix_min[i] = min(self.calories[i], self.suffix_min[i + 1])
+            self.suffix_max[i] = max(self.calories[i], self.suffix_max[i + 1])
+
+        self.best_score = float('inf')
+        self.best = None
+        self.nodes = 0
+        self.timed_out = False
+
+    def run(self):
+        """Returns (positions of the best plan or None, search completed)."""
+        if 0 < self.count <= len(self.scores):
+            self._search(0, self.count, [], 0.0, 0.0)
+        return self.best, not self.timed_out
+
+    def _search(self, start, left, chosen, score, calories):
+        n = len(self.scores)
+        for i in range(start, n - left + 1):
+            if score + self.prefix[i + left] - self.prefix[i] >= self.best_score:
+                break  # Later dishes only score worse
+
+            total = calories + self.calories[i]
+            if left == 1:
+                if self.low <= total <= self.high:
+                    self.best_score = score + self.scores[i]
+                    self.best = chosen + [i]
+                continue
+
+            rest = left - 1
+            if total + rest * self.suffix_min[i + 1] > self.high:
+                continue
+            if total + rest * self.suffix_max[i + 1] < self.low:
+                continue
+
+            self.nodes += 1
+            if self.nodes % self.CHECK_EVERY == 0 and time.perf_counter() >= self.deadline:
+                self.timed_out = True
+            if self.timed_out:
+                return
+            self._search(i + 1, rest, chosen + [i], score + self.scores[i], total)
+            if self.timed_out:
+                return
@@ -0,0 +1,409 @@
+"""
+Preprocessed binary copies of the meal dataset.
+
+Parsing the CSV, cleaning and renaming its columns on every worker start is
+slow. ``build_meal_table`` does that once and writes the typed columns to an
+uncompressed ``.npz`` file together with the source CSV's size, mtime and
+SHA-256. Workers load the ``.npz`` and only fall back to the CSV when the
+table is missing or was built from a different CSV.
+
+The same command writes the recommender's calorie-sorted nutrient arrays as
+plain ``.npy`` files, which workers memory-map instead of holding a private
+copy. Text is stored interned: an int32 code per row into one UTF-8 blob
+of the distinct values (with their offsets), so repeated and long names
+cost their bytes once.
+"""
+import hashlib
+import json
+import logging
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2  # 2 stores text as interned codes instead of fixed-width unicode
+
+# Raw CSV headers -> names used throughout the recommender
+COLUMN_RENAMES = {
+    'Calories (kcal)': 'Calories',
+    'Protein (g)': 'Protein',
+    'Fats (g)': 'Fat',
+    'Carbohydrates (g)': 'Carbs'
+}
+
+
+def read_meals_csv(csv_path):
+    """Parse the meal CSV with cleaned and renamed columns."""
+    meals_data = pd.read_csv(csv_path)
+
+    # Clean column names
+    meals_data.columns = meals_data.columns.str.strip()
+
+    return meals_data.rename(columns=COLUMN_RENAMES)
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_stat(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def encode_names(values):
+    """
+    Intern ``values`` as (codes, offsets, blob).
+
+    ``codes`` holds one int32 per value (-1 where missing) indexing the
+    distinct values, whose UTF-8 bytes are ``blob[offsets[code]:offsets[code + 1]]``.
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).map(str, na_action='ignore'))
+    encoded = [name.encode() for name in uniques]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(name) for name in encoded])
+    return codes.astype(np.int32), offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def decode_names(codes, offsets, blob):
+    """Object array of the values ``encode_names`` interned, NaN where missing."""
+    blob = bytes(blob)
+    # Code -1 picks the trailing NaN
+    uniques = np.array(
+        [blob[offsets[i]:offsets[i + 1]].decode() for i in range(len(offsets) - 1)] + [np.nan], dtype=object
+    )
+    return uniques[codes]
+
+
+class NameTable:
+    """Read-only interned names, decoded one at a time from (memory-mapped) arrays."""
+
+    def __init__(self, codes, offsets, blob):
+        self.codes = codes
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, position):
+        code = self.codes[position]
+        if code < 0:
+            return np.nan
+        return self.blob[self.offsets[code]:self.offsets[code + 1]].tobytes().decode()
+
+
+def save_meal_table(meals_data, table_path, source_path):
+    """
+    Write ``meals_data`` to ``table_path`` (atomically) as typed columns.
+
+    Text columns are stored interned (see ``encode_names``), so the file
+    loads without pickle.
+    """
+    arrays = {}
+    columns = []
+    for i, column in enumerate(meals_data.columns):
+        series = meals_data[column]
+        if pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+            arrays[f'col_{i}'] = series.to_numpy()
+            columns.append({'name': column, 'kind': 'numeric'})
+        else:
+            arrays[f'codes_{i}'], arrays[f'offsets_{i}'], arrays[f'blob_{i}'] = encode_names(series)
+            columns.append({'name': column, 'kind': 'text'})
+
+    meta = {
+        'format': FORMAT_VERSION,
+        'columns': columns,
+        'rows': len(meals_data),
+        'source_sha256': file_sha256(source_path),
+        'source': source_stat(source_path),
+    }
+    arrays['meta'] = np.array(json.dumps(meta))
+
+    tmp_path = f'{table_path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, table_path)
+    return meta
+
+
+def is_fresh(meta, source_path):
+    """Whether a table built with ``meta`` still matches the source CSV."""
+    if meta.get('format') != FORMAT_VERSION:
+        return False
+    try:
+        if meta['source'] == source_stat(source_path):
+            return True
+        # Touched or copied but identical content is still fresh
+        return meta['source_sha256'] == file_sha256(source_path)
+    except OSError:
+        return False
+
+
+def load_meal_table(table_path, source_path):
+    """
+    Load the binary meal table.
+
+    Returns None when the table is missing, unreadable or stale, in which
+    case the caller should parse the CSV instead.
+    """
+    if not os.path.exists(table_path):
+        return None
+    try:
+        with np.load(table_path, allow_pickle=False) as table:
+            meta = json.loads(str(table['meta']))
+            if not is_fresh(meta, source_path):
+                return None
+
+            data = {}
+            for i, column in enumerate(meta['columns']):
+                if column['kind'] == 'text':
+                    data[column['name']] = decode_names(table[f'codes_{i}'], table[f'offsets_{i}'], table[f'blob_{i}'])
+                else:
+                    data[column['name']] = table[f'col_{i}']
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        logger.warning('Ignoring meal table %s: %s', table_path, e)
+        return None
+
+    return pd.DataFrame(data, columns=[column['name'] for column in meta['columns']])
+
+
+# Nutrient index columns shared between workers through memory-mapped .npy files
+INDEX_COLUMNS = ('rows', 'calories', 'protein', 'fat', 'carbs')
+# The interned dish names next to them, read through a NameTable
+NAME_FILES = ('name_codes', 'name_offsets', 'name_blob')
+
+
+def save_nutrient_arrays(arrays, directory, source_path):
+    """
+    Write the recommender's sorted nutrient arrays as one ``.npy`` per column.
+
+    The directory is swapped in with a rename, so workers that still map
+    the previous files keep reading them until they reload.
+    """
+    tmp_dir = f'{directory}.tmp-{os.getpid()}'
+    os.makedirs(tmp_dir, exist_ok=True)
+    for column in INDEX_COLUMNS:
+        np.save(os.path.join(tmp_dir, f'{column}.npy'), np.ascontiguousarray(arrays[column]))
+
+    for name, values in zip(NAME_FILES, encode_names(arrays['names'])):
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), values)
+
+    meta = {
+        'format': FORMAT_VERSION,
+        'rows': len(arrays['names']),
+        'source_sha256': file_sha256(source_path),
+        'source': source_stat(source_path),
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    _swap_directory(tmp_dir, directory)
+    return meta
+
+
+def load_nutrient_arrays(directory, source_path):
+    """
+    Memory-map the nutrient arrays read-only.
+
+    Every worker mapping the same files shares one copy in the page cache.
+    Returns None when the directory is missing or stale.
+    """
+    return _map_arrays(directory, lambda meta: is_fresh(meta, source_path))
+
+
+def load_food_store(directory):
+    """
+    Memory-map a store written by FoodStoreWriter.
+
+    Ingested stores are built from external databases rather than the meal
+    CSV, so they are used as long as they are readable.
+    """
+    return _map_arrays(directory, lambda meta: meta.get('format') == FORMAT_VERSION)
+
+
+def _map_arrays(directory, accept):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        if not accept(meta):
+            return None
+
+        arrays = {
+            column: np.load(os.path.join(directory, f'{column}.npy'), mmap_mode='r')
+            for column in INDEX_COLUMNS + NAME_FILES
+        }
+    except (OSError, ValueError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logger.warning('Ignoring nutrient index %s: %s', directory, e)
+        return None
+
+    if any(len(arrays[column]) != meta['rows'] for column in INDEX_COLUMNS + ('name_codes',)):
+        return None
+    if len(arrays['name_blob']) != arrays['name_offsets'][-1]:
+        return None
+    # Plain ndarray views of the maps: slicing a np.memmap costs more than decoding the name
+    arrays['names'] = NameTable(*(arrays.pop(name).view(np.ndarray) for name in NAME_FILES))
+    return arrays
+
+
+def _swap_directory(tmp_dir, directory):
+    """Replace ``directory`` with ``tmp_dir`` using renames."""
+    old_dir = f'{directory}.old-{os.getpid()}'
+    if os.path.exists(directory):
+        os.replace(directory, old_dir)
+    os.replace(tmp_dir, directory)
+    if os.path.exists(old_dir):
+        for name in os.listdir(old_dir):
+            os.remove(os.path.join(old_dir, name))
+        os.rmdir(old_dir)
+
+
+# Columns every ingested chunk must provide (after renaming)
+NUTRIENT_COLUMNS = ('Calories', 'Protein', 'Fat', 'Carbs')
+
+
+class FoodStoreWriter:
+    """
+    Build a nutrient store from large food databases, one chunk at a time.
+
+    Chunks are appended to raw float32 column files and a UTF-8 name blob,
+    so memory while reading stays at one chunk whatever the input size.
+    ``finish`` drops duplicate foods (same normalized name and nutrients,
+    first occurrence wins), sorts by calories and writes the same
+    memory-mappable layout as ``save_nutrient_arrays``, block by block.
+    Names are interned by a 64-bit hash of their exact text.
+    """
+
+    BLOCK_ROWS = 1 << 18
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tmp_dir = f'{directory}.tmp-{os.getpid()}'
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._files = {
+            name: open(self._raw_path(name), 'wb')
+            for name in NUTRIENT_COLUMNS + ('hash', 'name_hash', 'name_length', 'name_blob')
+        }
+        self.rows = 0
+        self.sources = []
+
+    def _raw_path(self, name):
+        return os.path.join(self.tmp_dir, f'{name}.raw')
+
+    def _map_raw(self, name, dtype):
+        path = self._raw_path(name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)  # Empty files cannot be mapped
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def add_source(self, path):
+        self.sources.append({'path': os.path.abspath(path), 'sha256': file_sha256(path), **source_stat(path)})
+
+    def append(self, chunk):
+        """Add a DataFrame chunk with 'Dish Name' and the nutrient columns."""
+        nutrients = {
+            column: pd.to_numeric(chunk[column], errors='coerce').to_numpy(dtype=np.float32)
+            for column in NUTRIENT_COLUMNS
+        }
+        names = chunk['Dish Name']
+        nulls = names.isna().to_numpy()
+        names = names.astype(str).str.strip()
+
+        # Duplicate detection key: normalized name plus float32 nutrients
+        key = pd.DataFrame({'name': names.str.lower().to_numpy(), **nutrients})
+        key.loc[nulls, 'name'] = ''
+        hashes = pd.util.hash_pandas_object(key, index=False).to_numpy(dtype=np.uint64)
+
+        encoded = [b'' if null else name.encode() for name, null in zip(names, nulls)]
+        lengths = np.array([len(name) for name in encoded], dtype=np.int64)
+        lengths[nulls] = -1
+
+        for column, values in nutrients.items():
+            values.tofile(self._files[column])
+        hashes.tofile(self._files['hash'])
+        pd.util.hash_array(names.to_numpy(dtype=object)).tofile(self._files['name_hash'])
+        lengths.tofile(self._files['name_length'])
+        self._files['name_blob'].write(b''.join(encoded))
+        self.rows += len(chunk)
+
+    def finish(self):
+        """Deduplicate, sort and publish the store; returns its metadata."""
+        for f in self._files.values():
+            f.close()
+
+        hashes = np.fromfile(self._raw_path('hash'), dtype=np.uint64)
+        _, first = np.unique(hashes, return_index=True)
+        del hashes
+        kept = np.sort(first)  # Input order among the unique foods
+
+        raw = {column: self._map_raw(column, np.float32) for column in NUTRIENT_COLUMNS}
+        order = np.argsort(raw['Calories'][kept], kind='stable')  # NaN goes last
+        source_rows = kept[order]
+
+        total = len(source_rows)
+        np.save(os.path.join(self.tmp_dir, 'rows.npy'), order.astype(np.int64))
+        for column, source in zip(INDEX_COLUMNS[1:], NUTRIENT_COLUMNS):
+            out = np.lib.format.open_memmap(
+                os.path.join(self.tmp_dir, f'{column}.npy'), mode='w+', dtype=np.float32, shape=(total,)
+            )
+            for start in range(0, total, self.BLOCK_ROWS):
+                out[start:start + self.BLOCK_ROWS] = raw[source][source_rows[start:start + self.BLOCK_ROWS]]
+            out.flush()
+            del out
+
+        self._write_names(source_rows)
+
+        meta = {
+            'format': FORMAT_VERSION,
+            'kind': 'food_store',
+            'rows': total,
+            'rows_read': self.rows,
+            'duplicates': self.rows - total,
+            'sources': self.sources,
+        }
+        with open(os.path.join(self.tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        del raw
+        for name in NUTRIENT_COLUMNS + ('hash', 'name_hash', 'name_length', 'name_blob'):
+            os.remove(self._raw_path(name))
+        _swap_directory(self.tmp_dir, self.directory)
+        return meta
+
+    def _write_names(self, source_rows):
+        lengths = np.fromfile(self._raw_path('name_length'), dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.maximum(lengths, 0))])
+        blob = self._map_raw('name_blob', np.uint8)
+
+        # One code per distinct name among the kept rows, -1 for none
+        present = np.flatnonzero(lengths[source_rows] >= 0)
+        name_hashes = self._map_raw('name_hash', np.uint64)[source_rows[present]]
+        _, first, inverse = np.unique(name_hashes, return_index=True, return_inverse=True)
+        del name_hashes
+        codes = np.full(len(source_rows), -1, dtype=np.int32)
+        codes[present] = inverse.ravel()
+        np.save(os.path.join(self.tmp_dir, 'name_codes.npy'), codes)
+        del codes, inverse
+
+        unique_rows = source_rows[present[first]]
+        name_offsets = np.concatenate([[0], np.cumsum(lengths[unique_rows])]).astype(np.int64)
+        np.save(os.path.join(self.tmp_dir, 'name_offsets.npy'), name_offsets)
+
+        names = np.lib.format.open_memmap(
+            os.path.join(self.tmp_dir, 'name_blob.npy'), mode='w+', dtype=np.uint8, shape=(int(name_offsets[-1]),)
+        )
+        for start in range(0, len(unique_rows), self.BLOCK_ROWS):
+            rows = unique_rows[start:start + self.BLOCK_ROWS]
+            names[name_offsets[start]:name_offsets[start + len(rows)]] = np.frombuffer(
+                b''.join(blob[offsets[row]:offsets[row + 1]].tobytes() for row in rows), dtype=np.uint8
+            )
+        names.flush()
+        del names, blob
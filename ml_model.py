@@ -1,92 +1,304 @@
-import numpy as np
-import joblib
+import hashlib
+import logging
 import os
+
+import numpy as np
 from django.conf import settings
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
+from nutrilogic.caching import LRUCache
+
+from .flat_forest import FlatForest, load_if_current
+from .model_registry import model_registry
+
+logger = logging.getLogger(__name__)
+
+CONDITIONS = ('obesity', 'diabetes', 'heart_disease', 'nutrient_deficiency')
+
+# Demo training data is seeded so every worker builds the same models
+DEMO_SEED = 42
+DEMO_SAMPLES = 100
+
+# Profile.activity_level on the 0-1 scale of the activity feature
+ACTIVITY_SCORES = {'S': 0.2, 'L': 0.4, 'M': 0.6, 'V': 0.8, 'E': 1.0}
+
+RISK_LEVELS = np.array(['L', 'M', 'H'])
+RISK_THRESHOLDS = [0.3, 0.7]
+
+HEALTH_PREDICTION_CACHE = getattr(settings, 'HEALTH_PREDICTION_CACHE', {})
+
+# Predictions keyed by model version and normalized feature vector; repeat
+# visits with an unchanged profile are served without touching the models
+prediction_cache = LRUCache(
+    max_entries=HEALTH_PREDICTION_CACHE.get('MAX_ENTRIES', 4096),
+    ttl=HEALTH_PREDICTION_CACHE.get('TTL', 3600),
+    alias=HEALTH_PREDICTION_CACHE.get('ALIAS'),
+    namespace='health-predictions',
+)
+
+# Above this many rows sklearn's compiled trees beat the NumPy flat evaluator
+FLAT_MAX_ROWS = 512
+
+
+def model_dir():
+    return os.path.join(settings.BASE_DIR, 'health', 'ml_models')
+
+
+def model_path(condition_type, directory=None):
+    return os.path.join(directory or model_dir(), f'{condition_type}_model.joblib')
+
+
+def compact_model_path(condition_type, directory=None):
+    """Memory-mapped export of the joblib model (see ``manage.py export_compact_models``)"""
+    return os.path.join(directory or model_dir(), f'{condition_type}_model.forest')
+
+
+def create_demo_model(condition_type, seed=DEMO_SEED, n_samples=DEMO_SAMPLES, n_estimators=10):
+    """Train a simple demonstration model on seeded synthetic data"""
+    from sklearn.ensemble import RandomForestClassifier
+
+    model = RandomForestClassifier(n_estimators=n_estimators, random_state=42)
+
+    # Train with dummy data
+    rng = np.random.RandomState(seed + CONDITIONS.index(condition_type))
+    X = rng.rand(n_samples, 5)  # 5 features: age, bmi, activity, diet_score, calorie_ratio
+
+    # Different logic for different conditions
+    if condition_type == 'obesity':
+        y = (X[:, 1] > 0.7).astype(int)  # High BMI -> obesity risk
+    elif condition_type == 'diabetes':
+        y = ((X[:, 1] > 0.6) & (X[:, 3] < 0.4)).astype(int)  # High BMI + poor diet -> diabetes risk
+    elif condition_type == 'heart_disease':
+        y = ((X[:, 1] > 0.6) & (X[:, 2] < 0.3)).astype(int)  # High BMI + low activity -> heart disease risk
+    else:  # nutrient_deficiency
+        y = (X[:, 3] < 0.3).astype(int)  # Poor diet -> nutrient deficiency risk
+
+    model.fit(X, y)
+    return model
+
+
+def artifact_version(path):
+    """Short content hash of a model artifact"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def save_model(model, path):
+    """Write a model atomically so a worker never loads a half-written file"""
+    import joblib
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, path)
+
 
 class HealthPredictor:
-    """Simple ML model for health condition prediction"""
-    
+    """
+    Simple ML model for health condition prediction
+
+    Models are loaded on first use, not at import, so importing the health
+    app stays cheap. Persisted artifacts (see ``manage.py train_health_models``)
+    are preferred, and their compact ``.forest`` exports over the joblib files
+    while they are current; a missing artifact falls back to a seeded demo model.
+    Retrained artifacts are hot-swapped through the model registry.
+    """
+
     def __init__(self):
-        self.models = {
-            'obesity': self._get_model('obesity'),
-            'diabetes': self._get_model('diabetes'),
-            'heart_disease': self._get_model('heart_disease'),
-            'nutrient_deficiency': self._get_model('nutrient_deficiency')
-        }
-        self.scaler = StandardScaler()
-        
-    def _get_model(self, condition_type):
-        """Get or create a model for the specified condition"""
-        model_path = os.path.join(settings.BASE_DIR, f'health/ml_models/{condition_type}_model.joblib')
-        
+        self._entry = None
+
+    def load(self):
+        """
+        The serving LoadedModel from the model registry
+
+        The first call loads the models; later calls pick up retrained
+        artifacts, which the registry loads in the background.
+        """
+        if self._entry is None:
+            paths = [model_path(condition) for condition in CONDITIONS]
+            paths += [compact_model_path(condition) for condition in CONDITIONS]
+            self._entry = model_registry.register('health', paths, self._load_models)
+        loaded = self._entry.get()
+        if loaded is None:
+            raise RuntimeError(f'Health models could not be loaded: {self._entry.error}')
+        prediction_cache.set_version(loaded.version)
+        return loaded
+
+    @property
+    def models(self):
+        return self.load().model['models']
+
+    @property
+    def loaded(self):
+        return self._entry is not None and self._entry.current is not None
+
+    @property
+    def version(self):
+        return self.load().version
+
+    @property
+    def versions(self):
+        return self.load().model['versions']
+
+    def _load_models(self, paths):
+        """Registry loader: all condition models, their fused export and a combined version"""
+        models, versions = {}, {}
+        joblib_paths, compact_paths = paths[:len(CONDITIONS)], paths[len(CONDITIONS):]
+        for condition, path, compact_path in zip(CONDITIONS, joblib_paths, compact_paths):
+            models[condition], versions[condition] = self._get_model(condition, path, compact_path)
+        version = hashlib.sha1(':'.join(versions[condition] for condition in CONDITIONS).encode()).hexdigest()[:12]
+        return {'models': models, 'flat': self._export(models), 'versions': versions}, version
+
+    @staticmethod
+    def _export(models):
+        """
+        All four forests as one FlatForest, or None if a model is not a tree
+        ensemble (compact models are FlatForests already and predict directly)
+        """
+        if all(FlatForest.supports(models[condition]) for condition in CONDITIONS):
+            return FlatForest.from_sklearn(*(models[condition] for condition in CONDITIONS))
+        return None
+
+    def _get_model(self, condition_type, path=None, compact_path=None):
+        """Get or create a model for the specified condition, as (model, version)"""
+        path = path or model_path(condition_type)
+        compact_path = compact_path or compact_model_path(condition_type)
+
+        # A current compact export maps the trees instead of unpickling them
+        try:
+            compact = load_if_current(compact_path, path)
+            if compact is not None:
+                return compact, artifact_version(compact_path)
+        except Exception:
+            logger.exception('Could not load %s, using %s', compact_path, path)
+
         # If model exists, load it
-        if os.path.exists(model_path):
+        if os.path.exists(path):
             try:
-                return joblib.load(model_path)
-            except:
-                pass
-                
-        # Create a simple model (for demonstration)
-        return self._create_demo_model(condition_type)
-    
-    def _create_demo_model(self, condition_type):
-        """Create a simple demonstration model"""
-        model = RandomForestClassifier(n_estimators=10, random_state=42)
-        
-        # Train with dummy data
-        X = np.random.rand(100, 5)  # 5 features: age, bmi, activity, diet_score, calorie_ratio
-        
-        # Different logic for different conditions
-        if condition_type == 'obesity':
-            y = (X[:, 1] > 0.7).astype(int)  # High BMI -> obesity risk
-        elif condition_type == 'diabetes':
-            y = ((X[:, 1] > 0.6) & (X[:, 3] < 0.4)).astype(int)  # High BMI + poor diet -> diabetes risk
-        elif condition_type == 'heart_disease':
-            y = ((X[:, 1] > 0.6) & (X[:, 2] < 0.3)).astype(int)  # High BMI + low activity -> heart disease risk
-        else:  # nutrient_deficiency
-            y = (X[:, 3] < 0.3).astype(int)  # Poor diet -> nutrient deficiency risk
-            
-        model.fit(X, y)
-        return model
-    
+                import joblib
+                return joblib.load(path), artifact_version(path)
+            except Exception:
+                logger.exception('Could not load %s, using the demo model', path)
+        else:
+            logger.warning('%s not found, using the demo model (run manage.py train_health_models)', path)
+
+        return create_demo_model(condition_type), f'demo-{DEMO_SEED}'
+
     def predict(self, user_data):
         """
         Predict health risks based on user data
-        
+
         Args:
             user_data: dict with keys 'age', 'bmi', 'activity_level', 'diet_score', 'calorie_ratio'
-        
+
         Returns:
             dict of condition_type -> (risk_level, score)
         """
-        # Convert user data to feature vector
-        features = np.array([
+        return self.predict_many([user_data])[0]
+
+    def predict_many(self, user_rows, use_cache=True):
+        """
+        Predict health risks for many users at once
+
+        Args:
+            user_rows: iterable of user_data dicts (see predict), or a 2-D
+                array of already normalized features as built by feature_matrix
+            use_cache: look up / store results in prediction_cache; bulk
+                jobs that see every user once can skip it
+
+        Returns:
+            list with one dict of condition_type -> (risk_level, score) per user
+        """
+        features = feature_matrix(user_rows)
+        # One version for the whole batch, even if a reload lands meanwhile
+        loaded = self.load()
+        if not use_cache:
+            return self._predict_rows(features, loaded)
+
+        keys = [(loaded.version, tuple(row)) for row in features.tolist()]
+        results = [prediction_cache.get(key) for key in keys]
+        missing = [row for row, result in enumerate(results) if result is None]
+        if missing:
+            for row, result in zip(missing, self._predict_rows(features[missing], loaded)):
+                prediction_cache.set(keys[row], result)
+                results[row] = result
+
+        # Copies, so callers cannot modify the cached entries
+        return [dict(result) for result in results]
+
+    def _predict_rows(self, features, loaded):
+        probabilities = self.predict_proba_matrix(features, loaded)
+        risks = risk_levels(probabilities)
+
+        return [
+            {
+                condition: (str(risks[row, column]), probabilities[row, column])
+                for column, condition in enumerate(CONDITIONS)
+            }
+            for row in range(len(probabilities))
+        ]
+
+    def cache_stats(self):
+        """Hit rate and size of the prediction cache"""
+        return prediction_cache.stats()
+
+    def predict_proba_matrix(self, features, loaded=None):
+        """Positive-class probability per user (rows) and condition (columns, in CONDITIONS order)"""
+        probabilities = np.empty((len(features), len(CONDITIONS)))
+        if len(features):
+            bundle = (loaded or self.load()).model
+            models, flat = bundle['models'], bundle['flat']
+            if flat is not None and len(features) <= FLAT_MAX_ROWS:
+                # One traversal of the exported trees serves every condition
+                for column, proba in enumerate(flat.predict_proba_all(features)):
+                    probabilities[:, column] = proba[:, 1]
+            else:
+                for column, condition in enumerate(CONDITIONS):
+                    probabilities[:, column] = models[condition].predict_proba(features)[:, 1]
+        return probabilities
+
+
+def feature_matrix(user_rows):
+    """Normalized N x 5 feature matrix for HealthPredictor"""
+    if isinstance(user_rows, np.ndarray):
+        return np.asarray(user_rows, dtype=float).reshape(-1, 5)
+
+    return np.array([
+        (
             user_data.get('age', 30) / 100,  # Normalize age
             user_data.get('bmi', 25) / 40,   # Normalize BMI
             user_data.get('activity_level', 0.5),  # 0-1 scale
             user_data.get('diet_score', 0.5),      # 0-1 scale
-            user_data.get('calorie_ratio', 1.0)    # ratio of consumed/target
-        ]).reshape(1, -1)
-        
-        results = {}
-        
-        # Make predictions for each condition
-        for condition, model in self.models.items():
-            prob = model.predict_proba(features)[0][1]  # Probability of positive class
-            
-            # Determine risk level
-            if prob < 0.3:
-                risk = 'L'  # Low risk
-            elif prob < 0.7:
-                risk = 'M'  # Moderate risk
-            else:
-                risk = 'H'  # High risk
-                
-            results[condition] = (risk, prob)
-            
-        return results
-
-# Singleton instance
-predictor = HealthPredictor()
\ No newline at end of file
+            user_data.get('calorie_ratio', 1.0),   # ratio of consumed/target
+        )
+        for user_data in user_rows
+    ], dtype=float).reshape(-1, 5)
+
+
+def risk_levels(probabilities):
+    """Low (< 0.3), Moderate (< 0.7) or High risk for each probability"""
+    return RISK_LEVELS[np.digitize(probabilities, RISK_THRESHOLDS)]
+
+
+# Singleton instance; cheap to create, models load on first predict()
+predictor = HealthPredictor()
+
+
+def warmup():
+    """
+    Load the models ahead of the first request.
+
+    Call it in each worker after fork, e.g. from gunicorn's config:
+
+        def post_fork(server, worker):
+            from health.ml_model import warmup
+            warmup()
+    """
+    predictor.load()
+    return predictor
+
+
+def score_features(features):
+    """Probability matrix for a feature matrix; the task run by bulk re-scoring workers"""
+    return predictor.predict_proba_matrix(features)
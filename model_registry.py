@@ -0,0 +1,244 @@
+"""
+Hot-reloadable registry of the models NutriLogic serves.
+
+Each registered model is a set of artifact files plus a loader. Readers get
+the serving version with ``get()``; every CHECK_INTERVAL seconds that call
+also compares the artifacts' mtime/size and, when they changed, loads the
+new version on a background thread. The swap is a single reference
+assignment, so in-flight predictions keep using the version they started
+with and nobody waits for a load.
+
+Older versions stay in memory for ``rollback()``/``pin()``; a model
+registered with ``versioned_path`` can also pin versions kept on disk.
+Pins from ``settings.MODEL_REGISTRY['PINS']`` apply to every worker.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MODEL_REGISTRY = getattr(settings, 'MODEL_REGISTRY', {})
+
+
+def artifact_signature(paths):
+    """Cheap change detector: mtime and size of each artifact."""
+    parts = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            parts.append(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+        except OSError:
+            parts.append('missing')
+    return ':'.join(parts)
+
+
+def artifact_checksum(paths):
+    """sha256 over the contents of the artifacts that exist."""
+    digest = hashlib.sha256()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class LoadedModel:
+    """One loaded version of a registered model"""
+
+    def __init__(self, name, model, version, checksum, paths):
+        self.name = name
+        self.model = model
+        self.version = version
+        self.checksum = checksum
+        self.paths = paths
+        self.loaded_at = datetime.now(timezone.utc)
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'checksum': self.checksum,
+            'paths': list(self.paths),
+            'loaded_at': self.loaded_at.isoformat(),
+        }
+
+
+class RegisteredModel:
+    """
+    A named model and its loaded versions.
+
+    ``loader(paths)`` returns ``(model, version)``; a None version falls back
+    to the artifact checksum. ``versioned_path(version)`` optionally maps a
+    version to an artifact kept on disk, for pinning versions never loaded
+    by this worker.
+    """
+
+    # Previous versions kept in memory for rollback
+    KEEP = 3
+
+    def __init__(self, name, paths, loader, versioned_path=None):
+        self.name = name
+        self.paths = tuple(paths)
+        self.loader = loader
+        self.versioned_path = versioned_path
+        self.current = None
+        self.history = []
+        self.pinned = None
+        self.loading = False
+        self.error = None
+        self._signature = None
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+        self._first_load_lock = threading.Lock()
+
+    def get(self):
+        """The serving LoadedModel (None if nothing could be loaded)."""
+        self.check()
+        return self.current
+
+    def check(self, force=False):
+        """Start a reload if the artifacts changed; the first load happens inline."""
+        if self.current is None:
+            self._first_load()
+            return
+
+        now = time.monotonic()
+        if not force and now - self._checked_at < MODEL_REGISTRY.get('CHECK_INTERVAL', 30):
+            return
+        self._checked_at = now
+        if self.pinned is not None or self.loading:
+            return
+
+        signature = artifact_signature(self.paths)
+        if signature == self._signature:
+            return
+
+        self.loading = True
+        threading.Thread(
+            target=self._reload, args=(signature,), name=f'reload-{self.name}', daemon=True
+        ).start()
+
+    def _first_load(self):
+        """
+        Load inline, ignoring the check interval: concurrent first callers
+        wait for this load instead of finding nothing to serve. A failed load
+        is retried once the artifacts change.
+        """
+        with self._first_load_lock:
+            if self.current is not None:
+                return
+            self._checked_at = time.monotonic()
+            signature = artifact_signature(self.paths)
+            if signature != self._signature:
+                self._reload(signature)
+
+    def _reload(self, signature):
+        try:
+            loaded = self._load(self.paths)
+            with self._lock:
+                self._signature = signature
+                if self.pinned is None and (self.current is None or loaded.checksum != self.current.checksum):
+                    self._swap(loaded)
+            self.error = None
+        except Exception as e:
+            # Keep serving the current version; retry once the files change again
+            self._signature = signature
+            self.error = f'{type(e).__name__}: {e}'
+            logger.error('Could not load model %s: %s', self.name, self.error)
+        finally:
+            self.loading = False
+
+    def _load(self, paths):
+        model, version = self.loader(paths)
+        checksum = artifact_checksum(paths)
+        return LoadedModel(self.name, model, version or checksum[:12], checksum, paths)
+
+    def _swap(self, loaded):
+        previous = self.current
+        if previous is not None and previous is not loaded:
+            self.history = [previous] + [old for old in self.history if old is not loaded][:self.KEEP - 1]
+        self.current = loaded  # The only write readers see
+        logger.info('Serving %s version %s', self.name, loaded.version)
+
+    def pin(self, version):
+        """Serve ``version`` and stop following the artifacts until unpin()."""
+        with self._lock:
+            loaded = next(
+                (candidate for candidate in [self.current] + self.history
+                 if candidate is not None and candidate.version == version),
+                None,
+            )
+            if loaded is None:
+                path = self.versioned_path(version) if self.versioned_path else None
+                if not path or not os.path.exists(path):
+                    raise ValueError(f'{self.name} version {version} is not available')
+                loaded = self._load((path,))
+            self._swap(loaded)
+            self.pinned = version
+        return loaded
+
+    def rollback(self):
+        """Pin the previously served version."""
+        if not self.history:
+            raise ValueError(f'{self.name} has no previous version')
+        return self.pin(self.history[0].version)
+
+    def unpin(self):
+        """Follow the artifacts again; the next get() picks up the latest."""
+        with self._lock:
+            self.pinned = None
+            self._signature = None
+            self._checked_at = float('-inf')
+
+    def status(self):
+        return {
+            'current': self.current.describe() if self.current else None,
+            'history': [old.version for old in self.history],
+            'pinned': self.pinned,
+            'loading': self.loading,
+            'error': self.error,
+        }
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, paths, loader, versioned_path=None):
+        """Register a model once per process and return its RegisteredModel."""
+        with self._lock:
+            if name not in self._models:
+                entry = RegisteredModel(name, paths, loader, versioned_path)
+                self._models[name] = entry
+                pin = MODEL_REGISTRY.get('PINS', {}).get(name)
+                if pin:
+                    try:
+                        entry.pin(pin)
+                    except Exception:
+                        logger.exception('Cannot pin %s to %s', name, pin)
+            return self._models[name]
+
+    def __getitem__(self, name):
+        return self._models[name]
+
+    def __contains__(self, name):
+        return name in self._models
+
+    def status(self):
+        """What this worker is serving, for the admin status view."""
+        return {
+            'pid': os.getpid(),
+            'models': {name: entry.status() for name, entry in sorted(self._models.items())},
+        }
+
+
+# Process-wide registry
+model_registry = ModelRegistry()
@@ -36,6 +36,14 @@ class Profile(models.Model):
     daily_water_target = models.PositiveIntegerField(default=8, help_text="Target number of glasses per day")
     daily_calorie_target = models.PositiveIntegerField(null=True, blank=True)
     
+    class Meta:
+        # The admin changelist filters on these and pages by descending id
+        indexes = [
+            models.Index(fields=['gender', 'id'], name='profile_gender_idx'),
+            models.Index(fields=['activity_level', 'id'], name='profile_activity_idx'),
+            models.Index(fields=['goal', 'id'], name='profile_goal_idx'),
+        ]
+    
     def __str__(self):
         return f'{self.user.username} Profile'
     
@@ -89,3 +97,23 @@ class Profile(models.Model):
         except (FileNotFoundError, ValueError, AttributeError):
             # If the image file doesn't exist or there's an issue, skip resizing
             pass
+
+
+class DailyRollup(models.Model):
+    """
+    One day's count (and amount) of an admin dashboard metric, for one
+    dimension value such as ``obesity/H``; maintained by rollups.py
+    """
+    date = models.DateField()
+    metric = models.CharField(max_length=30)
+    dimension = models.CharField(max_length=60, blank=True, default='')
+    count = models.BigIntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['metric', 'date', 'dimension'], name='unique_daily_rollup'),
+        ]
+    
+    def __str__(self):
+        return f'{self.metric} {self.dimension} on {self.date}: {self.count}'
@@ -0,0 +1,173 @@
+"""
+Paginators for admin changelists over large tables.
+
+EstimatedCountPaginator replaces the changelist's ``COUNT(*)`` with the
+database's own row estimate when it is large (table statistics for an
+unfiltered PostgreSQL/MySQL table, the query planner's estimate for a
+filtered PostgreSQL queryset) and with a cached exact count otherwise.
+
+KeysetPaginator additionally seeks deep pages by primary key instead of
+``OFFSET``: when the queryset is ordered by pk only (the admin default),
+the last pk of every page served is cached (one key per page), so the
+next page is ``WHERE pk < last_pk LIMIT n`` however deep it is.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+ADMIN_PAGINATION = getattr(settings, 'ADMIN_PAGINATION', {})
+
+CACHE_ALIAS = ADMIN_PAGINATION.get('CACHE_ALIAS', 'default')
+# Exact counts are cached this many seconds
+COUNT_CACHE_TTL = ADMIN_PAGINATION.get('COUNT_CACHE_TTL', 300)
+# Estimates below this are replaced by an exact (cached) count
+ESTIMATE_THRESHOLD = ADMIN_PAGINATION.get('ESTIMATE_THRESHOLD', 100000)
+# Pages from this one on are sought by primary key
+KEYSET_MIN_PAGE = ADMIN_PAGINATION.get('KEYSET_MIN_PAGE', 5)
+# How many pages back a seek looks for a cached boundary before walking from page 1
+KEYSET_LOOKBACK = ADMIN_PAGINATION.get('KEYSET_LOOKBACK', 20)
+BOUNDARY_CACHE_TTL = ADMIN_PAGINATION.get('BOUNDARY_CACHE_TTL', 600)
+
+# _boundary() result for a page after the last row (possible with an estimated count)
+PAST_END = object()
+
+
+def query_key(queryset, prefix):
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.sha1(f'{sql}:{params!r}'.encode()).hexdigest()
+    return f'nutrilogic:{prefix}:{queryset.db}:{digest}'
+
+
+def estimated_count(queryset):
+    """The database's row estimate for ``queryset``, or None where it has none."""
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    unfiltered = not queryset.query.where
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            if unfiltered:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+                row = cursor.fetchone()
+                # -1 until the table was first analyzed
+                return row[0] if row and row[0] >= 0 else None
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            return int(plan[0]['Plan']['Plan Rows'])
+        if connection.vendor == 'mysql' and unfiltered:
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator whose count is an estimate for large results, exact (and cached) for small ones."""
+
+    estimated = False
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return len(self.object_list)
+
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+            self.estimated = True
+            return estimate
+
+        cache = caches[CACHE_ALIAS]
+        key = query_key(self.object_list, 'count')
+        count = cache.get(key)
+        if count is None:
+            count = self.object_list.count()
+            cache.set(key, count, COUNT_CACHE_TTL)
+        return count
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # An estimate may fall short of the real count: serve the pages
+            # past it (empty if there are no rows) rather than an error
+            if not self.estimated or int(number) < 1:
+                raise
+            return int(number)
+
+
+class KeysetPaginator(EstimatedCountPaginator):
+    """EstimatedCountPaginator that seeks deep pages of pk-ordered querysets by pk"""
+
+    @cached_property
+    def pk_direction(self):
+        """'asc'/'desc' if the queryset is ordered by pk alone, else None"""
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return None
+        pk_names = {'pk', queryset.model._meta.pk.name, queryset.model._meta.pk.attname}
+        ordering = list(queryset.query.order_by) or (
+            list(queryset.model._meta.ordering) if queryset.query.default_ordering else []
+        )
+        if len(ordering) != 1 or not isinstance(ordering[0], str):
+            return None
+        field = ordering[0]
+        descending = field.startswith('-')
+        if field.lstrip('-') not in pk_names:
+            return None
+        return 'desc' if descending else 'asc'
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.pk_direction is None or number < KEYSET_MIN_PAGE:
+            return super().page(number)
+
+        lookup = 'pk__lt' if self.pk_direction == 'desc' else 'pk__gt'
+        boundary = self._boundary(number, lookup)
+        if boundary is PAST_END:
+            return self._get_page([], number, self)
+        rows = self.object_list if boundary is None else self.object_list.filter(**{lookup: boundary})
+        object_list = list(rows[:self.per_page])
+        if object_list:
+            self._remember(number + 1, object_list[-1].pk)
+        return self._get_page(object_list, number, self)
+
+    @cached_property
+    def _boundary_key(self):
+        return f'{query_key(self.object_list, "keyset")}:{self.per_page}'
+
+    def _page_key(self, number):
+        return f'{self._boundary_key}:{number}'
+
+    def _remember(self, number, pk):
+        caches[CACHE_ALIAS].set(self._page_key(number), pk, BOUNDARY_CACHE_TTL)
+
+    def _boundary(self, number, lookup):
+        """Last pk before page ``number``, from the nearest cached page boundary, or PAST_END"""
+        if number == 1:
+            return None
+        pages = range(number, max(1, number - KEYSET_LOOKBACK), -1)
+        cached = caches[CACHE_ALIAS].get_many([self._page_key(page) for page in pages])
+        known, pk = next(
+            ((page, cached[self._page_key(page)]) for page in pages if self._page_key(page) in cached), (1, None)
+        )
+        if known == number:
+            return pk
+
+        rows = self.object_list if pk is None else self.object_list.filter(**{lookup: pk})
+        # An index-only walk over the pages in between
+        skipped = rows.values_list('pk', flat=True)[(number - known) * self.per_page - 1:(number - known) * self.per_page]
+        skipped = list(skipped)
+        if not skipped:
+            return PAST_END
+        self._remember(number, skipped[0])
+        return skipped[0]
@@ -1,45 +1,402 @@
 import pandas as pd
 import numpy as np
+import itertools
+import logging
 import os
+import time
 import joblib
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
+from sklearn.neighbors import KDTree
 from django.conf import settings
+from health.flat_forest import FlatForest, load_if_current
+from health.ml_model import FLAT_MAX_ROWS
+from health.model_registry import model_registry
+from nutrilogic.caching import LRUCache
+
+from .meal_planner import PlanSearch
+from .meal_store import INDEX_COLUMNS, load_food_store, load_meal_table, load_nutrient_arrays, read_meals_csv
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_FACTORS = {
+    'S': 1.2,   # Sedentary
+    'L': 1.375, # Lightly active
+    'M': 1.55,  # Moderately active
+    'V': 1.725, # Very active
+    'E': 1.9    # Extra active
+}
+
+# Batch scoring: users per chunk and cap on the users x meals score matrix
+BATCH_CHUNK_SIZE = 4096
+BATCH_MAX_CELLS = 2_000_000
+
+# Meal plans: best-ranked dishes searched, allowed deviation from the daily
+# calorie target, and search time per plan in seconds
+PLAN_POOL_SIZE = 200
+PLAN_TOLERANCE = 0.1
+PLAN_TIME_BUDGET = 0.05
+
+MEALS_CSV = 'Indian_Food_Nutrition_Processed.csv'
+MEAL_MODEL = 'meal_classifier.pkl'
+MEAL_MODEL_COMPACT = 'meal_classifier.forest'  # Written by `manage.py export_compact_models`
+MEAL_CLASSIFIER = 'meal_classifier'  # Model registry name
+MEAL_TABLE = 'meal_table.npz'  # Built by `manage.py build_meal_table`
+MEAL_INDEX = 'meal_index'  # Memory-mapped nutrient arrays, same command
+
+# Store written by `manage.py ingest_foods`; when set it replaces the meal CSV
+FOOD_STORE = getattr(settings, 'MEAL_FOOD_STORE', None)
+
+RECOMMENDER_CACHE = getattr(settings, 'RECOMMENDER_CACHE', {})
+
+# Ranked results shared by every recommender in the process, keyed by the
+# derived nutritional targets rather than by user
+recommendation_cache = LRUCache(
+    max_entries=RECOMMENDER_CACHE.get('MAX_ENTRIES', 2048),
+    ttl=RECOMMENDER_CACHE.get('TTL', 600),
+    alias=RECOMMENDER_CACHE.get('ALIAS'),
+    namespace='recommendations',
+)
+
+
+# Distinct cache versions for recommenders built from in-memory tables
+_memory_versions = itertools.count(1)
+
+
+def data_path(filename):
+    return os.path.join(settings.BASE_DIR, 'meals', 'data', filename)
+
+
+def file_signature(*paths):
+    """Cheap change detector for data files: mtime and size of each path."""
+    parts = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            parts.append(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+        except OSError:
+            parts.append('missing')
+    return ':'.join(parts)
+
+
+def quantize_calories(target_calories):
+    """Round calorie targets to the configured cache bucket (0 = exact)."""
+    bucket = RECOMMENDER_CACHE.get('CALORIE_BUCKET', 0)
+    if not bucket:
+        return target_calories
+    return np.round(np.asarray(target_calories) / bucket) * bucket
+
+
+def recommendation_key(targets, data_version=None):
+    """
+    Cache key for a ranking: the ranking only depends on the meal data, the
+    macro caps, the weight-loss rules (from bmi_category and goal) and the
+    calorie target.
+    """
+    return (
+        data_version or recommendation_cache.version,
+        int(targets['max_fat']),
+        int(targets['max_carbs']),
+        bool(targets['weight_loss']),
+        float(quantize_calories(targets['target_calories'])),
+    )
+
+
+def train_meal_classifier(meals_data, n_estimators=100, n_jobs=None):
+    """
+    Fit the Light/Balanced/High-Calorie meal classifier.
+
+    Returns (model, held-out accuracy), or (None, None) with too little data.
+    """
+    data = meals_data.dropna(subset=['Calories', 'Protein', 'Fat', 'Carbs']).copy()
+    conditions = [
+        (data['Calories'] < 400),
+        (data['Calories'] >= 400) & (data['Calories'] < 600),
+        (data['Calories'] >= 600)
+    ]
+    choices = ['Light', 'Balanced', 'High-Calorie']
+    data['Meal_Category'] = np.select(conditions, choices, default='Balanced')
+    
+    X = data[['Calories', 'Protein', 'Fat', 'Carbs']]
+    y = data['Meal_Category']
+    
+    if len(X) <= 10:
+        return None, None
+    
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    model = RandomForestClassifier(n_estimators=n_estimators, random_state=42, n_jobs=n_jobs)
+    model.fit(X_train, y_train)
+    return model, model.score(X_test, y_test)
+
+
+def save_meal_classifier(model, model_path, metadata):
+    """
+    Publish a trained classifier.
+
+    A versioned copy is kept next to ``model_path`` for rollback, then
+    ``model_path`` itself is replaced atomically so a worker never reads a
+    half-written file.
+    """
+    artifact = {'model': model, 'metadata': metadata}
+    base, ext = os.path.splitext(model_path)
+    versioned_path = f"{base}-{metadata['version']}{ext}"
+    
+    for path in (versioned_path, model_path):
+        tmp_path = f'{path}.tmp-{os.getpid()}'
+        joblib.dump(artifact, tmp_path)
+        os.replace(tmp_path, path)
+    return versioned_path
+
+
+def load_meal_classifier(model_path):
+    """
+    Load a classifier artifact as (model, metadata).
+
+    Bare pickled models from before versioned artifacts have no metadata.
+    """
+    artifact = joblib.load(model_path)
+    if isinstance(artifact, dict) and 'model' in artifact:
+        return artifact['model'], artifact.get('metadata', {})
+    return artifact, {}
+
+
+def versioned_classifier_path(version):
+    """The copy save_meal_classifier keeps of ``version``, for pinning/rollback."""
+    base, ext = os.path.splitext(data_path(MEAL_MODEL))
+    return f"{base}-{version}{ext}"
+
+
+def _load_registered_classifier(paths):
+    """
+    Model registry loader: the classifier, its metadata and flat export.
+
+    A compact export of the current pickle is memory-mapped instead of
+    unpickling the forest; it is its own flat export. Pinned versions pass
+    only the pickle.
+    """
+    if len(paths) > 1:
+        try:
+            compact = load_if_current(paths[1], paths[0])
+        except Exception:
+            logger.exception('Could not load %s, using %s', paths[1], paths[0])
+            compact = None
+        if compact is not None:
+            metadata = compact.metadata.get('source_metadata', {})
+            return {'model': compact, 'metadata': metadata, 'flat': compact}, metadata.get('version')
+    if not os.path.exists(paths[0]):
+        raise FileNotFoundError(f'No meal classifier at {paths[0]}; run `manage.py train_meal_classifier`')
+    model, metadata = load_meal_classifier(paths[0])
+    flat = FlatForest.from_sklearn(model) if FlatForest.supports(model) else None
+    return {'model': model, 'metadata': metadata, 'flat': flat}, metadata.get('version')
+
+
+class NutrientIndex:
+    """
+    Immutable columnar view of the meal table, sorted by calories.
+
+    Built once when the recommender loads so that requests never copy or
+    scan the DataFrame: the calorie window is located by binary search and
+    the macro filters and scoring run on that slice only.
+    """
+    
+    def __init__(self, meals_data):
+        calories = meals_data['Calories'].to_numpy(dtype=np.float64)
+        # Stable sort keeps dataset order within equal calories; NaN goes last
+        order = np.argsort(calories, kind='stable')
+        
+        self.rows = self._freeze(order)  # Position in the source DataFrame
+        self.calories = self._freeze(calories[order])
+        self.protein = self._freeze(meals_data['Protein'].to_numpy(dtype=np.float64)[order])
+        self.fat = self._freeze(meals_data['Fat'].to_numpy(dtype=np.float64)[order])
+        self.carbs = self._freeze(meals_data['Carbs'].to_numpy(dtype=np.float64)[order])
+        # Object array here, a meal_store.NameTable when memory-mapped
+        self.names = self._freeze(meals_data['Dish Name'].to_numpy(dtype=object)[order])
+    
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Wrap prebuilt (typically memory-mapped) arrays from
+        ``meal_store.load_nutrient_arrays`` without copying them.
+        """
+        index = cls.__new__(cls)
+        for column in INDEX_COLUMNS + ('names',):
+            setattr(index, column, arrays[column])
+        return index
+    
+    def arrays(self):
+        """Columns for ``meal_store.save_nutrient_arrays``."""
+        return {column: getattr(self, column) for column in INDEX_COLUMNS + ('names',)}
+    
+    def name(self, position):
+        return self.names[position]
+    
+    @staticmethod
+    def _freeze(values):
+        values = np.ascontiguousarray(values)
+        values.flags.writeable = False
+        return values
+    
+    def __len__(self):
+        return len(self.calories)
+    
+    def calorie_window(self, low, high):
+        """Slice of index positions with ``low <= Calories <= high``."""
+        start = np.searchsorted(self.calories, low, side='left')
+        stop = np.searchsorted(self.calories, high, side='right')
+        return slice(int(start), int(max(start, stop)))
 
 
 class MealRecommender:
     def __init__(self):
-        self.meals_data = None
+        self._meals_data = None
         self.model = None
+        self.model_metadata = {}
+        self._served_model = None
+        self.index = None
+        self._macro_candidates = {}
+        self._similarity = None
+        self.data_version = None
+        self.watch_files = True
+        self._checked_at = 0.0
         self.load_data_and_model()
 
+    @classmethod
+    def from_dataframe(cls, meals_data, model=None):
+        """
+        Recommender over an in-memory meal table, e.g. for benchmarks.
+
+        Nothing is read from or watched on disk.
+        """
+        recommender = cls.__new__(cls)
+        recommender._meals_data = meals_data
+        recommender.model = model
+        recommender.model_metadata = {}
+        recommender._served_model = None
+        recommender.index = NutrientIndex(meals_data)
+        recommender._macro_candidates = {}
+        recommender._similarity = None
+        recommender.data_version = f'memory-{next(_memory_versions)}'
+        recommender.watch_files = False
+        recommender._checked_at = 0.0
+        return recommender
+
     def load_data_and_model(self):
         try:
-            csv_path = os.path.join(settings.BASE_DIR, 'meals', 'data', 'Indian_Food_Nutrition_Processed.csv')
-            self.meals_data = pd.read_csv(csv_path)
-            
-            # Clean column names
-            self.meals_data.columns = self.meals_data.columns.str.strip()
-            
-            # Rename columns
-            column_renames = {
-                'Calories (kcal)': 'Calories',
-                'Protein (g)': 'Protein',
-                'Fats (g)': 'Fat',
-                'Carbohydrates (g)': 'Carbs'
-            }
-            self.meals_data = self.meals_data.rename(columns=column_renames)
+            csv_path = data_path(MEALS_CSV)
+            self.data_version = file_signature(self.source_path())
             
-            # Load model
-            model_path = os.path.join(settings.BASE_DIR, 'meals', 'data', 'meal_classifier.pkl')
-            if os.path.exists(model_path):
-                self.model = joblib.load(model_path)
+            # Rank from the shared memory-mapped arrays when they are fresh;
+            # the DataFrame itself is then only read if something asks for it
+            if FOOD_STORE:
+                arrays = load_food_store(FOOD_STORE)
+                if arrays is None:
+                    raise ValueError(f"Food store {FOOD_STORE} is missing or unreadable")
             else:
-                self.train_model()
+                arrays = load_nutrient_arrays(data_path(MEAL_INDEX), csv_path)
+            if arrays is not None:
+                self._meals_data = None
+                self.index = NutrientIndex.from_arrays(arrays)
+            else:
+                self._meals_data = self.read_meals_data()
+                self.index = NutrientIndex(self._meals_data)
+            
+            self.load_model()
                 
         except Exception as e:
             print(f"Error loading data: {e}")
             self.create_fallback_data()
+            self.data_version = 'fallback'
+            self.index = NutrientIndex(self.meals_data)
+        
+        self._macro_candidates = {}
+        self._similarity = None
+        self._checked_at = time.monotonic()
+        recommendation_cache.set_version(self.data_version)
+
+    def load_model(self):
+        # Training happens offline (`manage.py train_meal_classifier`), never here;
+        # the model registry reloads published versions in the background
+        entry = model_registry.register(
+            MEAL_CLASSIFIER, [data_path(MEAL_MODEL), data_path(MEAL_MODEL_COMPACT)], _load_registered_classifier,
+            versioned_path=versioned_classifier_path,
+        )
+        # A missing classifier is logged by the registry with the error below
+        self.use_model(entry.get())
+
+    def use_model(self, loaded):
+        """Serve a registry LoadedModel (None clears the classifier)."""
+        self._served_model = loaded
+        if loaded is None:
+            self._model, self.flat_model, self.model_metadata = None, None, {}
+        else:
+            self._model = loaded.model['model']
+            self.flat_model = loaded.model['flat']
+            self.model_metadata = loaded.model['metadata']
+
+    @staticmethod
+    def source_path():
+        """File whose changes mean the meal data must be reloaded."""
+        if FOOD_STORE:
+            return os.path.join(FOOD_STORE, 'meta.json')
+        return data_path(MEALS_CSV)
+
+    @property
+    def meals_data(self):
+        if self._meals_data is None and self.watch_files and self.data_version not in (None, 'fallback'):
+            if FOOD_STORE:
+                self._meals_data = self.index_dataframe()
+            else:
+                self._meals_data = self.read_meals_data()
+        return self._meals_data
+    
+    def index_dataframe(self):
+        """The indexed nutrient columns as a DataFrame, in dataset order."""
+        index = self.index
+        order = np.argsort(index.rows)
+        return pd.DataFrame({
+            'Dish Name': [index.name(i) for i in order],
+            'Calories': index.calories[order],
+            'Protein': index.protein[order],
+            'Fat': index.fat[order],
+            'Carbs': index.carbs[order],
+        })
+    
+    @meals_data.setter
+    def meals_data(self, value):
+        self._meals_data = value
+    
+    @staticmethod
+    def read_meals_data():
+        # Prefer the preprocessed table; parse the CSV only if it is stale
+        csv_path = data_path(MEALS_CSV)
+        meals_data = load_meal_table(data_path(MEAL_TABLE), csv_path)
+        if meals_data is None:
+            meals_data = read_meals_csv(csv_path)
+        return meals_data
+    
+    def refresh_if_changed(self):
+        """
+        Reload the meal data when its files change on disk, and follow the
+        classifier version the model registry is serving.
+
+        Data files are checked at most once per CHECK_INTERVAL seconds; a
+        reload moves the recommendation cache to the new data version.
+        """
+        if not self.watch_files:
+            return
+        if MEAL_CLASSIFIER in model_registry:
+            loaded = model_registry[MEAL_CLASSIFIER].get()
+            if loaded is not None and loaded is not self._served_model:
+                self.use_model(loaded)
+
+        now = time.monotonic()
+        if now - self._checked_at < RECOMMENDER_CACHE.get('CHECK_INTERVAL', 30):
+            return
+        self._checked_at = now
+        
+        signature = file_signature(self.source_path())
+        if self.data_version != 'fallback' and signature != self.data_version:
+            self.load_data_and_model()
 
     def create_fallback_data(self):
         self.meals_data = pd.DataFrame({
@@ -54,24 +411,38 @@ class MealRecommender:
         if self.meals_data is None or self.meals_data.empty:
             return
         
-        data = self.meals_data.dropna(subset=['Calories', 'Protein', 'Fat', 'Carbs'])
-        conditions = [
-            (data['Calories'] < 400),
-            (data['Calories'] >= 400) & (data['Calories'] < 600),
-            (data['Calories'] >= 600)
-        ]
-        choices = ['Light', 'Balanced', 'High-Calorie']
-        data['Meal_Category'] = np.select(conditions, choices, default='Balanced')
-        
-        X = data[['Calories', 'Protein', 'Fat', 'Carbs']]
-        y = data['Meal_Category']
-        
-        if len(X) > 10:
-            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-            self.model = RandomForestClassifier(n_estimators=100, random_state=42)
-            self.model.fit(X_train, y_train)
+        model, _ = train_meal_classifier(self.meals_data)
+        if model is not None:
+            self.model = model
+
+    @property
+    def model(self):
+        return self._model
 
-    def calculate_bmi_category(self, height, weight):
+    @model.setter
+    def model(self, model):
+        # Exported once per model so classify_meals skips sklearn's per-call overhead
+        self._model = model
+        if isinstance(model, FlatForest):
+            self.flat_model = model
+        else:
+            self.flat_model = FlatForest.from_sklearn(model) if FlatForest.supports(model) else None
+
+    def classify_meals(self, nutrients):
+        """
+        Light/Balanced/High-Calorie category for rows of (Calories, Protein, Fat, Carbs).
+
+        Same labels as ``self.model.predict``; returns None without a model.
+        """
+        if self.model is None:
+            return None
+        nutrients = np.asarray(nutrients, dtype=float).reshape(-1, 4)
+        if self.flat_model is not None and len(nutrients) <= FLAT_MAX_ROWS:
+            return self.flat_model.predict(nutrients)
+        return self.model.predict(pd.DataFrame(nutrients, columns=['Calories', 'Protein', 'Fat', 'Carbs']))
+
+    @staticmethod
+    def calculate_bmi_category(height, weight):
         if height <= 0 or weight <= 0:
             return 'Normal'
         bmi = weight / ((height/100) ** 2)
@@ -84,10 +455,14 @@ class MealRecommender:
         else:
             return 'Obese'
 
-    def get_recommendations(self, user_data, num_recommendations=15):
-        if self.meals_data is None or self.meals_data.empty:
-            return []
-        
+    @staticmethod
+    def calculate_targets(user_data):
+        """
+        Derive the nutritional targets that drive the ranking.
+
+        Returns a dict with 'bmi_category', 'goal', 'target_calories',
+        'max_fat', 'max_carbs' and 'weight_loss'.
+        """
         # Extract user data (must be provided, no defaults)
         age = user_data['age']
         gender = user_data['gender']
@@ -97,22 +472,14 @@ class MealRecommender:
         activity_level = user_data.get('activity_level', 'M')
         
         # Calculate BMI category
-        bmi_category = self.calculate_bmi_category(height, weight)
+        bmi_category = MealRecommender.calculate_bmi_category(height, weight)
         
         if gender == 'Male':
             bmr = 88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age)
         else:
             bmr = 447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age)
         
-        # Activity factor
-        activity_factors = {
-            'S': 1.2,   # Sedentary
-            'L': 1.375, # Lightly active
-            'M': 1.55,  # Moderately active
-            'V': 1.725, # Very active
-            'E': 1.9    # Extra active
-        }
-        tdee = bmr * activity_factors.get(activity_level, 1.2)
+        tdee = bmr * ACTIVITY_FACTORS.get(activity_level, 1.2)
         
         # Adjust target calories based on goal and BMI
         if bmi_category == 'Underweight' or goal == 'G':
@@ -128,71 +495,441 @@ class MealRecommender:
             max_fat = 50   # Moderate fat
             max_carbs = 130  # Moderate carbs
         
-        # Filter meals by calories
-        filtered_meals = self.meals_data.copy()
-        calorie_range = target_calories * 0.3  # Per meal target
+        return {
+            'bmi_category': bmi_category,
+            'goal': goal,
+            'target_calories': target_calories,
+            'max_fat': max_fat,
+            'max_carbs': max_carbs,
+            'weight_loss': bmi_category in ['Obese', 'Overweight'] or goal == 'L',
+        }
+
+    def calculate_targets_batch(self, profiles):
+        """
+        Vectorized ``calculate_targets`` for a list of user_data dicts.
+
+        Returns a dict of arrays (one entry per profile) with the same keys.
+        """
+        age = np.array([p['age'] for p in profiles], dtype=np.float64)
+        male = np.array([p['gender'] == 'Male' for p in profiles], dtype=bool)
+        height = np.array([p['height'] for p in profiles], dtype=np.float64)
+        weight = np.array([p['weight'] for p in profiles], dtype=np.float64)
+        goal = np.array([p.get('goal', 'M') for p in profiles], dtype=object)
+        activity = np.array(
+            [ACTIVITY_FACTORS.get(p.get('activity_level', 'M'), 1.2) for p in profiles],
+            dtype=np.float64,
+        )
         
-        filtered_meals = filtered_meals[
-            (filtered_meals['Calories'] >= calorie_range * 0.4) &
-            (filtered_meals['Calories'] <= calorie_range * 1.2)
-        ]
+        # BMI category, same thresholds as calculate_bmi_category
+        valid = (height > 0) & (weight > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bmi = weight / ((height / 100) ** 2)
+        bmi_category = np.select(
+            [~valid, bmi < 18.5, bmi < 25, bmi < 30],
+            ['Normal', 'Underweight', 'Normal', 'Overweight'],
+            default='Obese',
+        ).astype(object)
         
-        # CRITICAL: Filter for LOW FAT, LOW CARB, HIGH PROTEIN foods
-        if bmi_category in ['Obese', 'Overweight'] or goal == 'L':
-            # Strict filtering for weight loss
-            filtered_meals = filtered_meals[
-                (filtered_meals['Fat'] <= max_fat) &
-                (filtered_meals['Carbs'] <= max_carbs) &
-                (filtered_meals['Protein'] >= 10)  # MINIMUM 10g protein
-            ]
+        bmr = np.where(
+            male,
+            88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age),
+            447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age),
+        )
+        tdee = bmr * activity
+        
+        overweight = (bmi_category == 'Obese') | (bmi_category == 'Overweight')
+        gain = (bmi_category == 'Underweight') | (goal == 'G')
+        lose = ~gain & (overweight | (goal == 'L'))
+        
+        return {
+            'bmi_category': bmi_category,
+            'goal': goal,
+            'target_calories': np.where(gain, tdee * 1.15, np.where(lose, tdee * 0.75, tdee)),
+            'max_fat': np.where(gain, 100, np.where(lose, 30, 50)),
+            'max_carbs': np.where(gain, 300, np.where(lose, 80, 130)),
+            'weight_loss': overweight | (goal == 'L'),
+        }
+
+    def get_recommendations(self, user_data, num_recommendations=15):
+        """
+        The best ``num_recommendations`` meals for ``user_data``.
+
+        Meals tied on both health score and protein ratio come in dataset
+        order; the original pandas sort left their order unspecified.
+        """
+        if self.index is None or len(self.index) == 0:
+            return []
+        
+        self.refresh_if_changed()
+        targets = self.calculate_targets(user_data)
+        
+        # Entries remember how many results were ranked; a shorter list than
+        # that means every matching meal is already in it
+        key = recommendation_key(targets, self.data_version)
+        cached = recommendation_cache.get(key)
+        if cached is not None and (cached[0] >= num_recommendations or len(cached[1]) < cached[0]):
+            positions = cached[1]
+        else:
+            calorie_range = quantize_calories(targets['target_calories']) * 0.3  # Per meal target
+            positions = self.rank_meals(
+                calorie_range, targets['max_fat'], targets['max_carbs'], targets['weight_loss'],
+                limit=num_recommendations
+            )
+            recommendation_cache.set(key, (num_recommendations, positions))
+        
+        return self.format_recommendations(positions[:num_recommendations], targets)
+
+    def get_recommendations_batch(self, profiles, num_recommendations=15,
+                                  chunk_size=BATCH_CHUNK_SIZE, max_cells=BATCH_MAX_CELLS):
+        """
+        Recommendations for many users in one vectorized pass.
+
+        Args:
+            profiles: iterable of user_data dicts, as for get_recommendations
+            chunk_size: users scored together against the meal table
+            max_cells: upper bound on the users x meals score matrix size
+
+        Returns:
+            list with one recommendation list per profile, equal to what
+            get_recommendations returns for that profile
+        """
+        profiles = list(profiles)
+        results = [[] for _ in profiles]
+        if not profiles or self.index is None or len(self.index) == 0:
+            return results
+        
+        targets = self.calculate_targets_batch(profiles)
+        calorie_range = quantize_calories(targets['target_calories']) * 0.3  # Per meal target
+        
+        # Users sharing macro caps share the static part of the filter, and
+        # sorting them by calorie target keeps each chunk's window narrow
+        regimes = np.stack([targets['max_fat'], targets['max_carbs'], targets['weight_loss']], axis=1)
+        for regime in np.unique(regimes, axis=0):
+            max_fat, max_carbs, weight_loss = int(regime[0]), int(regime[1]), bool(regime[2])
+            users = np.flatnonzero((regimes == regime).all(axis=1))
+            users = users[np.argsort(calorie_range[users], kind='stable')]
             
-            # Calculate health score (lower is better for weight loss)
-            # HEAVILY prioritize high protein, penalize fat and carbs
-            filtered_meals['health_score'] = (
-                (filtered_meals['Fat'] * 3.0) +          # Penalize fat VERY heavily
-                (filtered_meals['Carbs'] * 2.0) -        # Penalize carbs heavily
-                (filtered_meals['Protein'] * 5.0) +      # Reward protein MASSIVELY
-                abs(filtered_meals['Calories'] - calorie_range) * 0.1
+            positions = self.macro_candidates(max_fat, max_carbs, weight_loss)
+            for start in range(0, len(users), chunk_size):
+                chunk = users[start:start + chunk_size]
+                ranked = self._rank_chunk(
+                    positions, calorie_range[chunk], weight_loss, num_recommendations, max_cells
+                )
+                for user, user_positions in zip(chunk, ranked):
+                    results[user] = self.format_recommendations(user_positions, {
+                        'bmi_category': targets['bmi_category'][user],
+                        'goal': targets['goal'][user],
+                        'target_calories': targets['target_calories'][user],
+                        'max_fat': max_fat,
+                        'max_carbs': max_carbs,
+                    })
+        
+        return results
+
+    def _rank_chunk(self, positions, calorie_range, weight_loss, num_recommendations, max_cells):
+        """Top ``num_recommendations`` index positions for each calorie target."""
+        ranked = [positions[:0]] * len(calorie_range)
+        if num_recommendations <= 0 or positions.size == 0:
+            return ranked
+        
+        # Union of the users' calorie windows within the macro candidates
+        calories = self.index.calories[positions]
+        lo = np.searchsorted(calories, calorie_range.min() * 0.4, side='left')
+        hi = np.searchsorted(calories, calorie_range.max() * 1.2, side='right')
+        if hi <= lo:
+            return ranked
+        positions = positions[lo:hi]
+        calories = calories[lo:hi]
+        rows = self.index.rows[positions]
+        protein_ratio = (self.index.protein[positions].astype(np.float64) / calories) * 100
+        
+        block = max(1, max_cells // len(positions))
+        k = min(num_recommendations, len(positions))
+        for start in range(0, len(calorie_range), block):
+            targets = calorie_range[start:start + block, None]
+            in_window = (calories >= targets * 0.4) & (calories <= targets * 1.2)
+            health_score = self.score_meals(positions, targets, weight_loss)
+            health_score[~in_window] = np.inf
+            
+            # Everything scoring at or below the k-th best score, ties included,
+            # then one lexsort orders all users' shortlists at once
+            kth = np.partition(health_score, k - 1, axis=1)[:, k - 1:k]
+            user, meal = np.nonzero(in_window & (health_score <= kth))
+            order = np.lexsort((rows[meal], -protein_ratio[meal], health_score[user, meal], user))
+            user, meal = user[order], meal[order]
+            
+            first = np.searchsorted(user, np.arange(len(targets)), side='left')
+            keep = np.arange(len(user)) - first[user] < num_recommendations
+            user, meal = user[keep], meal[keep]
+            bounds = np.searchsorted(user, np.arange(len(targets) + 1), side='left')
+            for i in range(len(targets)):
+                ranked[start + i] = positions[meal[bounds[i]:bounds[i + 1]]]
+        
+        return ranked
+
+    def get_meal_plan(self, user_data, meals_per_day=3, days=1, tolerance=PLAN_TOLERANCE,
+                      time_budget=PLAN_TIME_BUDGET, pool_size=PLAN_POOL_SIZE):
+        """
+        Assemble whole days of dishes that add up to the user's calorie target.
+
+        Every dish passes the same macro caps as the ranking; each day's
+        calories land within ``tolerance`` of target_calories, and among
+        those plans the one with the lowest summed health score is chosen.
+        Dishes are not repeated within the plan. The search is bounded by
+        ``time_budget`` seconds for the whole plan and returns the best plan
+        found so far when it runs out.
+
+        Returns:
+            dict with 'days' (one per requested day, each with 'meals' and
+            daily totals, or None for a day no combination of the remaining
+            dishes fits), 'optimal' (every day searched exhaustively) and
+            'elapsed_ms'
+        """
+        started = time.perf_counter()
+        targets = self.calculate_targets(user_data)
+        plan = {'days': [], 'optimal': True, 'elapsed_ms': 0.0}
+        if self.index is None or len(self.index) == 0:
+            return plan
+        
+        # Search pool: the best-ranked dishes for an even split of the day
+        calorie_range = targets['target_calories'] / meals_per_day  # Per meal target
+        pool = self.rank_meals(
+            calorie_range, targets['max_fat'], targets['max_carbs'], targets['weight_loss'],
+            limit=pool_size
+        )
+        scores = self.score_meals(pool, calorie_range, targets['weight_loss'])
+        low = targets['target_calories'] * (1 - tolerance)
+        high = targets['target_calories'] * (1 + tolerance)
+        
+        available = np.ones(len(pool), dtype=bool)
+        for day in range(days):
+            # Split what is left of the budget evenly over the remaining days
+            remaining = time_budget - (time.perf_counter() - started)
+            deadline = time.perf_counter() + max(remaining, 0) / (days - day)
+            
+            candidates = np.flatnonzero(available)
+            order = candidates[np.argsort(scores[candidates], kind='stable')]
+            search = PlanSearch(
+                scores[order], self.index.calories[pool[order]], meals_per_day, low, high, deadline
             )
+            chosen, complete = search.run()
+            plan['optimal'] = plan['optimal'] and complete
+            if chosen is None:
+                plan['days'].append(None)
+                continue
+            
+            chosen = order[chosen]
+            available[chosen] = False
+            positions = pool[chosen]
+            plan['days'].append({
+                'meals': self.format_recommendations(positions, targets),
+                'calories': int(self.index.calories[positions].sum()),
+                'protein': float(self.index.protein[positions].sum()),
+                'carbs': float(self.index.carbs[positions].sum()),
+                'fat': float(self.index.fat[positions].sum()),
+                'health_score': float(scores[chosen].sum()),
+            })
+        
+        plan['elapsed_ms'] = (time.perf_counter() - started) * 1000
+        return plan
+
+    def similar_dishes(self, name, k=5, user_data=None):
+        """
+        Dishes nutritionally closest to ``name``, for swapping a recommendation.
+
+        Distance is Euclidean over standardized (Calories, Protein, Fat,
+        Carbs). With ``user_data`` only dishes that pass that user's macro
+        caps and weight-loss/maintenance protein rule are returned.
+
+        Returns a list of dicts like the recommendations plus 'distance',
+        nearest first; empty if the dish is unknown or lacks nutrients.
+        """
+        similarity = self._similarity_index()
+        position = similarity['positions_by_name'].get(name)
+        if position is None or k <= 0:
+            return []
+        
+        index = self.index
+        point = (
+            np.array([[index.calories[position], index.protein[position],
+                       index.fat[position], index.carbs[position]]]) - similarity['mean']
+        ) / similarity['scale']
+        if np.isnan(point).any():
+            return []
+        
+        if user_data is None:
+            tree, positions = similarity['tree'], similarity['positions']
         else:
-            # Normal filtering - still prioritize protein
-            filtered_meals = filtered_meals[
-                (filtered_meals['Fat'] <= max_fat) &
-                (filtered_meals['Carbs'] <= max_carbs) &
-                (filtered_meals['Protein'] >= 8)  # MINIMUM 8g protein
-            ]
+            targets = self.calculate_targets(user_data)
+            tree, positions = self._regime_tree(targets['max_fat'], targets['max_carbs'], targets['weight_loss'])
+        if len(positions) == 0:
+            return []
+        
+        distances, rows = tree.query(point, k=min(len(positions), k + 1))
+        neighbours = positions[rows[0]]
+        keep = neighbours != position
+        
+        results = []
+        for i, distance in zip(neighbours[keep][:k], distances[0][keep][:k]):
+            results.append({
+                'name': index.name(i),
+                'calories': int(index.calories[i]),
+                'protein': float(index.protein[i]),
+                'carbs': float(index.carbs[i]),
+                'fat': float(index.fat[i]),
+                'distance': float(distance),
+            })
+        return results
+
+    def _similarity_index(self):
+        """
+        KD-tree over standardized macro vectors, built once per loaded index
+        on first use so worker start-up does not pay for it.
+        """
+        if self._similarity is None:
+            index = self.index
+            vectors = np.column_stack([index.calories, index.protein, index.fat, index.carbs])
+            positions = np.flatnonzero(~np.isnan(vectors).any(axis=1))
+            vectors = vectors[positions]
             
-            # Balanced score - still favor protein
-            filtered_meals['health_score'] = (
-                (filtered_meals['Fat'] * 1.5) +          # Penalize fat moderately
-                (filtered_meals['Carbs'] * 1.0) -        # Penalize carbs lightly
-                (filtered_meals['Protein'] * 3.0) +      # Reward protein heavily
-                abs(filtered_meals['Calories'] - calorie_range) * 0.2
-            )
+            mean = vectors.mean(axis=0) if len(vectors) else np.zeros(4)
+            scale = vectors.std(axis=0) if len(vectors) else np.ones(4)
+            scale[scale == 0] = 1.0
+            points = (vectors - mean) / scale
+            
+            positions_by_name = {}
+            for position in range(len(index) - 1, -1, -1):
+                positions_by_name[index.name(position)] = position
+            
+            self._similarity = {
+                'tree': KDTree(points if len(points) else np.zeros((1, 4))),
+                'points': points,
+                'positions': positions,
+                'mean': mean,
+                'scale': scale,
+                'positions_by_name': positions_by_name,
+                'regimes': {},
+            }
+        return self._similarity
+
+    def _regime_tree(self, max_fat, max_carbs, weight_loss):
+        """KD-tree restricted to the dishes passing one set of macro rules."""
+        similarity = self._similarity_index()
+        key = (max_fat, max_carbs, weight_loss)
+        if key not in similarity['regimes']:
+            allowed = self.macro_candidates(max_fat, max_carbs, weight_loss)
+            rows = np.flatnonzero(np.isin(similarity['positions'], allowed))
+            points = similarity['points'][rows]
+            tree = KDTree(points if len(points) else np.zeros((1, 4)))
+            similarity['regimes'][key] = (tree, similarity['positions'][rows])
+        return similarity['regimes'][key]
+
+    def format_recommendations(self, positions, targets):
+        """Build the recommendation dicts for index ``positions``."""
+        index = self.index
+        recommendations = []
+        for i in positions:
+            recommendations.append({
+                'name': index.name(i),
+                'calories': int(index.calories[i]),
+                'protein': float(index.protein[i]),
+                'carbs': float(index.carbs[i]),
+                'fat': float(index.fat[i]),
+                'bmi_category': targets['bmi_category'],
+                'target_calories': int(targets['target_calories']),
+                'goal': targets['goal'],
+                'max_fat': targets['max_fat'],
+                'max_carbs': targets['max_carbs']
+            })
+        return recommendations
+
+    def rank_meals(self, calorie_range, max_fat, max_carbs, weight_loss, limit=None):
+        """
+        Rank the meals that pass the calorie window and macro caps.
+
+        Meals are ordered by health score, then by protein-to-calorie ratio
+        (highest first), then by their position in the dataset. With a
+        ``limit`` only the best ``limit`` meals are selected and sorted.
+
+        Returns positions into ``self.index``, best first.
+        """
+        index = self.index
+        
+        # Filter meals by calories (binary search on the calorie-sorted index)
+        window = index.calorie_window(calorie_range * 0.4, calorie_range * 1.2)
+        mask = self.macro_mask(
+            index.protein[window], index.fat[window], index.carbs[window],
+            max_fat, max_carbs, weight_loss
+        )
+        candidates = np.flatnonzero(mask) + window.start
+        if candidates.size == 0:
+            return candidates
         
         # Sort by health score (lower is better = high protein, low fat/carbs)
-        filtered_meals = filtered_meals.sort_values('health_score')
+        health_score = self.score_meals(candidates, calorie_range, weight_loss)
         
-        # Additional protein ranking: calculate protein-to-calorie ratio
-        if not filtered_meals.empty:
-            filtered_meals['protein_ratio'] = (filtered_meals['Protein'] / filtered_meals['Calories']) * 100
-            # Re-sort with protein ratio as secondary sort
-            filtered_meals = filtered_meals.sort_values(['health_score', 'protein_ratio'], ascending=[True, False])
+        if limit is not None and limit < candidates.size:
+            if limit <= 0:
+                return candidates[:0]
+            # Partial selection: keep everything scoring at or below the
+            # limit-th best score (ties included) and sort only that
+            kth = np.partition(health_score, limit - 1)[limit - 1]
+            shortlist = health_score <= kth
+            candidates = candidates[shortlist]
+            health_score = health_score[shortlist]
         
-        recommendations = []
-        if not filtered_meals.empty:
-            for _, meal in filtered_meals.head(num_recommendations).iterrows():
-                recommendations.append({
-                    'name': meal['Dish Name'],
-                    'calories': int(meal['Calories']),
-                    'protein': float(meal['Protein']),
-                    'carbs': float(meal['Carbs']),
-                    'fat': float(meal['Fat']),
-                    'bmi_category': bmi_category,
-                    'target_calories': int(target_calories),
-                    'goal': goal,
-                    'max_fat': max_fat,
-                    'max_carbs': max_carbs
-                })
-        
-        return recommendations
\ No newline at end of file
+        # Additional protein ranking: protein-to-calorie ratio as secondary sort
+        protein_ratio = (
+            index.protein[candidates].astype(np.float64) / index.calories[candidates]
+        ) * 100
+        order = np.lexsort((index.rows[candidates], -protein_ratio, health_score))
+        return candidates[order[:limit]]
+
+    def macro_candidates(self, max_fat, max_carbs, weight_loss):
+        """Index positions passing the macro caps, still sorted by calories."""
+        key = (max_fat, max_carbs, weight_loss)
+        if key not in self._macro_candidates:
+            index = self.index
+            mask = self.macro_mask(index.protein, index.fat, index.carbs, max_fat, max_carbs, weight_loss)
+            self._macro_candidates[key] = np.flatnonzero(mask)
+        return self._macro_candidates[key]
+
+    @staticmethod
+    def macro_mask(protein, fat, carbs, max_fat, max_carbs, weight_loss):
+        # CRITICAL: Filter for LOW FAT, LOW CARB, HIGH PROTEIN foods
+        if weight_loss:
+            # Strict filtering for weight loss: MINIMUM 10g protein
+            return (fat <= max_fat) & (carbs <= max_carbs) & (protein >= 10)
+        # Normal filtering - still prioritize protein: MINIMUM 8g protein
+        return (fat <= max_fat) & (carbs <= max_carbs) & (protein >= 8)
+
+    def score_meals(self, positions, calorie_range, weight_loss):
+        """
+        Health score of the meals at ``positions`` (lower is better).
+
+        ``calorie_range`` may be a column of per-user targets, in which case
+        a users x meals score matrix is returned.
+        """
+        index = self.index
+        # Stores ingested from external databases keep float32 columns;
+        # score in float64 either way
+        calories = index.calories[positions].astype(np.float64, copy=False)
+        protein = index.protein[positions].astype(np.float64, copy=False)
+        fat = index.fat[positions].astype(np.float64, copy=False)
+        carbs = index.carbs[positions].astype(np.float64, copy=False)
+        
+        if weight_loss:
+            # HEAVILY prioritize high protein, penalize fat and carbs
+            return (
+                (fat * 3.0) +          # Penalize fat VERY heavily
+                (carbs * 2.0) -        # Penalize carbs heavily
+                (protein * 5.0) +      # Reward protein MASSIVELY
+                np.abs(calories - calorie_range) * 0.1
+            )
+        # Balanced score - still favor protein
+        return (
+            (fat * 1.5) +          # Penalize fat moderately
+            (carbs * 1.0) -        # Penalize carbs lightly
+            (protein * 3.0) +      # Reward protein heavily
+            np.abs(calories - calorie_range) * 0.2
+        )
@@ -0,0 +1,230 @@
+"""
+Daily rollups of the admin dashboard metrics.
+
+Each DailyRollup row holds the count (and amount, for payments) of one
+metric on one day for one dimension value, e.g. predictions on 2024-03-10
+for ``obesity/H``. Signal handlers (connected in signals.py) apply every
+save and delete as an increment once the transaction commits, so the
+dashboard reads O(days) rows instead of scanning the source tables.
+
+Bulk operations (``bulk_create``, ``QuerySet.update``/``delete``) send no
+signals: call ``record_created`` after a ``bulk_create``, or repair the
+affected days with ``manage.py rebuild_rollups``.
+"""
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+DIMENSION_SEPARATOR = '/'
+UNCHANGED = object()  # Key of an instance saved without touching the rollup fields
+
+
+class RollupSource:
+    """
+    A model counted per day: the first of ``date_fields`` it has, the
+    fields whose values make up the dimension and an optional summed field.
+    """
+
+    def __init__(self, metric, model, date_fields, dimensions=(), amount=None):
+        self.metric = metric
+        self.model_label = model
+        self.date_fields = date_fields
+        self.dimensions = dimensions
+        self.amount = amount
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    @property
+    def date_field(self):
+        for name in self.date_fields:
+            try:
+                self.model._meta.get_field(name)
+                return name
+            except FieldDoesNotExist:
+                continue
+        raise FieldDoesNotExist(f'{self.model_label} has none of the fields {self.date_fields}')
+
+    @property
+    def fields(self):
+        """The fields the key is built from"""
+        return {self.date_field, *self.dimensions, *([self.amount] if self.amount else [])}
+
+    @property
+    def is_datetime(self):
+        return isinstance(self.model._meta.get_field(self.date_field), models.DateTimeField)
+
+    def key(self, instance):
+        """(date, dimension, amount) the instance counts towards, or None without a date"""
+        day = getattr(instance, self.date_field, None)
+        if day is None:
+            return None
+        return (
+            rollup_date(day),
+            DIMENSION_SEPARATOR.join(str(getattr(instance, name)) for name in self.dimensions),
+            Decimal(getattr(instance, self.amount) or 0) if self.amount else Decimal(0),
+        )
+
+    def stored_key(self, pk):
+        """The key of row ``pk`` as stored in the database, None if there is no such row"""
+        row = self.model._base_manager.filter(pk=pk).values(*self.fields).first()
+        return None if row is None else self.key(SimpleNamespace(**row))
+
+
+ROLLUP_SOURCES = [
+    RollupSource('users', 'auth.User', ('date_joined',)),
+    RollupSource('meal_plans', 'meals.MealPlan', ('date',)),
+    RollupSource('predictions', 'health.HealthPrediction', ('prediction_date',),
+                 dimensions=('condition_type', 'risk_level')),
+    RollupSource('subscriptions', 'premium.Subscription', ('start_date', 'created_at'), dimensions=('status',)),
+    RollupSource('payments', 'premium.Payment', ('payment_date', 'created_at'), dimensions=('status',),
+                 amount='amount'),
+]
+
+
+def rollup_date(value):
+    """Day of a date or datetime in the current time zone, as ``__date`` lookups use"""
+    if isinstance(value, datetime):
+        return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    return value
+
+
+def split_dimension(dimension):
+    return dimension.split(DIMENSION_SEPARATOR)
+
+
+def increment(metric, deltas):
+    """
+    Add ``deltas`` ({(date, dimension): (count, amount)}) to the rollup rows.
+
+    Uses F() updates, so concurrent writers never lose increments.
+    """
+    from .models import DailyRollup
+
+    for (day, dimension), (count, amount) in deltas.items():
+        if not count and not amount:
+            continue
+        rows = DailyRollup.objects.filter(date=day, metric=metric, dimension=dimension)
+        if rows.update(count=F('count') + count, amount=F('amount') + amount):
+            continue
+        try:
+            with transaction.atomic():
+                DailyRollup.objects.create(date=day, metric=metric, dimension=dimension, count=count, amount=amount)
+        except IntegrityError:
+            # Another writer created the row first
+            rows.update(count=F('count') + count, amount=F('amount') + amount)
+
+
+def apply_change(source, old, new):
+    """Move one row's contribution from the ``old`` key to the ``new`` one after commit."""
+    if old == new:
+        return
+    deltas = defaultdict(lambda: (0, Decimal(0)))
+    for key, sign in ((old, -1), (new, 1)):
+        if key is not None:
+            day, dimension, amount = key
+            count, total = deltas[day, dimension]
+            deltas[day, dimension] = (count + sign, total + sign * amount)
+    transaction.on_commit(lambda: increment(source.metric, dict(deltas)))
+
+
+def record_created(metric, instances):
+    """Count rows inserted with bulk_create, which sends no post_save."""
+    source = next(source for source in ROLLUP_SOURCES if source.metric == metric)
+    deltas = defaultdict(lambda: (0, Decimal(0)))
+    for instance in instances:
+        key = source.key(instance)
+        if key is not None:
+            day, dimension, amount = key
+            count, total = deltas[day, dimension]
+            deltas[day, dimension] = (count + 1, total + amount)
+    transaction.on_commit(lambda: increment(metric, dict(deltas)))
+
+
+def track(source):
+    """pre_save/post_save/pre_delete/post_delete receivers maintaining ``source``'s rollup"""
+
+    def before_save(sender, instance, update_fields=None, **kwargs):
+        # The stored key, to move the count when the date or dimension changes;
+        # only updates read it (one query on the key's fields), loading rows
+        # costs nothing. An instance saved with deferred fields only updates
+        # the loaded ones, which Django passes as update_fields.
+        if instance.pk is None:
+            instance._rollup_key = None
+        elif update_fields is not None and not source.fields & set(update_fields):
+            instance._rollup_key = UNCHANGED
+        else:
+            instance._rollup_key = source.stored_key(instance.pk)
+
+    def saved(sender, instance, created, **kwargs):
+        old = None if created else getattr(instance, '_rollup_key', None)
+        if old is not UNCHANGED:
+            apply_change(source, old, source.key(instance))
+
+    def before_delete(sender, instance, **kwargs):
+        # Deferred fields cannot be read once the row is gone
+        if source.fields & instance.get_deferred_fields():
+            instance._rollup_key = source.stored_key(instance.pk)
+        else:
+            instance._rollup_key = source.key(instance)
+
+    def deleted(sender, instance, **kwargs):
+        apply_change(source, getattr(instance, '_rollup_key', None), None)
+
+    return before_save, saved, before_delete, deleted
+
+
+def rebuild(source, start=None, end=None):
+    """
+    Recompute ``source``'s rollup rows from the source table, optionally
+    for days start..end only. Returns the number of rows that were wrong.
+    """
+    from .models import DailyRollup
+
+    lookup = f'{source.date_field}__date' if source.is_datetime else source.date_field
+    rows = source.model.objects.order_by()
+    if start is not None:
+        rows = rows.filter(**{f'{lookup}__gte': start})
+    if end is not None:
+        rows = rows.filter(**{f'{lookup}__lte': end})
+    aggregates = {'count': Count('pk')}
+    if source.amount:
+        aggregates['amount'] = Sum(source.amount)
+    day = TruncDate(source.date_field) if source.is_datetime else F(source.date_field)
+    expected = {
+        (row['day'], DIMENSION_SEPARATOR.join(str(row[name]) for name in source.dimensions)):
+            (row['count'], Decimal(row.get('amount') or 0))
+        for row in rows.annotate(day=day).values('day', *source.dimensions).annotate(**aggregates)
+        if row['day'] is not None
+    }
+
+    existing = DailyRollup.objects.filter(metric=source.metric)
+    if start is not None:
+        existing = existing.filter(date__gte=start)
+    if end is not None:
+        existing = existing.filter(date__lte=end)
+    with transaction.atomic():
+        current = {(row.date, row.dimension): row for row in existing.select_for_update()}
+        # Rows decremented to zero are dropped too, but are not wrong
+        zero = (0, Decimal(0))
+        changed = [
+            key for key in current.keys() | expected.keys()
+            if key not in current or (current[key].count, current[key].amount) != expected.get(key, zero)
+        ]
+        repaired = [key for key in changed if key in expected or (current[key].count, current[key].amount) != zero]
+        DailyRollup.objects.filter(pk__in=[current[key].pk for key in changed if key in current]).delete()
+        DailyRollup.objects.bulk_create([
+            DailyRollup(date=key[0], metric=source.metric, dimension=key[1],
+                        count=expected[key][0], amount=expected[key][1])
+            for key in changed if key in expected
+        ])
+    return len(repaired)
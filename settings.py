@@ -174,6 +174,72 @@ import os
 RAZORPAY_KEY_ID = os.environ.get('RAZORPAY_KEY_ID', 'rzp_test_jLDfilVuZu0Q7y')
 RAZORPAY_KEY_SECRET = os.environ.get('RAZORPAY_KEY_SECRET', 'gFMEW8mjY4yfNBVe90fA15vB')
 
+# Meal recommendation cache (meals/recommender.py)
+RECOMMENDER_CACHE = {
+    'MAX_ENTRIES': 2048,
+    'TTL': 600,  # Seconds
+    'CALORIE_BUCKET': 0,  # kcal per bucket; 0 keys on the exact target
+    'CHECK_INTERVAL': 30,  # Seconds between meal CSV/model file checks
+    'ALIAS': None,  # Django cache alias to share entries across workers
+}
+
+# Health prediction cache (health/ml_model.py); entries are keyed by the
+# model version, so retraining invalidates them
+HEALTH_PREDICTION_CACHE = {
+    'MAX_ENTRIES': 4096,
+    'TTL': 3600,  # Seconds
+    'ALIAS': None,  # Django cache alias to share entries across workers
+}
+
+# Model registry (health/model_registry.py): seconds between artifact checks,
+# and versions to serve instead of the latest, e.g. {'meal_classifier': '<version>'}
+MODEL_REGISTRY = {
+    'CHECK_INTERVAL': 30,
+    'PINS': {},
+}
+
+# Admin index dashboard (nutrilogic/admin_dashboard.py): default and longest
+# trend chart ranges in days (?days= or ?start=&end= pick another range), and
+# whether to read the daily rollups; fill them with `manage.py rebuild_rollups`
+# before turning this on, they only count saves made after the upgrade
+ADMIN_DASHBOARD = {
+    'TREND_DAYS': 7,
+    'MAX_TREND_DAYS': 366,
+    'ROLLUPS': False,
+    # Compute the widgets before rendering the index. True renders it without
+    # data, for a template that loads each widget from /admin/dashboard/<widget>/
+    'ASYNC_CHARTS': False,
+    # Widget cache: fresh seconds per widget (default CACHE_TTL), then served
+    # stale for up to STALE_TTL while one request recomputes it
+    'CACHE_ALIAS': 'default',
+    'CACHE_TTL': 300,
+    'WIDGET_TTL': {'stats': 60},
+    'STALE_TTL': 86400,
+    'LOCK_TIMEOUT': 30,
+}
+
+# Admin changelists over large tables (users.paginators): counts at or above
+# ESTIMATE_THRESHOLD come from database statistics, smaller ones are exact
+# and cached; pages from KEYSET_MIN_PAGE on are sought by primary key from
+# a cached page boundary up to KEYSET_LOOKBACK pages back
+ADMIN_PAGINATION = {
+    'CACHE_ALIAS': 'default',
+    'COUNT_CACHE_TTL': 300,
+    'ESTIMATE_THRESHOLD': 100000,
+    'KEYSET_MIN_PAGE': 5,
+    'KEYSET_LOOKBACK': 20,
+    'BOUNDARY_CACHE_TTL': 600,
+}
+
+# Streaming CSV/JSONL exports (users.exports): rows fetched and encoded per chunk
+DATA_EXPORTS = {
+    'CHUNK_SIZE': 2000,
+}
+
+# Food store directory written by `manage.py ingest_foods`; when set, meal
+# recommendations are ranked from it instead of the meal CSV
+MEAL_FOOD_STORE = None
+
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [
@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.contrib.auth.models import User
 from django.dispatch import receiver
 from .models import Profile
+from .rollups import ROLLUP_SOURCES, track
 
 
 @receiver(post_save, sender=User)
@@ -19,3 +20,13 @@ def save_profile(sender, instance, created, **kwargs):
         # Don't call save() to avoid infinite recursion
         # The profile will be saved directly from the form
         pass
+
+
+# Daily dashboard rollups follow every save/delete of the counted models
+for source in ROLLUP_SOURCES:
+    before_save, saved, before_delete, deleted = track(source)
+    pre_save.connect(before_save, sender=source.model_label, weak=False, dispatch_uid=f'rollup-pre-save-{source.metric}')
+    post_save.connect(saved, sender=source.model_label, weak=False, dispatch_uid=f'rollup-save-{source.metric}')
+    pre_delete.connect(before_delete, sender=source.model_label, weak=False,
+                       dispatch_uid=f'rollup-pre-delete-{source.metric}')
+    post_delete.connect(deleted, sender=source.model_label, weak=False, dispatch_uid=f'rollup-delete-{source.metric}')
@@ -1,3 +1,915 @@
-from django.test import TestCase
+import gzip
+import itertools
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models.signals import post_init
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from health.flat_forest import FlatForest, load_if_current
+from health.ml_model import (
+    CONDITIONS, DEMO_SEED, HealthPredictor, artifact_version, compact_model_path, create_demo_model, model_path,
+    feature_matrix, prediction_cache, predictor,
+)
+from health.model_registry import RegisteredModel
+from health.models import HealthPrediction
+from meals.meal_store import (
+    COLUMN_RENAMES, FoodStoreWriter, NameTable, load_food_store, load_meal_table, load_nutrient_arrays,
+    read_meals_csv, save_meal_table, save_nutrient_arrays,
+)
+from meals.recommender import (
+    MEAL_MODEL, MEAL_MODEL_COMPACT, MEALS_CSV, MealRecommender, NutrientIndex, _load_registered_classifier, data_path,
+    load_meal_classifier, save_meal_classifier, train_meal_classifier, versioned_classifier_path,
+)
+from nutrilogic import admin_dashboard
+from nutrilogic.admin_dashboard import LiveDashboardData, RollupDashboardData, cached_widgets, dashboard_data, date_range
+from nutrilogic.caching import LRUCache
+
+from .exports import EXPORT_SOURCES, stream
+from .models import DailyRollup, Profile
+from . import paginators
+from .paginators import CACHE_ALIAS, KeysetPaginator
 
 # Create your tests here.
+
+
+class FlatForestTests(SimpleTestCase):
+    """The exported node arrays must reproduce sklearn's predict_proba exactly"""
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # Inside and well outside the [0, 1) training range
+        self.features = np.vstack([rng.rand(500, 5), rng.normal(0.5, 1.0, (200, 5))])
+
+    def test_health_models_match_sklearn(self):
+        models = [create_demo_model(condition) for condition in CONDITIONS]
+        flat = FlatForest.from_sklearn(*models)
+
+        for model, proba in zip(models, flat.predict_proba_all(self.features)):
+            np.testing.assert_array_equal(proba, model.predict_proba(self.features))
+
+    def test_single_row_matches_sklearn(self):
+        models = [create_demo_model(condition) for condition in CONDITIONS]
+        flat = FlatForest.from_sklearn(*models)
+
+        for row in self.features[:50]:
+            row = row.reshape(1, -1)
+            for model, proba in zip(models, flat.predict_proba_all(row)):
+                np.testing.assert_array_equal(proba, model.predict_proba(row))
+
+    def test_meal_classifier_matches_sklearn(self):
+        rng = np.random.RandomState(1)
+        meals = pd.DataFrame({
+            'Calories': rng.gamma(2.5, 120, 2000).round(1),
+            'Protein': rng.gamma(2.0, 6, 2000).round(1),
+            'Fat': rng.gamma(2.0, 7, 2000).round(1),
+            'Carbs': rng.gamma(2.0, 18, 2000).round(1),
+        })
+        model, _ = train_meal_classifier(meals, n_estimators=20)
+        flat = FlatForest.from_sklearn(model)
+
+        np.testing.assert_array_equal(flat.predict_proba(meals), model.predict_proba(meals))
+        np.testing.assert_array_equal(flat.predict(meals), model.predict(meals))
+
+    def test_missing_values_match_sklearn(self):
+        models = [create_demo_model(condition) for condition in CONDITIONS]
+        flat = FlatForest.from_sklearn(*models)
+        features = self.features[:200].copy()
+        rng = np.random.RandomState(2)
+        features[rng.rand(*features.shape) < 0.3] = np.nan
+        features[0] = np.nan
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'health.forest')
+            flat.save(path)
+            for forest in (flat, FlatForest.load(path)):
+                for model, proba, row_proba in zip(
+                    models, forest.predict_proba_all(features), forest.predict_proba_all(features[:1]),
+                ):
+                    np.testing.assert_array_equal(proba, model.predict_proba(features))
+                    np.testing.assert_array_equal(row_proba, model.predict_proba(features[:1]))
+
+
+class LRUCacheTests(SimpleTestCase):
+    """LRUCache bounds, expiry and counters, locally and in a shared cache alias"""
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        stats = cache.stats()
+        self.assertEqual((stats['size'], stats['evictions'], stats['hits'], stats['misses']), (2, 1, 3, 1))
+
+    def test_entries_expire_and_versions_scope_them(self):
+        cache = LRUCache(ttl=60)
+        cache.set('a', 1)
+        with mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.expirations, 1)
+
+        cache.set('b', 2)
+        cache.set_version('v2')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['version'], 'v2')
+
+    def test_shared_alias_counts_evictions_and_expirations(self):
+        cache = LRUCache(ttl=0.05, alias='default', namespace='test')
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # The backend dropping an entry before its TTL is an eviction
+        caches['default'].delete(cache._shared_key('b'))
+        self.assertIsNone(cache.get('b'))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        # A key never written here is a plain miss
+        self.assertIsNone(cache.get('c'))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 3))
+        self.assertEqual((stats['evictions'], stats['expirations']), (1, 1))
+
+        # Entries dropped by clear() or a version change are neither
+        cache.set('d', 4)
+        cache.clear()
+        cache.set('e', 5)
+        cache.set_version('v2')
+        self.assertIsNone(cache.get('d'))
+        self.assertIsNone(cache.get('e'))
+        self.assertEqual((cache.evictions, cache.expirations), (1, 1))
+
+
+class HealthPredictorTests(SimpleTestCase):
+    """Predictions are memoized per model version and feature vector"""
+
+    user = {'age': 45, 'bmi': 31.0, 'activity_level': 0.2, 'diet_score': 0.4, 'calorie_ratio': 1.3}
+
+    def setUp(self):
+        prediction_cache.clear()
+        prediction_cache.reset_stats()
+
+    def test_repeat_predictions_are_cached(self):
+        first = predictor.predict(self.user)
+        self.assertEqual(set(first), set(CONDITIONS))
+        second = predictor.predict(self.user)
+        self.assertEqual(second, first)
+        self.assertEqual((prediction_cache.hits, prediction_cache.misses), (1, 1))
+        self.assertEqual(prediction_cache.version, predictor.version)
+
+        # Callers get copies of the cached entry
+        second['obesity'] = None
+        self.assertEqual(predictor.predict(self.user), first)
+
+    def test_predict_many_matches_per_row_predictions(self):
+        rng = np.random.RandomState(5)
+        # More rows than FLAT_MAX_ROWS, so the batch runs sklearn's predict_proba
+        ages, bmis = rng.randint(18, 80, 600).tolist(), rng.uniform(16, 42, 600).tolist()
+        rows = [
+            {'age': age, 'bmi': bmi, 'activity_level': activity, 'diet_score': diet, 'calorie_ratio': ratio}
+            for age, bmi, activity, diet, ratio in zip(ages, bmis, *rng.rand(3, 600).tolist())
+        ]
+        batch = predictor.predict_many(rows, use_cache=False)
+        self.assertEqual(predictor.predict_many(feature_matrix(rows), use_cache=False), batch)
+        for row, expected in zip(rows[:50], batch):
+            result = predictor.predict(row)
+            self.assertEqual([result[c][0] for c in CONDITIONS], [expected[c][0] for c in CONDITIONS])
+            np.testing.assert_allclose([result[c][1] for c in CONDITIONS], [expected[c][1] for c in CONDITIONS])
+
+    def test_trained_artifacts_are_seeded_and_preferred(self):
+        with tempfile.TemporaryDirectory() as first_dir, tempfile.TemporaryDirectory() as second_dir:
+            for directory in (first_dir, second_dir):
+                call_command('train_health_models', output_dir=directory, samples=300, stdout=StringIO())
+            features = np.random.RandomState(0).rand(50, 5)
+            health = HealthPredictor()
+            self.assertFalse(health.loaded)
+            for condition in CONDITIONS:
+                path = model_path(condition, first_dir)
+                model, version = health._get_model(condition, path, compact_model_path(condition, first_dir))
+                self.assertEqual(version, artifact_version(path))
+                same_seed, _ = health._get_model(
+                    condition, model_path(condition, second_dir), compact_model_path(condition, second_dir)
+                )
+                np.testing.assert_array_equal(model.predict_proba(features), same_seed.predict_proba(features))
+
+            # No artifact: the seeded demo model
+            missing = os.path.join(first_dir, 'missing')
+            with self.assertLogs('health.ml_model', 'WARNING'):
+                _, version = health._get_model(
+                    'obesity', model_path('obesity', missing), compact_model_path('obesity', missing)
+                )
+            self.assertEqual(version, f'demo-{DEMO_SEED}')
+
+
+class MealStoreTests(SimpleTestCase):
+    """Binary meal tables, nutrient indexes and food stores load back what was written"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.source = os.path.join(self.dir, 'meals.csv')
+        pd.DataFrame({
+            'Dish Name': ['Dal', 'Tea', None, 'Dal', 'Ωmega rice', 'Tea'],
+            'Calories (kcal)': [320.0, 5.0, 150.0, 320.0, 410.0, 60.0],
+            'Protein (g)': [18.0, 0.1, 4.0, 18.0, 9.0, 1.0],
+            'Fats (g)': [9.0, 0.0, 5.0, 9.0, 3.5, 2.0],
+            'Carbohydrates (g)': [40.0, 1.0, 20.0, 40.0, 80.0, 8.0],
+        }).to_csv(self.source, index=False)
+        self.meals = read_meals_csv(self.source)
+
+    def test_table_round_trip(self):
+        path = os.path.join(self.dir, 'meals.npz')
+        save_meal_table(self.meals, path, self.source)
+        pd.testing.assert_frame_equal(load_meal_table(path, self.source), self.meals)
+
+        # A different CSV makes the table stale
+        self.meals.head(2).to_csv(self.source, index=False)
+        self.assertIsNone(load_meal_table(path, self.source))
+
+    def test_unreadable_table_is_logged_and_ignored(self):
+        path = os.path.join(self.dir, 'meals.npz')
+        save_meal_table(self.meals, path, self.source)
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        with self.assertLogs('meals.meal_store', 'WARNING'):
+            self.assertIsNone(load_meal_table(path, self.source))
+
+    def test_nutrient_index_maps_interned_names(self):
+        index = NutrientIndex(self.meals)
+        directory = os.path.join(self.dir, 'index')
+        save_nutrient_arrays(index.arrays(), directory, self.source)
+        mapped = NutrientIndex.from_arrays(load_nutrient_arrays(directory, self.source))
+
+        np.testing.assert_array_equal(mapped.calories, index.calories)
+        self.assertEqual([str(mapped.name(i)) for i in range(6)], [str(index.name(i)) for i in range(6)])
+        self.assertIsInstance(mapped.names, NameTable)
+        self.assertEqual(len(np.unique(mapped.names.codes[mapped.names.codes >= 0])), 3)
+
+        # A damaged file is logged and the index ignored (replaced, as the old one is still mapped)
+        os.remove(os.path.join(directory, 'calories.npy'))
+        with open(os.path.join(directory, 'calories.npy'), 'wb') as f:
+            f.write(b'truncated')
+        with self.assertLogs('meals.meal_store', 'WARNING'):
+            self.assertIsNone(load_nutrient_arrays(directory, self.source))
+
+    def test_food_store_drops_duplicates(self):
+        writer = FoodStoreWriter(os.path.join(self.dir, 'store'))
+        writer.add_source(self.source)
+        for chunk in pd.read_csv(self.source, chunksize=4):
+            writer.append(chunk.rename(columns=COLUMN_RENAMES))
+        meta = writer.finish()
+
+        store = load_food_store(os.path.join(self.dir, 'store'))
+        self.assertEqual((meta['rows'], meta['duplicates']), (5, 1))
+        np.testing.assert_array_equal(store['calories'], [5, 60, 150, 320, 410])
+        self.assertEqual([str(store['names'][i]) for i in range(5)], ['Tea', 'Tea', 'nan', 'Dal', 'Ωmega rice'])
+
+
+def baseline_recommendations(meals_data, user_data, num_recommendations=15):
+    """The original DataFrame ranking, with exact ties kept in dataset order"""
+    age, gender, height, weight = user_data['age'], user_data['gender'], user_data['height'], user_data['weight']
+    goal = user_data.get('goal', 'M')
+    bmi_category = MealRecommender.calculate_bmi_category(height, weight)
+    if gender == 'Male':
+        bmr = 88.362 + (13.397 * weight) + (4.799 * height) - (5.677 * age)
+    else:
+        bmr = 447.593 + (9.247 * weight) + (3.098 * height) - (4.330 * age)
+    tdee = bmr * {'S': 1.2, 'L': 1.375, 'M': 1.55, 'V': 1.725, 'E': 1.9}.get(user_data.get('activity_level', 'M'), 1.2)
+    if bmi_category == 'Underweight' or goal == 'G':
+        target_calories, max_fat, max_carbs = tdee * 1.15, 100, 300
+    elif bmi_category == 'Obese' or bmi_category == 'Overweight' or goal == 'L':
+        target_calories, max_fat, max_carbs = tdee * 0.75, 30, 80
+    else:
+        target_calories, max_fat, max_carbs = tdee, 50, 130
+
+    calorie_range = target_calories * 0.3
+    meals = meals_data[
+        (meals_data['Calories'] >= calorie_range * 0.4) & (meals_data['Calories'] <= calorie_range * 1.2)
+    ].copy()
+    if bmi_category in ['Obese', 'Overweight'] or goal == 'L':
+        meals = meals[(meals['Fat'] <= max_fat) & (meals['Carbs'] <= max_carbs) & (meals['Protein'] >= 10)].copy()
+        meals['health_score'] = (
+            meals['Fat'] * 3.0 + meals['Carbs'] * 2.0 - meals['Protein'] * 5.0
+            + abs(meals['Calories'] - calorie_range) * 0.1
+        )
+    else:
+        meals = meals[(meals['Fat'] <= max_fat) & (meals['Carbs'] <= max_carbs) & (meals['Protein'] >= 8)].copy()
+        meals['health_score'] = (
+            meals['Fat'] * 1.5 + meals['Carbs'] * 1.0 - meals['Protein'] * 3.0
+            + abs(meals['Calories'] - calorie_range) * 0.2
+        )
+    # The original sorted with pandas' default (unstable) quicksort first
+    meals = meals.sort_values('health_score', kind='stable')
+    if not meals.empty:
+        meals['protein_ratio'] = (meals['Protein'] / meals['Calories']) * 100
+        meals = meals.sort_values(['health_score', 'protein_ratio'], ascending=[True, False])
+
+    return [
+        {
+            'name': meal['Dish Name'], 'calories': int(meal['Calories']), 'protein': float(meal['Protein']),
+            'carbs': float(meal['Carbs']), 'fat': float(meal['Fat']), 'bmi_category': bmi_category,
+            'target_calories': int(target_calories), 'goal': goal, 'max_fat': max_fat, 'max_carbs': max_carbs,
+        }
+        for _, meal in meals.head(num_recommendations).iterrows()
+    ]
+
+
+def synthetic_meals(n_meals=600, n_duplicates=200, seed=3):
+    """Meal table whose last ``n_duplicates`` dishes repeat earlier nutrients exactly"""
+    rng = np.random.RandomState(seed)
+    meals = pd.DataFrame({
+        'Dish Name': [f'Dish {i}' for i in range(n_meals)],
+        'Calories': rng.gamma(2.5, 120, n_meals).round(0) + 20,
+        'Protein': rng.gamma(2.0, 8, n_meals).round(1),
+        'Fat': rng.gamma(2.0, 6, n_meals).round(1),
+        'Carbs': rng.gamma(2.0, 15, n_meals).round(1),
+    })
+    copies = meals.sample(n_duplicates, random_state=seed).reset_index(drop=True)
+    copies['Dish Name'] = [f'Copy {i}' for i in range(n_duplicates)]
+    return pd.concat([meals, copies], ignore_index=True)
+
+
+def synthetic_profiles(n_profiles=150, seed=4):
+    rng = np.random.RandomState(seed)
+    return [
+        {
+            'age': int(rng.randint(18, 75)),
+            'gender': ['Male', 'Female'][rng.randint(2)],
+            'height': float(rng.randint(150, 196)),
+            'weight': float(rng.randint(42, 131)),
+            'goal': 'LMG'[rng.randint(3)],
+            'activity_level': 'SLMVE'[rng.randint(5)],
+        }
+        for _ in range(n_profiles)
+    ]
+
+
+class RecommenderTests(SimpleTestCase):
+    """Rankings match the original implementation; meals tied exactly come in dataset order"""
+
+    def setUp(self):
+        self.meals = synthetic_meals()
+        self.recommender = MealRecommender.from_dataframe(self.meals)
+        self.profiles = synthetic_profiles()
+
+    def test_matches_original_ranking(self):
+        for user_data in self.profiles:
+            self.assertEqual(
+                self.recommender.get_recommendations(user_data),
+                baseline_recommendations(self.meals, user_data),
+            )
+
+    def test_partial_selection_matches_a_full_sort(self):
+        for calorie_range in (150.0, 300.0, 420.0, 700.0):
+            for max_fat, max_carbs, weight_loss in ((30, 80, True), (50, 130, False), (100, 300, False)):
+                ranked = self.recommender.rank_meals(calorie_range, max_fat, max_carbs, weight_loss)
+                for limit in (1, 15, len(ranked) + 5):
+                    np.testing.assert_array_equal(
+                        self.recommender.rank_meals(calorie_range, max_fat, max_carbs, weight_loss, limit=limit),
+                        ranked[:limit],
+                    )
+
+    def test_batch_matches_single_profiles(self):
+        expected = [self.recommender.get_recommendations(user_data) for user_data in self.profiles]
+        self.assertEqual(self.recommender.get_recommendations_batch(self.profiles), expected)
+        # Chunks and score blocks of a few users each
+        self.assertEqual(
+            self.recommender.get_recommendations_batch(self.profiles, chunk_size=7, max_cells=2000),
+            expected,
+        )
+
+
+class MealDataFilesTests(SimpleTestCase):
+    """The recommender reads the preprocessed meal files while they match the CSV"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(BASE_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.csv_path = data_path(MEALS_CSV)
+        os.makedirs(os.path.dirname(self.csv_path))
+        raw_headers = {name: header for header, name in COLUMN_RENAMES.items()}
+        synthetic_meals(300, 50).rename(columns=raw_headers).to_csv(self.csv_path, index=False)
+        self.meals = read_meals_csv(self.csv_path)
+
+    def test_fresh_table_replaces_the_csv(self):
+        call_command('build_meal_table', stdout=StringIO())
+        with mock.patch('meals.recommender.read_meals_csv', side_effect=AssertionError('parsed the CSV')):
+            pd.testing.assert_frame_equal(MealRecommender.read_meals_data(), self.meals)
+
+        # Editing the CSV makes the table stale
+        with open(self.csv_path, 'a') as f:
+            f.write('Extra dish,100,5,2,10\n')
+        self.assertEqual(len(MealRecommender.read_meals_data()), len(self.meals) + 1)
+
+    def test_recommender_ranks_from_the_mapped_index(self):
+        call_command('build_meal_table', stdout=StringIO())
+        with mock.patch.object(MealRecommender, 'load_model'):
+            recommender = MealRecommender()
+        self.assertIsNone(recommender._meals_data)
+        self.assertIsInstance(recommender.index.calories, np.memmap)
+        self.assertIsInstance(recommender.index.names, NameTable)
+
+        in_memory = MealRecommender.from_dataframe(self.meals)
+        for user_data in synthetic_profiles(20):
+            self.assertEqual(recommender.get_recommendations(user_data), in_memory.get_recommendations(user_data))
+
+    def test_published_classifiers_hot_swap_and_pin(self):
+        call_command('train_meal_classifier', n_estimators=5, stdout=StringIO())
+        model_file = data_path(MEAL_MODEL)
+        model, metadata = load_meal_classifier(model_file)
+        self.assertTrue(os.path.exists(versioned_classifier_path(metadata['version'])))
+
+        entry = RegisteredModel('meal-classifier-test', [model_file], _load_registered_classifier,
+                                versioned_path=versioned_classifier_path)
+        self.assertEqual(entry.get().version, metadata['version'])
+
+        save_meal_classifier(model, model_file, {**metadata, 'version': 'retrained'})
+        entry.check(force=True)
+        deadline = time.monotonic() + 5
+        while entry.loading and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(entry.get().version, 'retrained')
+
+        # Versions kept on disk can be pinned by a worker that never loaded them
+        fresh = RegisteredModel('meal-classifier-pin', [model_file], _load_registered_classifier,
+                                versioned_path=versioned_classifier_path)
+        self.assertEqual(fresh.pin(metadata['version']).version, metadata['version'])
+        self.assertEqual(fresh.get().model['metadata']['version'], metadata['version'])
+
+    def test_corrupt_compact_classifier_falls_back_to_the_pickle(self):
+        call_command('train_meal_classifier', n_estimators=5, stdout=StringIO())
+        with open(data_path(MEAL_MODEL_COMPACT), 'wb') as f:
+            f.write(b'truncated')
+
+        entry = RegisteredModel('meal-classifier-corrupt', [data_path(MEAL_MODEL), data_path(MEAL_MODEL_COMPACT)],
+                                _load_registered_classifier)
+        with self.assertLogs('meals.recommender', 'ERROR'):
+            loaded = entry.get()
+        self.assertIsNone(entry.error)
+        self.assertIsInstance(loaded.model['model'], RandomForestClassifier)
+
+
+class MealPlanTests(SimpleTestCase):
+    """Meal plans are the best-scoring combinations that fit the calorie target"""
+
+    def setUp(self):
+        self.recommender = MealRecommender.from_dataframe(synthetic_meals())
+        self.user = {'age': 34, 'gender': 'Female', 'height': 165.0, 'weight': 60.0, 'goal': 'M', 'activity_level': 'L'}
+
+    def test_plan_is_optimal_over_its_pool(self):
+        plan = self.recommender.get_meal_plan(self.user, meals_per_day=3, pool_size=30, tolerance=0.1, time_budget=30)
+        self.assertTrue(plan['optimal'])
+
+        # Brute force over the same pool of dishes
+        targets = self.recommender.calculate_targets(self.user)
+        calorie_range = targets['target_calories'] / 3
+        pool = self.recommender.rank_meals(
+            calorie_range, targets['max_fat'], targets['max_carbs'], targets['weight_loss'], limit=30
+        )
+        scores = self.recommender.score_meals(pool, calorie_range, targets['weight_loss'])
+        calories = self.recommender.index.calories[pool]
+        low, high = targets['target_calories'] * 0.9, targets['target_calories'] * 1.1
+        best = min(
+            scores[list(combination)].sum()
+            for combination in itertools.combinations(range(len(pool)), 3)
+            if low <= calories[list(combination)].sum() <= high
+        )
+        day = plan['days'][0]
+        self.assertAlmostEqual(day['health_score'], best)
+        self.assertTrue(low <= day['calories'] <= high)
+
+    def test_days_do_not_repeat_dishes_and_unfit_days_are_none(self):
+        plan = self.recommender.get_meal_plan(self.user, meals_per_day=3, days=3, pool_size=30)
+        names = [meal['name'] for day in plan['days'] for meal in day['meals']]
+        self.assertEqual((len(plan['days']), len(names)), (3, len(set(names))))
+
+        plan = self.recommender.get_meal_plan(self.user, meals_per_day=3, days=2, tolerance=0)
+        self.assertEqual(plan['days'], [None, None])
+
+
+class SimilarDishesTests(SimpleTestCase):
+    """similar_dishes returns the nearest dishes in standardized macro space"""
+
+    def setUp(self):
+        self.meals = synthetic_meals()
+        self.recommender = MealRecommender.from_dataframe(self.meals)
+        nutrients = self.meals[['Calories', 'Protein', 'Fat', 'Carbs']].to_numpy(dtype=float)
+        self.points = (nutrients - nutrients.mean(axis=0)) / nutrients.std(axis=0)
+
+    def test_matches_brute_force_neighbours(self):
+        for row in (0, 17, 250):
+            name = self.meals['Dish Name'][row]
+            distances = np.sqrt(((self.points - self.points[row]) ** 2).sum(axis=1))
+            distances[row] = np.inf
+            similar = self.recommender.similar_dishes(name, k=5)
+            self.assertNotIn(name, [dish['name'] for dish in similar])
+            np.testing.assert_allclose([dish['distance'] for dish in similar], np.sort(distances)[:5])
+
+    def test_user_rules_and_unknown_dishes(self):
+        user_data = {'age': 50, 'gender': 'Male', 'height': 175.0, 'weight': 105.0, 'goal': 'L', 'activity_level': 'S'}
+        targets = self.recommender.calculate_targets(user_data)
+        similar = self.recommender.similar_dishes('Dish 3', k=10, user_data=user_data)
+        self.assertEqual(len(similar), 10)
+        for dish in similar:
+            self.assertTrue(dish['fat'] <= targets['max_fat'] and dish['carbs'] <= targets['max_carbs'])
+            self.assertGreaterEqual(dish['protein'], 10)
+        self.assertEqual(self.recommender.similar_dishes('No such dish'), [])
+
+
+class CompactExportTests(SimpleTestCase):
+    """export_compact_models publishes exact .forest files, and nothing when predictions drift"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(BASE_DIR=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('train_health_models', samples=300, stdout=StringIO())
+        self.directory = os.path.dirname(model_path('obesity'))
+
+    def export(self, **options):
+        call_command('export_compact_models', only='health', samples=500, stdout=StringIO(), **options)
+
+    def test_round_trip_matches_the_originals(self):
+        self.export()
+        X = np.random.RandomState(1).uniform(-0.2, 1.5, size=(200, 5))
+        for condition in CONDITIONS:
+            compact = load_if_current(compact_model_path(condition), model_path(condition))
+            self.assertIsNotNone(compact)
+            original = joblib.load(model_path(condition))
+            np.testing.assert_array_equal(compact.predict_proba(X), original.predict_proba(X))
+
+        # Retraining makes the exports stale until they are exported again
+        call_command('train_health_models', seed=7, samples=300, stdout=StringIO())
+        self.assertIsNone(load_if_current(compact_model_path('obesity'), model_path('obesity')))
+
+    def test_drift_gate_publishes_nothing(self):
+        self.export()
+        with open(compact_model_path('obesity'), 'rb') as f:
+            published = f.read()
+
+        predict_proba = FlatForest.predict_proba
+        with mock.patch.object(FlatForest, 'predict_proba', lambda forest, X: predict_proba(forest, X)[:, ::-1]):
+            with self.assertRaisesMessage(CommandError, 'nothing was published'):
+                self.export(max_drift=0.01)
+
+        with open(compact_model_path('obesity'), 'rb') as f:
+            self.assertEqual(f.read(), published)
+        self.assertFalse([name for name in os.listdir(self.directory) if '.candidate-' in name])
+
+
+class ModelRegistryTests(SimpleTestCase):
+    """Serving versions load once, and a failed reload keeps the last good one"""
+
+    def test_concurrent_cold_start_waits_for_first_load(self):
+        loads = []
+
+        def slow_loader(paths):
+            loads.append(paths)
+            time.sleep(0.2)
+            return 'model', 'v1'
+
+        entry = RegisteredModel('cold-start', [], slow_loader)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            served = list(pool.map(lambda _: entry.get(), range(4)))
+
+        self.assertEqual([loaded.version for loaded in served], ['v1'] * 4)
+        self.assertEqual(len(loads), 1)
+
+    def test_reload_keeps_last_good_version_and_reports_it(self):
+        def loader(paths):
+            with open(paths[0]) as f:
+                content = f.read()
+            if content == 'broken':
+                raise ValueError('corrupt artifact')
+            return content.upper(), content
+
+        def publish(content):
+            with open(path, 'w') as f:
+                f.write(content)
+            entry.check(force=True)
+            deadline = time.monotonic() + 5
+            while entry.loading and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'model.bin')
+            with open(path, 'w') as f:
+                f.write('v1')
+            entry = RegisteredModel('reloads', [path], loader)
+            self.assertEqual(entry.get().version, 'v1')
+
+            publish('v22')
+            self.assertEqual((entry.get().model, entry.get().version), ('V22', 'v22'))
+
+            with self.assertLogs('health.model_registry', 'ERROR'):
+                publish('broken')
+            status = entry.status()
+            self.assertEqual(status['current']['version'], 'v22')
+            self.assertEqual(status['history'], ['v1'])
+            self.assertIn('corrupt artifact', status['error'])
+
+            self.assertEqual(entry.rollback().version, 'v1')
+            self.assertEqual(entry.status()['pinned'], 'v1')
+            self.assertEqual(entry.get().model, 'V1')
+
+
+class RescoreHealthRisksTests(TestCase):
+    """Bulk re-scoring writes the same predictions as the predictor, and resumes"""
+
+    def setUp(self):
+        for i in range(6):
+            user = User.objects.create_user(f'user{i}')
+            if i < 5:  # The last profile has no health details
+                Profile.objects.filter(user=user).update(
+                    age=25 + 9 * i, height=160 + 5 * i, weight=55 + 10 * i, activity_level='SLMVE'[i]
+                )
+        self.profiles = list(Profile.objects.filter(age__isnull=False).order_by('pk'))
+        HealthPrediction.objects.create(
+            user=self.profiles[0].user, condition_type='obesity', risk_level='L', prediction_score=0.1,
+            input_data={'diet_score': 0.2, 'calorie_ratio': 1.4},
+        )
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.checkpoint = os.path.join(tmp.name, 'checkpoint.json')
+
+    def rescore(self):
+        out = StringIO()
+        call_command('rescore_health_risks', workers=0, chunk_size=2, checkpoint=self.checkpoint, stdout=out)
+        return out.getvalue()
+
+    def test_predictions_match_the_predictor(self):
+        self.rescore()
+        predictions = list(HealthPrediction.objects.order_by('pk')[1:])
+        self.assertEqual(len(predictions), 5 * len(CONDITIONS))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        # The first profile's form inputs come from its latest prediction
+        inputs = [predictions[i].input_data for i in range(0, len(predictions), len(CONDITIONS))]
+        self.assertEqual((inputs[0]['diet_score'], inputs[0]['calorie_ratio']), (0.2, 1.4))
+        expected = predictor.predict_many(inputs, use_cache=False)
+        for i, prediction in enumerate(predictions):
+            level, score = expected[i // len(CONDITIONS)][prediction.condition_type]
+            self.assertEqual(prediction.user_id, self.profiles[i // len(CONDITIONS)].user_id)
+            self.assertEqual(prediction.risk_level, level)
+            self.assertAlmostEqual(prediction.prediction_score, score)
+
+    def test_resumes_after_checkpoint(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'last_pk': self.profiles[2].pk, 'rows': 3, 'model_version': predictor.version}, f)
+        output = self.rescore()
+
+        scored = HealthPrediction.objects.order_by('pk')[1:].values_list('user_id', flat=True)
+        self.assertEqual(sorted(set(scored)), [profile.user_id for profile in self.profiles[3:]])
+        self.assertIn('Re-scored 5 profiles', output)
+
+
+class AdminDashboardTests(TestCase):
+    """The dashboard costs a fixed number of queries whatever the date range"""
+
+    def setUp(self):
+        today = datetime(2024, 3, 10, 12, tzinfo=dt_timezone.utc)
+        # Rollups are applied on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, goal in enumerate(['L', 'L', 'M', 'G']):
+                user = User.objects.create_user(f'user{i}', date_joined=today - timedelta(days=i))
+                Profile.objects.filter(user=user).update(goal=goal)
+
+    def test_query_count_is_fixed(self):
+        for days in (7, 90):
+            with self.assertNumQueries(9):
+                dashboard_data(*date_range(days=days, end=date(2024, 3, 10)), data_class=LiveDashboardData)
+            with self.assertNumQueries(4):
+                dashboard_data(*date_range(days=days, end=date(2024, 3, 10)), data_class=RollupDashboardData)
+
+    def test_trends_and_distributions(self):
+        for data_class in (LiveDashboardData, RollupDashboardData):
+            stats, chart_data = dashboard_data(*date_range(days=7, end=date(2024, 3, 10)), data_class=data_class)
+
+            self.assertEqual(stats['total_users'], 4)
+            self.assertEqual(chart_data['user_trend_data']['labels'][-1], 'Mar 10')
+            self.assertEqual(chart_data['user_trend_data']['values'], [0, 0, 0, 1, 1, 1, 1])
+            goals = dict(zip(chart_data['goal_data']['labels'], chart_data['goal_data']['values']))
+            self.assertEqual(goals[dict(Profile.GOAL_CHOICES)['L']], 2)
+
+
+class DailyRollupTests(TestCase):
+    """Signals keep the rollups equal to what rebuild_rollups computes"""
+
+    def rollups(self):
+        return set(DailyRollup.objects.filter(count__gt=0).values_list('metric', 'date', 'dimension', 'count'))
+
+    def test_signals_match_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            users = [User.objects.create_user(f'user{i}') for i in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            users[0].date_joined -= timedelta(days=3)
+            users[0].save()
+            users[1].delete()
+        maintained = self.rollups()
+
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(maintained, self.rollups())
+        self.assertEqual(sum(count for metric, _, _, count in maintained if metric == 'users'), 2)
+
+    def test_loading_costs_nothing_and_updates_read_only_what_they_need(self):
+        self.assertFalse(post_init.has_listeners(User))
+        with self.captureOnCommitCallbacks(execute=True):
+            users = [User.objects.create_user(f'user{i}') for i in range(2)]
+
+        # Only saves that may change the date read the stored one
+        user = User.objects.get(pk=users[0].pk)
+        user.first_name = 'Asha'
+        for update_fields, reads in ((['first_name'], 0), (None, 1)):
+            with CaptureQueriesContext(connection) as queries:
+                user.save(update_fields=update_fields)
+            stored_reads = [query for query in queries if 'SELECT "auth_user"."date_joined"' in query['sql']]
+            self.assertEqual(len(stored_reads), reads)
+
+        # A deferred instance is counted by its stored date when deleted
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.only('username').get(pk=users[1].pk).delete()
+        maintained = self.rollups()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(maintained, self.rollups())
+        self.assertEqual(sum(count for metric, _, _, count in maintained if metric == 'users'), 1)
+
+    def test_counts_wait_for_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            User.objects.create_user('user')
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.rollups(), set())
+
+
+class DashboardCacheTests(TestCase):
+    """Widgets are computed once, served stale while locked and recomputed on refresh"""
+
+    def test_widgets_are_cached_until_refresh(self):
+        cache = caches[admin_dashboard.CACHE_ALIAS]
+        cache.clear()
+        dates = date_range(days=7, end=date(2024, 3, 10))
+
+        first = cached_widgets(*dates, data_class=RollupDashboardData)
+        with self.assertNumQueries(0):
+            again = cached_widgets(*dates, data_class=RollupDashboardData)
+        self.assertEqual(again['stats']['computed_at'], first['stats']['computed_at'])
+
+        # Another request holds the lock of an expired widget: serve it stale
+        key = admin_dashboard.widget_cache_key('stats', *dates)
+        cache.set(key, dict(cache.get(key), expires_at=0))
+        cache.add(f'{key}:lock', 1)
+        with self.assertNumQueries(0):
+            stale = cached_widgets(*dates, names=['stats'], data_class=RollupDashboardData)
+        self.assertTrue(stale['stats']['stale'])
+
+        cache.delete(f'{key}:lock')
+        refreshed = cached_widgets(*dates, refresh=True, data_class=RollupDashboardData)
+        self.assertGreater(refreshed['stats']['computed_at'], first['stats']['computed_at'])
+        self.assertFalse(refreshed['stats']['stale'])
+
+
+class DashboardChartViewTests(TestCase):
+    """Chart endpoints are staff-only JSON with conditional GET"""
+
+    def setUp(self):
+        caches[admin_dashboard.CACHE_ALIAS].clear()
+        self.url = reverse('admin:dashboard_chart', args=['user_trend_data'], current_app='nutrilogic_admin')
+
+    async def test_etag_and_not_modified(self):
+        staff = await User.objects.acreate_user('staff', is_staff=True)
+        await self.async_client.aforce_login(staff)
+
+        response = await self.async_client.get(self.url, {'days': 14})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']['values']), 14)
+
+        response = await self.async_client.get(self.url, {'days': 14}, headers={'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_staff_only(self):
+        user = await User.objects.acreate_user('user')
+        await self.async_client.aforce_login(user)
+
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_index_renders_chart_data_by_default(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+
+        response = self.client.get(reverse('admin:index', current_app='nutrilogic_admin'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('user_trend_data', response.context['chart_data'])
+        self.assertIn('total_users', response.context['stats'])
+
+
+class ProfilePaginatorTests(TestCase):
+    """Keyset pages must match OFFSET pages, and counts are cached"""
+
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        for i in range(60):
+            User.objects.create_user(f'user{i:02d}')
+        self.profiles = Profile.objects.order_by('-pk')
+
+    def test_keyset_pages_match_offset(self):
+        expected = list(self.profiles)
+        for number in (6, 7, 5, 12):
+            page = KeysetPaginator(self.profiles, 5).page(number)
+            self.assertEqual(list(page), expected[(number - 1) * 5:number * 5])
+
+        # The boundary of the next page was cached by the previous one
+        KeysetPaginator(self.profiles, 5).page(8)
+        with self.assertNumQueries(1):
+            KeysetPaginator(self.profiles, 5).page(9)
+
+    def test_boundaries_are_cached_per_page(self):
+        paginator = KeysetPaginator(self.profiles, 5)
+        page = paginator.page(8)
+        self.assertEqual(caches[CACHE_ALIAS].get(paginator._page_key(9)), page[-1].pk)
+        # With no boundary within the lookback the seek walks from page 1
+        with mock.patch.object(paginators, 'KEYSET_LOOKBACK', 2):
+            self.assertEqual(list(KeysetPaginator(self.profiles, 5).page(12)), list(self.profiles)[55:])
+
+    def test_pages_past_an_estimated_count_are_empty(self):
+        with mock.patch.object(paginators, 'estimated_count', return_value=200000):
+            paginator = KeysetPaginator(self.profiles, 5)
+            self.assertTrue(paginator.count >= 200000 and paginator.estimated)
+            # Past the 12 real pages, with and without a cached boundary to start from
+            self.assertEqual(list(paginator.page(20)), [])
+            paginator.page(12)
+            self.assertEqual(list(paginator.page(13)), [])
+            self.assertEqual(list(paginator.page(14)), [])
+
+    def test_count_is_cached(self):
+        self.assertEqual(KeysetPaginator(self.profiles, 5).count, 60)
+        with self.assertNumQueries(0):
+            self.assertEqual(KeysetPaginator(self.profiles, 5).count, 60)
+
+
+class ExportTests(TestCase):
+    """Exports stream every row once, and resume where they stopped"""
+
+    def setUp(self):
+        for i in range(25):
+            User.objects.create_user(f'user{i:02d}', date_joined=datetime(2024, 3, 1 + i % 5, 12, tzinfo=dt_timezone.utc))
+        self.source = EXPORT_SOURCES['profiles']
+
+    def test_stream_filters_by_date_and_gzips(self):
+        queryset = self.source.queryset(since=date(2024, 3, 2), until=date(2024, 3, 3))
+        data = gzip.decompress(b''.join(stream(self.source, 'jsonl', queryset, chunk_size=4, compress=True)))
+        rows = [json.loads(line) for line in data.decode().splitlines()]
+
+        self.assertEqual(len(rows), 10)
+        self.assertEqual([row['id'] for row in rows], sorted(row['id'] for row in rows))
+        self.assertTrue(all(row['date_joined'][:10] in ('2024-03-02', '2024-03-03') for row in rows))
+
+    def test_command_resumes_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'profiles.csv')
+            call_command('export_data', 'profiles', output=output, chunk_size=10, stdout=StringIO())
+            with open(output, 'rb') as f:
+                expected = f.read()
+
+            # A run stopped after its first chunk, with part of the next one written
+            lines = expected.splitlines(keepends=True)
+            with open(output, 'wb') as f:
+                f.write(b''.join(lines[:11]) + lines[11][:5])
+            with open(f'{output}.checkpoint', 'w') as f:
+                json.dump({
+                    'last_pk': int(lines[10].split(b',')[0]), 'rows': 10, 'offset': len(b''.join(lines[:11])),
+                    'export': {'source': 'profiles', 'format': 'csv', 'gzip': False, 'since': None, 'until': None},
+                }, f)
+
+            call_command('export_data', 'profiles', output=output, chunk_size=10, stdout=StringIO())
+            with open(output, 'rb') as f:
+                self.assertEqual(f.read(), expected)
+            self.assertFalse(os.path.exists(f'{output}.checkpoint'))